@@ -1,197 +1,114 @@
-import zipfile
-import struct
-import datetime
-
-# Detect the operating system and app that created it
-def detect_zip_origin(extra, file_list, zip_info_list, verbose=False):
-    characteristics = {
-        'Windows': 0,
-        'MacOS': 0,
-        'Ubuntu': 0,
-        'WinRAR': 0,
-        'WinZip': 0,
-        '7-zip': 0,
-        'Bandizip': 0,
-        'Compress': 0,
-        'zip': 0,
-    }
-
-    features = {
-        'NTFS_timestamp': False,
-        'nanoseconds_format': False,
-        'extended_timestamp': False,
-        'unix_uid_gid': False,
-        'unicode_path': False,
-        'root_folder_header': False,
-        'double_zipping': False,
-        'mac_folder': False,
-        'data_descriptor': False,
-    }
-
-    idx = 0
-    while idx < len(extra):
-        try:
-            header_id, data_size = struct.unpack('<HH', extra[idx:idx+4])
-            data = extra[idx+4:idx+4+data_size]
-
-            # Detect based on header_id
-            if header_id == 0x000A:  # NTFS timestamp (Windows)
-                characteristics['Windows'] += 3
-                features['NTFS_timestamp'] = True
-                if data.endswith(b'\xff\xff\xff\xff\xff\xff\xff\xff'):
-                    features['nanoseconds_format'] = True
-                    characteristics['Windows'] += 2
-
-            elif header_id == 0x5455:  # Extended timestamps (Unix-based)
-                characteristics['MacOS'] += 1
-                characteristics['Ubuntu'] += 1
-                features['extended_timestamp'] = True
-                if data_size == 0x13:
-                    characteristics['MacOS'] += 2  # Specific to macOS
-                    characteristics['Compress'] += 2
-                elif data_size == 0x09:
-                    characteristics['Unix/Linux'] += 2  # Common on Unix/Linux systems
-                if data_size in [0x09, 0x13]:
-                    characteristics['Unix/Linux'] += 1
-
-            elif header_id == 0x5855 or header_id == 0x7875:  # Unix UID/GID (Linux/MacOS)
-                characteristics['MacOS'] += 1
-                characteristics['Ubuntu'] += 1
-                features['unix_uid_gid'] = True
-
-            elif header_id == 0x7075:  # Unicode path extra field (WinRAR)
-                characteristics['WinRAR'] += 2
-                characteristics['Windows'] += 3
-                features['unicode_path'] = True
-
-            elif header_id == 0x50B4:  # WinZip specific header ID
-                characteristics['WinZip'] += 2
-                characteristics['Windows'] += 2
-
-            idx += 4 + data_size
-
-        except struct.error:
-            print("Error reading extra field data")
-            break
-
-    for zip_info in zip_info_list:
-        if zip_info.filename.startswith('__MACOSX'):
-            features['mac_folder'] = True
-            characteristics['MacOS'] += 3  # Strong indicator of macOS
-        elif zip_info.filename.lower() == 'thumbs.db':
-            characteristics['Windows'] += 2  # Indicator of Windows origin
-
-        if zip_info.compress_type == zipfile.ZIP_STORED:
-            features['double_zipping'] = True
-            characteristics['7-zip'] += 1  # 7-zip is more likely to store ZIP files without recompression
-
-        # Check for data descriptor (ZIP signature 0x08074b50 or 0x50 4B 07 08)
-        if zip_info.extra and zip_info.extra[:4] == b'\x50\x4B\x07\x08':
-            features['data_descriptor'] = True
-            characteristics['Compress'] += 2  # Likely Compress on macOS
-
-    root_folder = next((f for f in file_list if '/' in f and f.count('/') == 1), None)
-    if root_folder:
-        features['root_folder_header'] = True
-        characteristics['Ubuntu'] += 1
-        characteristics['Bandizip'] += 1  # Bandizip often includes root folder headers
-
-    # Determine probable origin based on scores
-    max_score = max(characteristics.values())
-    likely_OS_apps = [key for key, value in characteristics.items() if value == max_score]
-
+import metrics
+from extra_fields import read_extra_fields
+from archive import shared_archive
+from scoring import score_zip_origin
+from cache import cached_result
+
+def print_zip_origin(origin):
+    for warning in origin['warnings']:
+        print(warning)
+    likely_OS_apps = origin['origins']
     if len(likely_OS_apps) == 3:
         print("Unknown ZIP file origin")
     if len(likely_OS_apps) == 2:
         print(f"Likely ZIP file origins (tie): {', '.join(likely_OS_apps)}")
     else:
         print(f"Likely ZIP file origin: {likely_OS_apps[0]}")
-    print(f"Scores by characteristics: {characteristics}")
-    print(f"Detected Features: {features}")
+    print(f"Scores by characteristics: {origin['scores']}")
+    print(f"Detected Features: {origin['features']}")
+
+# Detect the operating system and app that created it
+def detect_zip_origin(zip_info_list, verbose=False):
+    origin = score_zip_origin(zip_info_list)
+    print_zip_origin(origin)
+    return origin
+
+# Decode the comment and the known extra fields of an entry
+def read_extra_info(zip_info):
+    comment = zip_info.comment.decode('utf-8', 'ignore') if zip_info.comment else None
+    # Timestamps, IDs and the rest from the shared decoders in extra_fields.py
+    fields = [field.report() for field in read_extra_fields(zip_info.extra)]
+    return {'comment': comment, 'extra_fields': fields}
+
+def print_extra_info(zip_info, extra_info=None):
+    if extra_info is None:
+        extra_info = read_extra_info(zip_info)
 
-def print_extra_info(zip_info):
     # File comment (if any)
-    if zip_info.comment:
-        print(f"Comment: {zip_info.comment.decode('utf-8', 'ignore')}")
+    if extra_info['comment'] is not None:
+        print(f"Comment: {extra_info['comment']}")
     else:
         print(f"Comment: None")
 
-    # Read Extra Field for additional timestamps and IDs
-    extra = zip_info.extra
-    idx = 0
-    created_date = modified_date = accessed_date = None
-    uid = gid = None
-
-    while idx < len(extra):
-        header_id, data_size = struct.unpack('<HH', extra[idx:idx+4])
-        data = extra[idx+4:idx+4+data_size]
-
-        if header_id == 0x000A:  # NTFS timestamps (Windows)
-            if data_size >= 24:
-                mod_time, cre_time, acc_time = struct.unpack('<QQQ', data[:24])
-                modified_date = datetime.datetime(1601, 1, 1) + datetime.timedelta(microseconds=mod_time // 10)
-                accessed_date = datetime.datetime(1601, 1, 1) + datetime.timedelta(microseconds=acc_time // 10)
-                created_date = datetime.datetime(1601, 1, 1) + datetime.timedelta(microseconds=cre_time // 10)
-            print(f"Created Date (NTFS): {created_date}")
-            print(f"Accessed Date (NTFS): {accessed_date}")
-            print(f"Modified Date (NTFS): {modified_date}")
-
-        elif header_id == 0x5455:  # Unix timestamps
-            if data_size >= 5:
-                info_bits = data[0]
-                offset = 1
-                if info_bits & 1:  # Modification time
-                    mod_time_unix = struct.unpack('<I', data[offset:offset+4])[0]
-                    modified_date = datetime.datetime.fromtimestamp(mod_time_unix)
-                    offset += 4
-                if info_bits & 2:  # Access time
-                    acc_time_unix = struct.unpack('<I', data[offset:offset+4])[0]
-                    accessed_date = datetime.datetime.fromtimestamp(acc_time_unix)
-                    offset += 4
-                if info_bits & 4:  # Creation time
-                    cre_time_unix = struct.unpack('<I', data[offset:offset+4])[0]
-                    created_date = datetime.datetime.fromtimestamp(cre_time_unix)
-            print(f"Created Date (Unix): {created_date}")
-            print(f"Accessed Date (Unix): {accessed_date}")
-            print(f"Modified Date (Unix): {modified_date}")
-
-        elif header_id == 0x7875:  # UNIX UID/GID
-            if data_size >= 6:
-                version, uid_size = struct.unpack('<BB', data[:2])
-                uid = int.from_bytes(data[2:2 + uid_size], 'little')
-                gid_size = data[2 + uid_size]
-                gid = int.from_bytes(data[3 + uid_size:3 + uid_size + gid_size], 'little')
-            print(f"UID: {uid}")
-            print(f"GID: {gid}")
-
-        idx += 4 + data_size
-
-# Analyze ZIP file and detect the operating system that created it
-def analyze_zip_file(file_path, verbose=False):
-    with zipfile.ZipFile(file_path, 'r') as zip_file:
-        print("\nAnalyzing ZIP file:", file_path)
-
-        overall_characteristics = {
-            'Windows': 0,
-            'MacOS': 0,
-            'Ubuntu': 0,
-            'WinRAR': 0,
-            'WinZip': 0,
-            '7-zip': 0,
-            'Bandizip': 0,
-            'Compress': 0,
-            'zip': 0,
-        }
-
-        for info in zip_file.infolist():
-            if verbose:
-                if info.filename.endswith('/'):
-                    print("\nFolder Name:", info.filename)
-                else:
-                    print("\nFile Name:", info.filename)
-                    print("Compressed Size:", info.compress_size)
-                    print("Uncompressed Size:", info.file_size)
-                print_extra_info(info)
+    for field in extra_info['extra_fields']:
+        if field['type'] in ('NTFS', 'Unix'):
+            print(f"Created Date ({field['type']}): {field['created']}")
+            print(f"Accessed Date ({field['type']}): {field['accessed']}")
+            print(f"Modified Date ({field['type']}): {field['modified']}")
+        elif field['type'] == 'UID/GID':
+            print(f"UID: {field['uid']}")
+            print(f"GID: {field['gid']}")
+        elif field['type'] == 'Info-ZIP Unix':
+            print(f"Accessed Date ({field['type']}): {field['accessed']}")
+            print(f"Modified Date ({field['type']}): {field['modified']}")
+            print(f"UID: {field['uid']}")
+            print(f"GID: {field['gid']}")
+        elif field['type'] == 'Unicode Path':
+            print(f"Unicode Path: {field['name']}")
+        elif field['type'] == 'ZIP64':
+            print(f"ZIP64 Extended Information: {field['values']}")
+
+# Names, sizes, comment and decoded extra fields of an entry, as listed by -a -v
+def read_entry_report(info):
+    return {
+        'name': info.filename,
+        'compressed_size': info.compress_size,
+        'uncompressed_size': info.file_size,
+        **read_extra_info(info),
+    }
 
-        print("\n-----Final Analysis:-----")
-        detect_zip_origin(info.extra, zip_file.namelist(), zip_file.infolist(), verbose)
+# Analyze ZIP file and detect the operating system that created it; returns the analysis.
+# With sharded (a parallel.ShardedArchive) the entries are analyzed on its worker processes.
+def read_zip_analysis(file_path, verbose=False, archive=None, cache=None, sharded=None):
+    if sharded is not None:
+        read = lambda: sharded.analyze_entries(verbose)
+    else:
+        read = lambda: analyze_entries(file_path, verbose, archive)
+    analysis = cached_result(cache, file_path, f"analysis:verbose={verbose:d}", read)
+    # A cached result may come from an identical archive under another name
+    analysis['file'] = file_path
+    return analysis
+
+def analyze_entries(file_path, verbose=False, archive=None):
+    with shared_archive(file_path, archive) as zip_file:
+        entries = []
+        if verbose:
+            with metrics.stage('extra_fields'):
+                for info in zip_file.infolist():
+                    entries.append(read_entry_report(info))
+            metrics.count('extra_fields_decoded', sum(len(entry['extra_fields']) for entry in entries))
+
+        with metrics.stage('scoring'):
+            origin = score_zip_origin(zip_file.infolist())
+        metrics.count('entries_scored', len(zip_file.infolist()))
+        return {'file': file_path, 'entries': entries, 'origin': origin}
+
+def print_zip_analysis(analysis):
+    print("\nAnalyzing ZIP file:", analysis['file'])
+    for entry in analysis['entries']:
+        if entry['name'].endswith('/'):
+            print("\nFolder Name:", entry['name'])
+        else:
+            print("\nFile Name:", entry['name'])
+            print("Compressed Size:", entry['compressed_size'])
+            print("Uncompressed Size:", entry['uncompressed_size'])
+        print_extra_info(None, entry)
+
+    print("\n-----Final Analysis:-----")
+    print_zip_origin(analysis['origin'])
+
+def analyze_zip_file(file_path, verbose=False, archive=None, cache=None, sharded=None):
+    analysis = read_zip_analysis(file_path, verbose, archive, cache, sharded)
+    with metrics.stage('output'):
+        print_zip_analysis(analysis)
+    return analysis
@@ -0,0 +1,192 @@
+import datetime
+import contextlib
+import metrics
+from byte_source import BUFFER_TYPES, open_source, close_source
+from zip_records import (CENTRAL_DIRECTORY_HEADER, CENTRAL_DIRECTORY_SIGNATURE, ZIP64_LIMIT,
+                         ZIP64_COUNT_LIMIT, locate_central_directory, read_central_directory_header,
+                         iter_extra_fields, unpack_zip64_extra, iter_zip_records, seek_zip_records)
+
+ZIP_STORED = 0
+UTF8_FLAG = 0x800
+
+class BadZipFile(Exception):
+    pass
+
+# One central directory entry holding its raw header fields. The names used by the
+# analyzers follow zipfile.ZipInfo (filename, compress_type, compress_size, file_size,
+# header_offset, extra, comment), with sizes and offsets already resolved from ZIP64.
+class ZipEntry:
+    __slots__ = ('offset', 'create_version', 'extract_version', 'flag_bits', 'compress_type',
+                 'mod_time', 'mod_date', 'CRC', 'compress_size', 'file_size', 'disk_start',
+                 'internal_attr', 'external_attr', 'header_offset', 'filename', 'extra',
+                 'comment', '_extra_fields')
+
+    def is_dir(self):
+        return self.filename.endswith('/')
+
+    # (header_id, data) pairs of the extra field, split on first use
+    @property
+    def extra_fields(self):
+        if self._extra_fields is None:
+            self._extra_fields = tuple(iter_extra_fields(self.extra))
+        return self._extra_fields
+
+    # The CentralDirectoryHeader record this entry was read from
+    def header(self, data):
+        return read_central_directory_header(data, self.offset)
+
+# Names are UTF-8 when flag bit 11 is set, cp437 otherwise, and end at a NUL
+def decode_filename(raw_name, flag_bits):
+    filename = raw_name.decode('utf-8' if flag_bits & UTF8_FLAG else 'cp437', errors='replace')
+    if '\x00' in filename:
+        filename = filename[:filename.find('\x00')]
+    return filename
+
+# Parse the central directory straight into ZipEntry objects. A source that is not a
+# buffer (a remote or unmapped file) is read with one request for the whole directory.
+def read_zip_entries(data, location):
+    entries = []
+    unpack_from = CENTRAL_DIRECTORY_HEADER.unpack_from
+    shift = 0
+    if not isinstance(data, BUFFER_TYPES):
+        shift = location.offset
+        data = data[location.offset:location.offset + location.size]
+    offset = location.offset - shift
+    end = offset + location.size
+    while offset < end:
+        if data[offset:offset + 4] != CENTRAL_DIRECTORY_SIGNATURE or offset + 46 > len(data):
+            raise BadZipFile(f"damaged central directory at offset {offset + shift}")
+        entry = ZipEntry()
+        (_, entry.create_version, entry.extract_version, flag_bits, entry.compress_type,
+         entry.mod_time, entry.mod_date, entry.CRC, compress_size, file_size, name_length,
+         extra_length, comment_length, disk_start, entry.internal_attr, entry.external_attr,
+         header_offset) = unpack_from(data, offset)
+        start = offset + 46
+        raw_name = data[start:start + name_length]
+        start += name_length
+        extra = data[start:start + extra_length]
+        start += extra_length
+        entry.comment = data[start:start + comment_length]
+
+        if ZIP64_LIMIT in (file_size, compress_size, header_offset) or disk_start == ZIP64_COUNT_LIMIT:
+            needed = []
+            if file_size == ZIP64_LIMIT:
+                needed.append(('file_size', 8))
+            if compress_size == ZIP64_LIMIT:
+                needed.append(('compress_size', 8))
+            if header_offset == ZIP64_LIMIT:
+                needed.append(('header_offset', 8))
+            if disk_start == ZIP64_COUNT_LIMIT:
+                needed.append(('disk_start', 4))
+            values = unpack_zip64_extra(extra, needed)
+            file_size = values.get('file_size', file_size)
+            compress_size = values.get('compress_size', compress_size)
+            header_offset = values.get('header_offset', header_offset)
+            disk_start = values.get('disk_start', disk_start)
+
+        entry.offset = offset + shift
+        entry.flag_bits = flag_bits
+        entry.compress_size = compress_size
+        entry.file_size = file_size
+        entry.disk_start = disk_start
+        entry.header_offset = location.base + header_offset
+        entry.filename = decode_filename(raw_name, flag_bits)
+        entry.extra = extra
+        entry._extra_fields = None
+        entries.append(entry)
+        offset = start + comment_length
+    return entries
+
+# A ZIP file mapped and parsed once: the central directory is read up front, and
+# every mode (-a, -t, -x, -a -x) works from this object instead of reopening the file.
+# file_path may also be an http(s) URL, read with range requests; source overrides
+# where the bytes come from (bytes, an mmap or a byte_source.ByteSource).
+class ZipArchive:
+    def __init__(self, file_path, source=None):
+        self.file_path = file_path
+        with metrics.stage('open'):
+            self.data, self.size, self.mtime = open_source(file_path if source is None else source)
+        metrics.count('archives_opened')
+        metrics.count('archive_bytes', self.size)
+
+        try:
+            with metrics.stage('locate_central_directory'):
+                self.location = locate_central_directory(self.data)
+            if self.location is None:
+                raise BadZipFile("no end of central directory record")
+            with metrics.stage('parse_central_directory'):
+                self.entries = read_zip_entries(self.data, self.location)
+            metrics.count('central_directory_bytes', self.location.size)
+            metrics.count('entries_parsed', len(self.entries))
+        except BadZipFile as e:
+            self.close()
+            raise BadZipFile(f"{file_path}: {e}") from None
+
+    def infolist(self):
+        return self.entries
+
+    def namelist(self):
+        return [entry.filename for entry in self.entries]
+
+    # All records in file order; scan=True walks the data instead of using the directory
+    def records(self, scan=False):
+        if scan:
+            return iter_zip_records(self.data)
+        return seek_zip_records(self.data, self.location, [entry.header_offset for entry in self.entries])
+
+    def close(self):
+        close_source(self.data)
+        self.data = b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def is_zip_archive(file_path):
+    try:
+        with ZipArchive(file_path):
+            return True
+    except (OSError, BadZipFile):
+        return False
+
+# Use the archive already opened by the caller, or open file_path for the duration
+@contextlib.contextmanager
+def shared_archive(file_path, archive=None):
+    if archive is not None:
+        yield archive
+    else:
+        with ZipArchive(file_path) as archive:
+            yield archive
+
+# (data, size, mtime) of an archive, for the duration, after a quick check that it is one:
+# an end of central directory record pointing at a central directory. Only the tail of the
+# file is read (for a URL, the bytes of the first request); the entries are not parsed.
+@contextlib.contextmanager
+def probed_source(file_path):
+    data, size, mtime = open_source(file_path)
+    try:
+        if locate_central_directory(data) is None:
+            raise BadZipFile(f"{file_path}: no end of central directory record")
+        yield data, size, mtime
+    finally:
+        close_source(data)
+
+# Size and mtime of an archive after the quick check of probed_source
+def probe_zip(file_path):
+    with probed_source(file_path) as (_, size, mtime):
+        return size, mtime
+
+# Name, size and modification time of an archive; without an opened archive the file
+# only gets the quick check of probe_zip
+def read_zip_info(file_path, archive=None):
+    if archive is not None:
+        size, mtime = archive.size, archive.mtime
+    else:
+        size, mtime = probe_zip(file_path)
+    return {
+        'file': file_path,
+        'size': size,
+        'modified': None if mtime is None else datetime.datetime.fromtimestamp(mtime),
+    }
@@ -0,0 +1,225 @@
+import io
+import os
+import sys
+import glob
+import time
+import signal
+import threading
+import itertools
+import contextlib
+import metrics
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+from analyze import analyze_zip_file
+from carve import carve_zip_file
+from archive import ZipArchive, BadZipFile
+from byte_source import source_exists
+from jsonl import JsonlWriter
+from report import build_report
+from scoring import set_rules_path
+from cache import ResultCache, DEFAULT_CACHE_SIZE, format_cache_stats
+
+# Chunks queued per worker at a time: one running and one ready to start
+CHUNKS_AHEAD_PER_WORKER = 2
+
+class AnalysisTimeout(Exception):
+    pass
+
+def raise_analysis_timeout(signum, frame):
+    raise AnalysisTimeout()
+
+# The result cache of this worker, opened on its first file. SQLite connections cannot
+# be shared between threads, so thread pools (server.py --threads) get one per thread.
+worker_cache = threading.local()
+
+def open_worker_cache(cache_path, cache_size):
+    if not cache_path:
+        return None
+    cache = getattr(worker_cache, 'cache', None)
+    if cache is None:
+        cache = worker_cache.cache = ResultCache(cache_path, cache_size)
+    return cache
+
+# Expand directories, glob patterns and '-' (one path per line on stdin) into file paths
+def iter_batch_paths(sources):
+    for source in sources:
+        if source == '-':
+            for line in sys.stdin:
+                path = line.strip()
+                if path:
+                    yield path
+        elif os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for name in sorted(files):
+                    yield os.path.join(root, name)
+        elif glob.has_magic(source):
+            yield from sorted(glob.iglob(source, recursive=True))
+        else:
+            yield source
+
+def partial_report(report, output_format):
+    return None if output_format == 'jsonl' else report.getvalue()
+
+# Analyze one archive in a worker process; returns (path, report, error or None, metrics)
+# where the report is the printed text, or the result dict when output_format is 'jsonl',
+# and metrics is the snapshot of this file's stages with profile (None without)
+def analyze_batch_file(file_path, verbose=False, timeout=None, output_format='text',
+                       cache_path=None, cache_size=DEFAULT_CACHE_SIZE, carve=False, profile=False):
+    if not profile:
+        return *report_batch_file(file_path, verbose, timeout, output_format, cache_path, cache_size, carve), None
+    metrics.enable()
+    metrics.reset()
+    result = report_batch_file(file_path, verbose, timeout, output_format, cache_path, cache_size, carve)
+    return *result, metrics.snapshot()
+
+def report_batch_file(file_path, verbose, timeout, output_format, cache_path, cache_size, carve):
+    report = io.StringIO()
+    if timeout:
+        signal.signal(signal.SIGALRM, raise_analysis_timeout)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        cache = open_worker_cache(cache_path, cache_size)
+        if output_format == 'jsonl':
+            result = build_report(file_path, analyze=True, verbose=verbose, cache=cache, carve=carve)
+            return file_path, result, result.pop('error', None)
+        with contextlib.redirect_stdout(report):
+            if not source_exists(file_path):
+                return file_path, report.getvalue(), "file does not exist"
+            try:
+                if carve:
+                    carve_zip_file(file_path, verbose=verbose, cache=cache)
+                elif cache is not None:
+                    # Parsed only when the cache has no result for this archive
+                    analyze_zip_file(file_path, verbose=verbose, cache=cache)
+                else:
+                    with ZipArchive(file_path) as archive:
+                        analyze_zip_file(file_path, verbose=verbose, archive=archive)
+            except BadZipFile:
+                return file_path, report.getvalue(), "not a valid ZIP file"
+        return file_path, report.getvalue(), None
+    except AnalysisTimeout:
+        return file_path, partial_report(report, output_format), f"timed out after {timeout} s"
+    except Exception as e:
+        return file_path, partial_report(report, output_format), f"{type(e).__name__}: {e}"
+    finally:
+        if timeout:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+
+# Analyze a chunk of archives one after the other in a worker; returns their results
+def analyze_batch_chunk(file_paths, *job):
+    return [analyze_batch_file(file_path, *job) for file_path in file_paths]
+
+# Analyze archives on a process pool and yield (path, report, error, metrics) in completion order.
+# Paths are sent to the workers in chunks of chunk_size, one task per chunk, with at most
+# CHUNKS_AHEAD_PER_WORKER chunks per worker queued at a time. When a worker dies, every file
+# of the chunks queued on that pool is retried one at a time in a separate single-worker
+# pool, so only the file that actually crashes it is reported.
+def run_batch(paths, workers=None, chunk_size=16, timeout=None, verbose=False, output_format='text', rules_path=None,
+              cache_path=None, cache_size=DEFAULT_CACHE_SIZE, carve=False, profile=False):
+    workers = workers or os.cpu_count() or 1
+    chunk_size = max(1, chunk_size)
+    paths = iter(paths)
+    retries = []
+    pending = {}
+    isolated = None
+    job = (verbose, timeout, output_format, cache_path, cache_size, carve, profile)
+    # Workers load the fingerprint rules given with --rules, whatever the start method
+    pool_options = {'initializer': set_rules_path, 'initargs': (rules_path,)} if rules_path else {}
+    executor = ProcessPoolExecutor(max_workers=workers, **pool_options)
+    isolation_executor = ProcessPoolExecutor(max_workers=1, **pool_options)
+    try:
+        while True:
+            while len(pending) < workers * CHUNKS_AHEAD_PER_WORKER:
+                chunk = list(itertools.islice(paths, chunk_size))
+                if not chunk:
+                    break
+                pending[executor.submit(analyze_batch_chunk, chunk, *job)] = chunk
+            if isolated is None and retries:
+                path = retries.pop()
+                isolated = (isolation_executor.submit(analyze_batch_file, path, *job), path)
+            if not pending and isolated is None:
+                break
+
+            waiting = set(pending)
+            if isolated is not None:
+                waiting.add(isolated[0])
+            done, _ = wait(waiting, return_when=FIRST_COMPLETED)
+
+            if isolated is not None and isolated[0] in done:
+                future, path = isolated
+                isolated = None
+                try:
+                    yield future.result()
+                except BrokenProcessPool:
+                    yield path, None, "worker process crashed", None
+                    isolation_executor.shutdown(wait=False, cancel_futures=True)
+                    isolation_executor = ProcessPoolExecutor(max_workers=1, **pool_options)
+
+            broken = False
+            for future in done & pending.keys():
+                chunk = pending.pop(future)
+                try:
+                    yield from future.result()
+                except BrokenProcessPool:
+                    broken = True
+                    retries.extend(chunk)
+            if broken:
+                # Chunks still queued on the broken pool fail as well
+                for future, chunk in pending.items():
+                    if future.done() and future.exception() is None:
+                        yield from future.result()
+                    else:
+                        retries.extend(chunk)
+                pending.clear()
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = ProcessPoolExecutor(max_workers=workers, **pool_options)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        isolation_executor.shutdown(wait=False, cancel_futures=True)
+
+def print_batch(sources, workers=None, chunk_size=16, timeout=None, verbose=False, output_format='text', rules_path=None,
+                cache_path=None, cache_size=DEFAULT_CACHE_SIZE, carve=False, profile=False, metrics_format='table'):
+    if profile:
+        # Totals of the stages timed in the workers, over the wall time of the whole batch
+        metrics.enable()
+        metrics.reset()
+    cache_before = None
+    if cache_path:
+        with ResultCache(cache_path, cache_size) as cache:
+            cache_before = cache.stats()
+    start = time.perf_counter()
+    files = errors = 0
+    writer = JsonlWriter(sys.stdout) if output_format == 'jsonl' else None
+    results = run_batch(iter_batch_paths(sources), workers, chunk_size, timeout, verbose, output_format, rules_path,
+                        cache_path, cache_size, carve, profile)
+    for file_path, report, error, snapshot in results:
+        files += 1
+        if snapshot:
+            metrics.merge(snapshot)
+        errors += error is not None
+        if writer:
+            record = report or {'file': file_path}
+            if error:
+                record['error'] = error
+            writer.write(record)
+            continue
+        print(f"\n===== {file_path} =====")
+        if report:
+            print(report, end='')
+        if error:
+            print(f"Error: {error}")
+    if writer:
+        writer.close()
+    elapsed = time.perf_counter() - start
+    rate = files / elapsed if elapsed > 0 else 0.0
+    print(f"\nBatch: {files} files, {errors} errors in {elapsed:.2f} s ({rate:.1f} files/sec)", file=sys.stderr)
+    if cache_before is not None:
+        # The workers share the counters stored in the cache file; report this run's share
+        with ResultCache(cache_path, cache_size) as cache:
+            stats = cache.stats()
+        for name in ('hits', 'misses', 'evictions'):
+            stats[name] -= cache_before[name]
+        print(format_cache_stats(stats), file=sys.stderr)
+    if profile:
+        print(metrics.format_metrics(metrics.snapshot(), metrics_format), file=sys.stderr)
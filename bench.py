@@ -0,0 +1,430 @@
+import os
+import sys
+import json
+import math
+import time
+import zipfile
+import argparse
+import threading
+import tempfile
+import subprocess
+import contextlib
+import tracemalloc
+import importlib.util
+import http.server
+import urllib.parse
+import hex
+import analyze
+import scoring
+import tree_map
+import report
+from archive import ZipArchive
+from corpus import make_sparse_zip64, make_sparse_zip64_corpus, make_style_corpus
+
+KNOW_ZIP = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'know_zip.py')
+
+# Load another hex.py (e.g. `git show <rev>:hex.py > hex_old.py`) to compare against
+def load_module(path):
+    spec = importlib.util.spec_from_file_location(f"baseline_{os.path.basename(path)[:-3]}", path)
+    module = importlib.util.module_from_spec(spec)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(path)))
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        sys.path.pop(0)
+    return module
+
+# Write a sample archive of stored entries filled with random data
+def make_sample_zip(file_path, entries, entry_size):
+    with zipfile.ZipFile(file_path, 'w', zipfile.ZIP_STORED) as zip_file:
+        for i in range(entries):
+            zip_file.writestr(f"dir{i % 16}/file{i}.bin", os.urandom(entry_size))
+
+# Best wall time of func(*args) over repeat runs, with its report discarded
+def time_call(func, *args, repeat=3):
+    best = None
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func(*args)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def bench_parse(file_path, baseline=None, repeat=3):
+    size_mb = os.path.getsize(file_path) / (1024 * 1024)
+    print(f"Archive: {file_path} ({size_mb:.1f} MB)")
+    candidates = [
+        ("hex.analyze_zip_hex", hex.analyze_zip_hex),
+        ("hex.analyze_zip_hex (scan)", lambda path: hex.analyze_zip_hex(path, scan=True)),
+    ]
+    if baseline:
+        candidates.append((f"{baseline}:analyze_zip_hex", load_module(baseline).analyze_zip_hex))
+    for name, func in candidates:
+        seconds = time_call(func, file_path, repeat=repeat)
+        print(f"  {name}: {seconds:.3f} s, {size_mb / seconds:.1f} MB/s")
+
+def bench_view(file_path, baseline=None, repeat=3):
+    size_mb = os.path.getsize(file_path) / (1024 * 1024)
+    candidates = [("hex.view_zip_in_hex", hex.view_zip_in_hex)]
+    if baseline:
+        candidates.append((f"{baseline}:view_zip_in_hex", load_module(baseline).view_zip_in_hex))
+    for name, func in candidates:
+        seconds = time_call(func, file_path, repeat=repeat)
+        print(f"  {name}: {seconds:.3f} s, {size_mb / seconds:.1f} MB/s")
+
+# Build and render the file tree of an archive; reports entries/s and the memory held by the tree
+def bench_tree(file_path, repeat=3):
+    with ZipArchive(file_path) as archive:
+        entries = len(archive.infolist())
+        seconds = time_call(tree_map.build_file_tree, file_path, archive, repeat=repeat)
+        tracemalloc.start()
+        file_tree = tree_map.build_file_tree(file_path, archive)
+        tree_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        render = time_call(tree_map.print_file_tree, file_path, file_tree, repeat=repeat)
+    print(f"Tree of {entries} entries ({len(file_tree)} nodes, {tree_bytes / (1024 * 1024):.1f} MB)")
+    print(f"  build_file_tree: {seconds:.3f} s, {entries / seconds:,.0f} entries/s")
+    print(f"  print_file_tree: {render:.3f} s, {len(file_tree) / render:,.0f} lines/s")
+
+# Time the origin scoring engine alone on an archive of the given number of entries
+def bench_scoring(entries, repeat=3):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        sample = os.path.join(tmp_dir, 'entries.zip')
+        make_sparse_zip64(sample, entries, 0)
+        with ZipArchive(sample) as archive:
+            print(f"Scoring {entries} entries")
+            backends = [('numpy', scoring.numpy), ('python', None)] if scoring.numpy else [('python', None)]
+            for name, backend in backends:
+                numpy, scoring.numpy = scoring.numpy, backend
+                try:
+                    seconds = time_call(scoring.score_zip_origin, archive.infolist(), repeat=repeat)
+                finally:
+                    scoring.numpy = numpy
+                print(f"  score_zip_origin ({name}): {seconds:.3f} s, {entries / seconds:,.0f} entries/s")
+
+# Local stand-in for an object store: serves the files of a directory with Range support
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        byte_range = self.headers.get('Range', '')
+        status = 200
+        if byte_range.startswith('bytes='):
+            first, _, last = byte_range[6:].partition('-')
+            if first:
+                start, end = int(first), min(size - 1, int(last)) if last else size - 1
+            else:
+                start = max(0, size - int(last))
+            if start >= size:
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{size}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            status = 206
+        with open(path, 'rb') as f:
+            f.seek(start)
+            body = f.read(end - start + 1)
+        self.send_response(status)
+        if status == 206:
+            self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Last-Modified', self.date_time_string(int(os.path.getmtime(path))))
+        self.end_headers()
+        self.wfile.write(body)
+
+# Serve directory on a local port for the duration; yields the base URL
+@contextlib.contextmanager
+def serve_directory(directory):
+    handler = lambda *args: RangeRequestHandler(*args, directory=directory)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+# Analyze an archive through HTTP range requests to a local stub server; reports the
+# requests and bytes fetched against the file size, and checks the result is the local one
+def bench_remote(file_path, repeat=3):
+    size = os.path.getsize(file_path)
+    with serve_directory(os.path.dirname(os.path.abspath(file_path))) as base_url:
+        url = f"{base_url}/{urllib.parse.quote(os.path.basename(file_path))}"
+        with ZipArchive(url) as archive:
+            remote = report.build_report(url, analyze=True, tree=True, cache=None)
+            fetched = archive.data.requests, archive.data.bytes_read
+        local = report.build_report(file_path, analyze=True, tree=True)
+        seconds = time_call(lambda: report.build_report(url, analyze=True), repeat=repeat)
+    remote['file'] = local['file']
+    print(f"Remote archive: {url} ({size / (1024 * 1024):.1f} MB)")
+    print(f"  open + central directory: {fetched[0]} requests, {fetched[1]:,} bytes ({100 * fetched[1] / max(size, 1):.2f}% of the file)")
+    print(f"  build_report -a: {seconds:.3f} s, same result as local: {remote == local}")
+
+# Runs know_zip.py and writes its own peak RSS (VmHWM, in KB) to the PEAK_RSS_FD pipe.
+# ru_maxrss of the child would also count the memory of the process it was forked from.
+PEAK_RSS_WRAPPER = '''
+import os, sys, runpy
+sys.argv = sys.argv[1:]
+sys.path.insert(0, os.path.dirname(sys.argv[0]))
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+finally:
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as status:
+            peak = next((line.split()[1] for line in status if line.startswith('VmHWM:')), '')
+        os.write(int(os.environ['PEAK_RSS_FD']), peak.encode())
+'''
+
+# Run know_zip.py in a fresh process; returns (wall seconds, peak RSS in KB)
+def measure_cli(cli_args):
+    read_fd, write_fd = os.pipe()
+    env = dict(os.environ, PEAK_RSS_FD=str(write_fd))
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', PEAK_RSS_WRAPPER, KNOW_ZIP] + cli_args,
+                               stdout=subprocess.DEVNULL, pass_fds=(write_fd,), env=env)
+    os.close(write_fd)
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    with os.fdopen(read_fd, 'rb') as pipe:
+        peak = pipe.read()
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"know_zip.py {' '.join(cli_args)} exited with {process.returncode}")
+    return elapsed, int(peak) if peak else usage.ru_maxrss
+
+def bench_zip64(directory):
+    for path in make_sparse_zip64_corpus(directory):
+        size_gb = os.path.getsize(path) / 1024 ** 3
+        print(f"Archive: {path} ({size_gb:.2f} GB)")
+        for mode in (['-a', '-x'], ['-a', '-x', '--scan'], ['-a']):
+            seconds, rss_kb = measure_cli(['-f', path] + mode)
+            print(f"  know_zip.py {' '.join(mode)}: {seconds:.3f} s, peak RSS {rss_kb / 1024:.1f} MB")
+
+# Time know_zip.py serially and with -j jobs in the modes that shard one archive, and
+# check both print the same output
+def bench_parallel(file_path, jobs, repeat=3):
+    with ZipArchive(file_path) as archive:
+        entries = len(archive.infolist())
+    print(f"Archive: {file_path} ({entries} entries), serial vs -j {jobs}")
+    for mode in (['-a'], ['-a', '-v'], ['-a', '-x']):
+        command = [sys.executable, KNOW_ZIP, '-f', file_path] + mode
+        serial = subprocess.run(command, stdout=subprocess.PIPE, check=True).stdout
+        sharded = subprocess.run(command + ['-j', str(jobs)], stdout=subprocess.PIPE, check=True).stdout
+        serial_seconds = min(measure_cli(['-f', file_path] + mode)[0] for _ in range(repeat))
+        sharded_seconds = min(measure_cli(['-f', file_path, '-j', str(jobs)] + mode)[0] for _ in range(repeat))
+        print(f"  know_zip.py {' '.join(mode)}: {serial_seconds:.3f} s serial, {sharded_seconds:.3f} s sharded "
+              f"(x{serial_seconds / sharded_seconds:.2f}), same output: {serial == sharded}")
+
+# Modes of the suite: (name, know_zip.py flags, the same work in process)
+SUITE_MODES = [
+    ('parse_zip_file', ['-a', '-x'], lambda path: hex.analyze_zip_hex(path)),
+    ('view_zip_in_hex', ['-x'], lambda path: hex.view_zip_in_hex(path)),
+    ('detect_zip_origin', ['-a'], lambda path: analyze.analyze_zip_file(path)),
+    ('print_file_tree', ['-t'], lambda path: tree_map.print_file_tree(path)),
+]
+# A mode is reported as a regression when its median time or peak RSS grows by more than this
+DEFAULT_REGRESSION_THRESHOLD = 1.2
+
+# Startup of know_zip.py on the smallest archive of the suite, per mode: (name, flags).
+# The sum of the top-level imports reported by -X importtime must stay within the budget.
+STARTUP_MODES = [('info', []), ('analyze', ['-a']), ('tree', ['-t'])]
+STARTUP_IMPORT_BUDGET_MS = {'info': 60.0, 'analyze': 75.0, 'tree': 75.0}
+
+# Nearest-rank percentile of the values
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+# Wall times of repeat runs of func(*args), with its report discarded
+def time_runs(func, *args, repeat=5):
+    times = []
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func(*args)
+            times.append(time.perf_counter() - start)
+    return times
+
+# Milliseconds spent importing the top-level modules of one know_zip.py run, from the
+# -X importtime report on stderr (nested imports are indented and already counted)
+def import_time_ms(report):
+    total = 0
+    for line in report.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and line.startswith('import time:') and fields[2][:2] != '  ' and fields[1].strip().isdigit():
+            total += int(fields[1])
+    return total / 1000
+
+# Median import time and wall time of repeat fresh know_zip.py runs per startup mode; a
+# first run is discarded so every measured run finds the compiled modules
+def run_startup(path, repeat=5):
+    startup = {}
+    for name, flags in STARTUP_MODES:
+        command = [sys.executable, '-X', 'importtime', KNOW_ZIP, '-f', path] + flags
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        imports, walls = [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            process = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+            walls.append(time.perf_counter() - start)
+            imports.append(import_time_ms(process.stderr))
+        startup[name] = {'import_ms': percentile(imports, 0.5), 'wall_ms': percentile(walls, 0.5) * 1000,
+                         'budget_ms': STARTUP_IMPORT_BUDGET_MS[name]}
+    return startup
+
+# Latency percentiles and throughput of every mode in process, peak RSS of each mode in a
+# fresh know_zip.py, and the detected origin of each archive
+def run_suite(paths, repeat=5):
+    results = {}
+    for path in paths:
+        size = os.path.getsize(path)
+        with ZipArchive(path) as archive:
+            entries = len(archive.infolist())
+        origin = analyze.read_zip_analysis(path)['origin']['origins']
+        modes = {}
+        for name, flags, func in SUITE_MODES:
+            times = time_runs(func, path, repeat=repeat)
+            _, rss_kb = measure_cli(['-f', path] + flags)
+            median = percentile(times, 0.5)
+            modes[name] = {
+                'p50': median, 'p90': percentile(times, 0.9), 'p99': percentile(times, 0.99),
+                'mb_per_s': size / (1024 * 1024) / median, 'entries_per_s': entries / median,
+                'peak_rss_mb': rss_kb / 1024,
+            }
+        results[os.path.basename(path)] = {'size': size, 'entries': entries, 'origins': origin, 'modes': modes}
+    return results
+
+def load_baseline(path):
+    with open(path) as f:
+        return json.load(f)
+
+def save_baseline(path, results, startup=None):
+    with open(path, 'w') as f:
+        json.dump({'python': sys.version.split()[0], 'results': results, 'startup': startup or {}}, f, indent=2)
+
+# Print the startup of each mode against its import budget and the baseline; returns the
+# number of regressions (over budget, or wall time grown by more than threshold)
+def print_startup(startup, baseline=None, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    regressions = 0
+    print("Startup (know_zip.py -X importtime):")
+    for mode, stats in startup.items():
+        line = (f"  {mode}: imports {stats['import_ms']:.1f} ms (budget {stats['budget_ms']:.0f} ms), "
+                f"wall {stats['wall_ms']:.1f} ms")
+        if stats['import_ms'] > stats['budget_ms']:
+            regressions += 1
+            line += " OVER BUDGET"
+        old = (baseline or {}).get('startup', {}).get(mode)
+        if old is not None:
+            ratio = stats['wall_ms'] / old['wall_ms'] if old['wall_ms'] else 1.0
+            line += f" (wall x{ratio:.2f} vs baseline)"
+            if ratio > threshold:
+                regressions += 1
+                line += " REGRESSION"
+        print(line)
+    return regressions
+
+# Print the suite results, compared with a stored baseline when given; returns the
+# number of regressions (slower or larger than threshold, or another detected origin)
+def print_suite(results, baseline=None, threshold=DEFAULT_REGRESSION_THRESHOLD):
+    regressions = 0
+    for archive_name, result in results.items():
+        before = (baseline or {}).get('results', {}).get(archive_name)
+        print(f"Archive: {archive_name} ({result['size'] / (1024 * 1024):.1f} MB, {result['entries']} entries, "
+              f"origin {', '.join(result['origins'])})")
+        if before is not None and before['origins'] != result['origins']:
+            regressions += 1
+            print(f"  REGRESSION: origin was {', '.join(before['origins'])}")
+        for mode, stats in result['modes'].items():
+            line = (f"  {mode}: p50 {stats['p50'] * 1000:.2f} ms, p90 {stats['p90'] * 1000:.2f} ms, "
+                    f"p99 {stats['p99'] * 1000:.2f} ms, "
+                    f"{stats['mb_per_s']:.1f} MB/s, {stats['entries_per_s']:,.0f} entries/s, "
+                    f"peak RSS {stats['peak_rss_mb']:.1f} MB")
+            old = before['modes'].get(mode) if before is not None else None
+            if old is not None:
+                time_ratio = stats['p50'] / old['p50'] if old['p50'] else 1.0
+                rss_ratio = stats['peak_rss_mb'] / old['peak_rss_mb'] if old['peak_rss_mb'] else 1.0
+                line += f" (p50 x{time_ratio:.2f}, RSS x{rss_ratio:.2f} vs baseline)"
+                if time_ratio > threshold or rss_ratio > threshold:
+                    regressions += 1
+                    line += " REGRESSION"
+            print(line)
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the ZIP analysis modes.')
+    parser.add_argument('-f', '--file', type=str, help='Archive to benchmark (default: generate one)')
+    parser.add_argument('--baseline', type=str, help='Path to another hex.py to compare against')
+    parser.add_argument('--entries', type=int, default=1000, help='Entries in the generated archive')
+    parser.add_argument('--entry-size', type=int, default=64 * 1024, help='Bytes per generated entry')
+    parser.add_argument('--zip64-corpus', type=str, help='Directory for the sparse ZIP64 corpus (generated if missing) to measure time and RSS on')
+    parser.add_argument('--score-entries', type=int, help='Benchmark origin scoring on an archive of this many entries (e.g. 100000)')
+    parser.add_argument('--tree', action='store_true', help='Benchmark building and printing the file tree (with -f or the generated archive)')
+    parser.add_argument('--remote', action='store_true', help='Benchmark reading the archive (-f or generated) through HTTP range requests to a local stub server')
+    parser.add_argument('--parallel', type=int, metavar='JOBS', help='Compare the serial and sharded (-j JOBS) analysis of the archive (-f or generated)')
+    parser.add_argument('--suite', type=str, metavar='DIR', help='Run every mode over the corpus of archiver styles in DIR (generated if missing)')
+    parser.add_argument('--startup', action='store_true', help='Only measure the startup of know_zip.py against its import budget (with --suite)')
+    parser.add_argument('--full', action='store_true', help='With --suite, add the 1M-entry and multi-GB archives to the corpus')
+    parser.add_argument('--save-baseline', type=str, metavar='PATH', help='With --suite, store the results as a JSON baseline')
+    parser.add_argument('--compare', type=str, metavar='PATH', help='With --suite, compare with a stored baseline; exits with 1 on regressions')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_REGRESSION_THRESHOLD, help='Slowdown or RSS growth ratio reported as a regression')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per measurement (best is kept)')
+    args = parser.parse_args()
+
+    if args.suite:
+        paths = make_style_corpus(args.suite, args.full)
+        baseline = load_baseline(args.compare) if args.compare else None
+        results = {} if args.startup else run_suite(paths, args.repeat)
+        regressions = print_suite(results, baseline, args.threshold)
+        startup = run_startup(min(paths, key=os.path.getsize), max(args.repeat, 5))
+        regressions += print_startup(startup, baseline, args.threshold)
+        if args.save_baseline:
+            save_baseline(args.save_baseline, results, startup)
+        if args.compare:
+            print(f"{regressions} regressions against {args.compare}")
+            sys.exit(1 if regressions else 0)
+    elif args.score_entries:
+        bench_scoring(args.score_entries, args.repeat)
+    elif args.zip64_corpus:
+        bench_zip64(args.zip64_corpus)
+    elif args.tree:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sample = args.file
+            if not sample:
+                sample = os.path.join(tmp_dir, 'sample.zip')
+                make_sample_zip(sample, args.entries, 0)
+            bench_tree(sample, args.repeat)
+    elif args.parallel:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sample = args.file
+            if not sample:
+                sample = os.path.join(tmp_dir, 'sample.zip')
+                make_sample_zip(sample, args.entries * 100, 0)
+            bench_parallel(sample, args.parallel, args.repeat)
+    elif args.remote:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sample = args.file
+            if not sample:
+                sample = os.path.join(tmp_dir, 'sample.zip')
+                make_sample_zip(sample, args.entries, args.entry_size)
+            bench_remote(sample, args.repeat)
+    elif args.file:
+        bench_parse(args.file, args.baseline, args.repeat)
+        bench_view(args.file, args.baseline, args.repeat)
+    else:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            sample = os.path.join(tmp_dir, 'sample.zip')
+            make_sample_zip(sample, args.entries, args.entry_size)
+            bench_parse(sample, args.baseline, args.repeat)
+            bench_view(sample, args.baseline, args.repeat)
@@ -0,0 +1,284 @@
+import os
+import mmap
+from collections import OrderedDict
+import metrics
+
+# Sources are read and cached in blocks of this size
+BLOCK_SIZE = 64 * 1024
+# Blocks kept per source (16 MiB), least recently used dropped first
+CACHE_BLOCKS = 256
+# Blocks read past the end of a missed read, for the record that usually follows
+READ_AHEAD_BLOCKS = 1
+# Missing blocks this close together are read with one request, gap included
+COALESCE_GAP_BLOCKS = 2
+# The first request to a remote archive reads this many blocks at its end, which covers
+# the end of central directory record (at most 64 KiB from the end) and small directories
+TAIL_BLOCKS = 2
+HTTP_TIMEOUT = 30
+
+# What the parsers can use as it is (struct.unpack_from, memoryview, find)
+BUFFER_TYPES = (bytes, bytearray, memoryview, mmap.mmap)
+
+def is_url(location):
+    return isinstance(location, str) and location.startswith(('http://', 'https://'))
+
+def source_exists(location):
+    return is_url(location) or os.path.exists(location)
+
+# Bytes of an archive read on demand, in blocks of BLOCK_SIZE. Supports what the parsers
+# use on a mapped file: len(), indexing, slicing and find/rfind. Subclasses implement fetch.
+class ByteSource:
+    def __init__(self, size=0, cache_blocks=CACHE_BLOCKS, read_ahead=READ_AHEAD_BLOCKS):
+        self.size = size
+        self.mtime = None
+        self.blocks = OrderedDict()
+        self.cache_blocks = cache_blocks
+        self.read_ahead = read_ahead
+        self.requests = 0
+        self.bytes_read = 0
+
+    # size bytes at offset from the underlying storage
+    def fetch(self, offset, size):
+        raise NotImplementedError
+
+    def close(self):
+        self.blocks.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            data = self.read(start, stop - start)
+            return data if step == 1 else data[::step]
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError('byte source index out of range')
+        return self.read(key, 1)[0]
+
+    def cache_block(self, index, block):
+        self.blocks[index] = block
+        if len(self.blocks) > self.cache_blocks:
+            self.blocks.popitem(last=False)
+
+    # Read the missing blocks first..last in as few requests as possible: runs of missing
+    # blocks separated by at most COALESCE_GAP_BLOCKS cached ones become one request.
+    # Returns the blocks read, so a read larger than the cache still gets all of them.
+    def load(self, first, last):
+        missing = [index for index in range(first, last + 1) if index not in self.blocks]
+        if not missing:
+            return {}
+        last_block = (self.size - 1) // BLOCK_SIZE
+        runs = [[missing[0], missing[0]]]
+        for index in missing[1:]:
+            if index - runs[-1][1] <= COALESCE_GAP_BLOCKS + 1:
+                runs[-1][1] = index
+            else:
+                runs.append([index, index])
+        runs[-1][1] = min(last_block, runs[-1][1] + self.read_ahead)
+
+        loaded = {}
+        for start, stop in runs:
+            offset = start * BLOCK_SIZE
+            data = self.fetch(offset, min(self.size, (stop + 1) * BLOCK_SIZE) - offset)
+            for index in range(start, stop + 1):
+                block = data[(index - start) * BLOCK_SIZE:(index - start + 1) * BLOCK_SIZE]
+                loaded[index] = block
+                self.cache_block(index, block)
+        return loaded
+
+    def read(self, offset, size):
+        end = min(self.size, offset + size)
+        if offset >= end:
+            return b''
+        first, last = offset // BLOCK_SIZE, (end - 1) // BLOCK_SIZE
+        loaded = self.load(first, last)
+        parts = []
+        for index in range(first, last + 1):
+            block = loaded.get(index)
+            if block is None:
+                block = self.blocks[index]
+                self.blocks.move_to_end(index)
+            parts.append(block)
+        start = offset - first * BLOCK_SIZE
+        if len(parts) == 1:
+            return parts[0][start:start + end - offset]
+        return b''.join(parts)[start:start + end - offset]
+
+    # Same results as bytes.find / bytes.rfind, reading one block-sized window at a time
+    def find(self, sub, start=0, end=None):
+        start, end, _ = slice(start, end).indices(self.size)
+        step = max(BLOCK_SIZE, len(sub))
+        while start < end:
+            stop = min(end, start + step + len(sub) - 1)
+            index = self.read(start, stop - start).find(sub)
+            if index != -1:
+                return start + index
+            if stop == end:
+                break
+            start += step
+        return -1
+
+    def rfind(self, sub, start=0, end=None):
+        start, end, _ = slice(start, end).indices(self.size)
+        step = max(BLOCK_SIZE, len(sub))
+        stop = end
+        while stop > start:
+            begin = max(start, stop - step)
+            index = self.read(begin, stop - begin).rfind(sub)
+            if index != -1:
+                return begin + index
+            if begin == start:
+                break
+            stop = begin + len(sub) - 1
+        return -1
+
+# A local file read with pread, for files that cannot be memory mapped
+class FileSource(ByteSource):
+    def __init__(self, file_path, **options):
+        super().__init__(**options)
+        self.fd = os.open(file_path, os.O_RDONLY)
+        stat = os.fstat(self.fd)
+        self.size = stat.st_size
+        self.mtime = stat.st_mtime
+
+    def fetch(self, offset, size):
+        self.requests += 1
+        data = os.pread(self.fd, size, offset)
+        self.bytes_read += len(data)
+        return data
+
+    def close(self):
+        super().close()
+        if self.fd != -1:
+            os.close(self.fd)
+            self.fd = -1
+
+# An archive on an HTTP(S) server or object store (e.g. a presigned URL), read with
+# Range requests over one keep-alive connection. The first request reads the tail of the
+# archive and its size, so listing a small directory takes a single request.
+class HttpRangeSource(ByteSource):
+    def __init__(self, url, headers=None, timeout=HTTP_TIMEOUT, **options):
+        # Imported here: most runs read local files, and the http stack is slow to import
+        import http.client
+        import urllib.parse
+        super().__init__(**options)
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.netloc:
+            raise ValueError(f"not an http(s) URL: {url}")
+        self.url = url
+        self.path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.connection = connection_class(parts.netloc, timeout=timeout)
+        self.headers = dict(headers or {})
+        # Set when the server ignores Range and sends the whole object
+        self.whole = None
+        self.etag = None
+
+        status, response, body = self.request(f"bytes=-{TAIL_BLOCKS * BLOCK_SIZE}")
+        if status == 416:
+            self.size = 0
+        elif status == 200:
+            self.keep_whole(body)
+        elif status == 206:
+            self.size = content_range_total(response.getheader('Content-Range'), url)
+            tail = self.size - len(body)
+            first = -(-tail // BLOCK_SIZE)
+            for index in range(first, -(-self.size // BLOCK_SIZE)):
+                start = index * BLOCK_SIZE - tail
+                self.cache_block(index, body[start:start + BLOCK_SIZE])
+        else:
+            self.close()
+            raise OSError(f"{url}: HTTP {status} {response.reason}")
+        modified = response.getheader('Last-Modified')
+        if modified:
+            import email.utils
+            self.mtime = email.utils.parsedate_to_datetime(modified).timestamp()
+        # Later reads fail rather than mix two versions of a changed object
+        self.etag = response.getheader('ETag')
+        if self.etag and status == 206:
+            self.headers['If-Match'] = self.etag
+
+    def keep_whole(self, body):
+        self.whole = body
+        self.size = len(body)
+
+    def request(self, byte_range):
+        import http.client
+        headers = dict(self.headers, Range=byte_range)
+        for attempt in range(2):
+            try:
+                self.connection.request('GET', self.path, headers=headers)
+                response = self.connection.getresponse()
+                body = response.read()
+                break
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The server closed the keep-alive connection; reconnect once
+                self.connection.close()
+                if attempt:
+                    raise
+            except http.client.HTTPException as e:
+                self.connection.close()
+                raise OSError(f"{self.url}: {e}") from None
+        self.requests += 1
+        self.bytes_read += len(body)
+        return response.status, response, body
+
+    def fetch(self, offset, size):
+        if self.whole is not None:
+            return self.whole[offset:offset + size]
+        status, response, body = self.request(f"bytes={offset}-{offset + size - 1}")
+        if status == 200:
+            self.keep_whole(body)
+            return body[offset:offset + size]
+        if status != 206:
+            raise OSError(f"{self.url}: HTTP {status} {response.reason}")
+        if len(body) != size:
+            raise OSError(f"{self.url}: short read of {len(body)} bytes at offset {offset}, expected {size}")
+        return body
+
+    def close(self):
+        super().close()
+        self.whole = None
+        self.connection.close()
+
+# Total size from a 'bytes start-end/total' Content-Range header
+def content_range_total(value, url):
+    try:
+        return int(value.rsplit('/', 1)[1])
+    except (AttributeError, IndexError, ValueError):
+        raise OSError(f"{url}: bad Content-Range header {value!r}") from None
+
+# (data, size, mtime) of an archive. Local files are memory mapped, or read through a
+# FileSource when they cannot be; http(s) URLs are read with range requests; bytes and
+# other buffers are used as they are (mtime is None when unknown).
+def open_source(location):
+    if isinstance(location, BUFFER_TYPES):
+        return location, len(location), None
+    if is_url(location):
+        source = HttpRangeSource(location)
+        return source, source.size, source.mtime
+    with open(location, 'rb') as f:
+        stat = os.fstat(f.fileno())
+        if not stat.st_size:
+            return b'', 0, stat.st_mtime
+        try:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), stat.st_size, stat.st_mtime
+        except (OSError, ValueError):
+            source = FileSource(location)
+            return source, source.size, source.mtime
+
+def close_source(data):
+    if isinstance(data, ByteSource):
+        metrics.count('source_requests', data.requests)
+        metrics.count('source_bytes_read', data.bytes_read)
+    if isinstance(data, (mmap.mmap, ByteSource)):
+        data.close()
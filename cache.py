@@ -0,0 +1,197 @@
+import os
+import mmap
+import time
+import zlib
+import sys
+import metrics
+from zip_records import locate_central_directory
+from byte_source import BUFFER_TYPES, is_url
+
+# Bumped whenever the shape of a cached result changes
+CACHE_FORMAT = 2
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+# Evict down to this fraction of the size limit, so eviction does not run on every store
+EVICTION_TARGET = 0.9
+COUNTERS = ('hits', 'misses', 'stores', 'evictions')
+
+# Cheap key for results read from the central directory (analysis, tree): the file size,
+# every byte after the central directory (ZIP64 EOCD, locator, EOCD and comment) and the
+# CRC-32 of the central directory itself. None when there is no end of central directory.
+# A remote source gives the same key as a local copy of the archive.
+def archive_prekey(data):
+    location = locate_central_directory(data)
+    if location is None:
+        return None
+    import hashlib
+    size = len(data)
+    start, end = location.offset, location.offset + location.size
+    if not isinstance(data, BUFFER_TYPES):
+        # Only the central directory and what follows it are read
+        data = data[start:]
+        start, end = 0, end - start
+    key = hashlib.blake2b(digest_size=20)
+    key.update(size.to_bytes(8, 'little'))
+    with memoryview(data) as view:
+        key.update(view[end:])
+        key.update(zlib.crc32(view[start:end]).to_bytes(4, 'little'))
+    return 'cd:' + key.hexdigest()
+
+# Digest of the whole file, for results that depend on the local headers and data too
+def archive_digest(data):
+    import hashlib
+    return 'content:' + hashlib.blake2b(data, digest_size=20).hexdigest()
+
+# On-disk cache of analysis results shared by every process that opens the same file.
+# Results are pickled: the cache file must only ever be written by this tool.
+# Entries are stamped with the fingerprint rules they were scored with, and the least
+# recently used ones are dropped once the stored results exceed max_size bytes.
+class ResultCache:
+    def __init__(self, path, max_size=DEFAULT_CACHE_SIZE):
+        # Imported with the first cache: runs without --cache only use cached_result
+        import sqlite3
+        from scoring import default_rules
+        self.path = path
+        self.max_size = max_size
+        self.version = f"{CACHE_FORMAT}:{default_rules().digest}"
+        self.hits = self.misses = self.stores = self.evictions = 0
+        self.archive_keys = {}
+        self.uncached_urls = set()
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, version TEXT NOT NULL, "
+                        "value BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self.db.executemany("INSERT OR IGNORE INTO counters VALUES (?, 0)", [(name,) for name in COUNTERS])
+
+    # Key of the archive at file_path, computed once per file version (size, mtime, inode)
+    def archive_key(self, file_path, content=False):
+        if is_url(file_path):
+            return self.remote_archive_key(file_path, content)
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        signature = (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+        cached = self.archive_keys.get((file_path, content))
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+
+        with open(file_path, 'rb') as f:
+            if stat.st_size:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    key = archive_digest(data) if content else archive_prekey(data)
+            else:
+                key = archive_digest(b'') if content else archive_prekey(b'')
+        self.archive_keys[(file_path, content)] = (signature, key)
+        return key
+
+    # Key of an archive read over http(s), from the tail fetched by the first range request.
+    # Results read from the central directory use its pre-key, like a local file. Keying the
+    # other results by content would download the whole archive, so they are keyed by the
+    # URL, size, ETag and Last-Modified instead, and not cached when the server sends neither.
+    def remote_archive_key(self, url, content=False):
+        from byte_source import HttpRangeSource
+        try:
+            with HttpRangeSource(url) as source:
+                prekey = archive_prekey(source)
+                size, etag, mtime = source.size, source.etag, source.mtime
+        except OSError:
+            return None
+        if not content or prekey is None:
+            return prekey
+        if etag is None and mtime is None:
+            if url not in self.uncached_urls:
+                self.uncached_urls.add(url)
+                print(f"Warning: {url} has no ETag or Last-Modified header; results that read past "
+                      f"its central directory (-a -x, --carve) are not cached", file=sys.stderr)
+            return None
+        import hashlib
+        key = hashlib.blake2b(repr((url, size, etag, mtime, prekey)).encode('utf-8'), digest_size=20)
+        return 'url:' + key.hexdigest()
+
+    def count(self, name, n=1):
+        setattr(self, name, getattr(self, name) + n)
+        metrics.count(f"cache_{name}", n)
+        self.db.execute("UPDATE counters SET value = value + ? WHERE name = ?", (n, name))
+
+    def get(self, key):
+        import pickle
+        row = self.db.execute("SELECT value FROM results WHERE key = ? AND version = ?",
+                              (key, self.version)).fetchone()
+        if row is None:
+            self.count('misses')
+            return None
+        self.db.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.count('hits')
+        return pickle.loads(row[0])
+
+    def put(self, key, value):
+        import pickle
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        # A single result larger than a quarter of the cache would only push everything else out
+        if len(blob) > self.max_size // 4:
+            return
+        self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                        (key, self.version, blob, len(blob), time.time()))
+        self.count('stores')
+        self.evict()
+
+    # Drop the least recently used results until the cache is under its target size
+    def evict(self):
+        total = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_size:
+            return
+        excess = total - int(self.max_size * EVICTION_TARGET)
+        keys = []
+        for key, size in self.db.execute("SELECT key, size FROM results ORDER BY last_used"):
+            keys.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self.db.executemany("DELETE FROM results WHERE key = ?", keys)
+        self.count('evictions', len(keys))
+
+    # Counters accumulated by every process that used this cache file, plus its current size
+    def stats(self):
+        stats = dict(self.db.execute("SELECT name, value FROM counters"))
+        stats['entries'], stats['bytes'] = self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        return stats
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Return the result of one mode for an archive from the cache, or compute it with read()
+# and store it. content=True keys the result by the whole file instead of the central directory.
+def cached_result(cache, file_path, mode, read, content=False):
+    if cache is None:
+        return read()
+    with metrics.stage('cache_lookup'):
+        archive_key = cache.archive_key(file_path, content)
+        if archive_key is None:
+            result = None
+        else:
+            key = f"{mode}|{archive_key}"
+            result = cache.get(key)
+    if result is None:
+        result = read()
+        if archive_key is not None:
+            with metrics.stage('cache_store'):
+                cache.put(key, result)
+    return result
+
+# Whether the archive can be left unopened until a mode misses the result cache
+def deferred_parse(cache, analyze=False, tree=False):
+    return cache is not None and (analyze or tree)
+
+def format_cache_stats(stats):
+    return (f"Cache: {stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions, "
+            f"{stats['entries']} results ({stats['bytes']} bytes)")
@@ -0,0 +1,148 @@
+import metrics
+from zip_records import (LocalFileHeader, CentralDirectoryHeader, EndOfCentralDirectory,
+                         carve_zip_records, resolve_zip64, record_size)
+from archive import ZipEntry, decode_filename
+from scoring import score_zip_origin
+from hex import map_file, record_to_dict, print_zip_records
+from analyze import print_zip_origin
+from cache import cached_result
+
+# A data descriptor (signature, CRC and two ZIP64 sizes) is at most this long
+MAX_DATA_DESCRIPTOR_SIZE = 24
+DATA_DESCRIPTOR_FLAG = 0x08
+
+# Where a carved record ends, with the file data of a local header; None when a data
+# descriptor holds the size instead
+def carved_record_end(record):
+    if isinstance(record, LocalFileHeader):
+        compressed_size = resolve_zip64(record).compressed_size
+        if compressed_size == 0 and record.flags & DATA_DESCRIPTOR_FLAG:
+            return None
+        return record.data_offset + compressed_size
+    return record.offset + record_size(record)
+
+# Split carved records into archives: an end of central directory record closes one, and
+# a local header starts the next when it comes after central directory headers (the end
+# was lost) or not right after the data of the previous entry (a truncated entry)
+def group_carved_records(records):
+    group = []
+    in_directory = False
+    end = None
+    for record in records:
+        if isinstance(record, LocalFileHeader) and group and (
+                in_directory or (end is not None and not 0 <= record.offset - end <= MAX_DATA_DESCRIPTOR_SIZE)):
+            yield group
+            group = []
+            in_directory = False
+        group.append(record)
+        end = carved_record_end(record) if isinstance(record, LocalFileHeader) else None
+        if isinstance(record, CentralDirectoryHeader):
+            in_directory = True
+        elif isinstance(record, EndOfCentralDirectory):
+            yield group
+            group = []
+            in_directory = False
+    if group:
+        yield group
+
+# A ZipEntry rebuilt from a carved central directory or local header, so carved entries
+# are scored like the entries of a valid archive
+def carved_entry(record):
+    record = resolve_zip64(record)
+    entry = ZipEntry()
+    entry.offset = record.offset
+    entry.flag_bits = record.flags
+    entry.compress_type = record.compression_method
+    entry.mod_time = record.mod_time
+    entry.mod_date = record.mod_date
+    entry.CRC = record.crc32
+    entry.compress_size = record.compressed_size
+    entry.file_size = record.uncompressed_size
+    entry.filename = decode_filename(record.file_name, record.flags)
+    entry.extra = record.extra
+    entry._extra_fields = None
+    if isinstance(record, CentralDirectoryHeader):
+        entry.create_version = record.version_made_by
+        entry.extract_version = record.version_needed
+        entry.disk_start = record.disk_number_start
+        entry.internal_attr = record.internal_attributes
+        entry.external_attr = record.external_attributes
+        entry.header_offset = record.local_header_offset
+        entry.comment = record.comment
+    else:
+        entry.create_version = entry.extract_version = record.version_needed
+        entry.disk_start = entry.internal_attr = entry.external_attr = 0
+        entry.header_offset = record.offset
+        entry.comment = b''
+    return entry
+
+# One carved archive: its extent, what was found of it, and the origin scored from its
+# entries. Entries come from the central directory, plus local headers it does not list
+# (all of them when the directory was lost). size bounds the end of truncated data.
+def read_carved_archive(records, size, verbose=False):
+    local_headers = [record for record in records if isinstance(record, LocalFileHeader)]
+    directory = [record for record in records if isinstance(record, CentralDirectoryHeader)]
+    eocd = next((record for record in records if isinstance(record, EndOfCentralDirectory)), None)
+    listed = {record.file_name for record in directory}
+    sources = [(record, 'central directory') for record in directory]
+    sources += [(record, 'local header') for record in local_headers if record.file_name not in listed]
+    entries = [carved_entry(record) for record, _ in sources]
+    last = records[-1]
+    return {
+        'start': records[0].offset,
+        'end': min(size, carved_record_end(last) or last.data_offset),
+        'local_headers': len(local_headers),
+        'central_directory_headers': len(directory),
+        'complete': eocd is not None and eocd.cd_entries_total == len(directory) == len(local_headers),
+        'entries': [{'name': entry.filename, 'compressed_size': entry.compress_size,
+                     'uncompressed_size': entry.file_size, 'source': source}
+                    for entry, (_, source) in zip(entries, sources)] if verbose else [],
+        'entry_count': len(entries),
+        'origin': score_zip_origin(entries),
+    }
+
+def carve_archives(data, verbose=False):
+    with metrics.stage('carve'):
+        archives = [read_carved_archive(records, len(data), verbose)
+                    for records in group_carved_records(carve_zip_records(data))]
+    metrics.count('archives_carved', len(archives))
+    return archives
+
+# Carve any file (disk image, truncated upload, archive glued to other data) without
+# requiring a valid archive; cached by content since every byte is scanned
+def read_carved_zip(file_path, verbose=False, cache=None):
+    def read():
+        with map_file(file_path) as data:
+            return {'file': file_path, 'size': len(data), 'archives': carve_archives(data, verbose)}
+    result = cached_result(cache, file_path, f"carve:verbose={verbose:d}", read, content=True)
+    result['file'] = file_path
+    return result
+
+def read_carved_records(file_path):
+    with map_file(file_path) as data:
+        return [record_to_dict(record) for record in carve_zip_records(data)]
+
+def print_carved_zip(result):
+    print(f"\nCarving ZIP records in: {result['file']} ({result['size']} bytes)")
+    if not result['archives']:
+        print("\nNo ZIP records found.")
+    for number, archive in enumerate(result['archives'], 1):
+        state = 'complete' if archive['complete'] else 'partial'
+        print(f"\nArchive {number} at offsets {archive['start']}-{archive['end']} ({state}): "
+              f"{archive['local_headers']} local headers, {archive['central_directory_headers']} central directory headers, "
+              f"{archive['entry_count']} entries")
+        for entry in archive['entries']:
+            print(f"  {entry['name']} ({entry['compressed_size']} / {entry['uncompressed_size']} bytes, from {entry['source']})")
+        print_zip_origin(archive['origin'])
+
+def carve_zip_file(file_path, verbose=False, cache=None):
+    result = read_carved_zip(file_path, verbose, cache)
+    with metrics.stage('output'):
+        print_carved_zip(result)
+    return result
+
+# Print every carved record, as -a -x does for the records of a valid archive
+def carve_zip_hex(file_path):
+    print(f"\nCarving ZIP file in hex format (little endian): {file_path}")
+    with map_file(file_path) as data:
+        print_zip_records(carve_zip_records(data))
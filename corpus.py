@@ -0,0 +1,277 @@
+import os
+import zlib
+import random
+import struct
+import argparse
+from zip_records import (LOCAL_FILE_HEADER, CENTRAL_DIRECTORY_HEADER, END_OF_CENTRAL_DIRECTORY,
+                         ZIP64_END_OF_CENTRAL_DIRECTORY, ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR,
+                         LOCAL_FILE_HEADER_SIGNATURE, CENTRAL_DIRECTORY_SIGNATURE,
+                         END_OF_CENTRAL_DIRECTORY_SIGNATURE, ZIP64_END_OF_CENTRAL_DIRECTORY_SIGNATURE,
+                         ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR_SIGNATURE, ZIP64_EXTRA_ID,
+                         ZIP64_LIMIT, ZIP64_COUNT_LIMIT, DATA_DESCRIPTOR_SIGNATURE)
+
+ZIP64_VERSION = 45
+UNIX_VERSION_MADE_BY = (3 << 8) | ZIP64_VERSION
+DOS_DATE_1980_01_01 = 0x21
+
+# (file name, entries, bytes per entry)
+SPARSE_ZIP64_CORPUS = [
+    ('zip64_one_5g.zip', 1, 5 * 1024 ** 3),
+    ('zip64_four_2g.zip', 4, 2 * 1024 ** 3),
+    ('zip64_70k_entries.zip', 70000, 1024),
+    ('zip64_200k_entries.zip', 200000, 0),
+]
+
+# Write a ZIP64 archive of stored, all-zero entries whose data is never written:
+# the data regions stay holes, so a multi-GB archive takes a few MB on disk.
+# CRCs are left at zero; the archives are meant for the parsers, not for extraction.
+def make_sparse_zip64(file_path, entries, entry_size):
+    local_header_offsets = []
+    with open(file_path, 'wb') as f:
+        for i in range(entries):
+            name = f"data/entry{i:07d}.bin".encode()
+            extra = struct.pack('<HHQQ', ZIP64_EXTRA_ID, 16, entry_size, entry_size)
+            local_header_offsets.append(f.tell())
+            f.write(LOCAL_FILE_HEADER.pack(
+                LOCAL_FILE_HEADER_SIGNATURE, ZIP64_VERSION, 0, 0, 0, DOS_DATE_1980_01_01, 0,
+                ZIP64_LIMIT, ZIP64_LIMIT, len(name), len(extra)))
+            f.write(name + extra)
+            f.seek(entry_size, os.SEEK_CUR)
+
+        cd_offset = f.tell()
+        for i, offset in enumerate(local_header_offsets):
+            name = f"data/entry{i:07d}.bin".encode()
+            extra = struct.pack('<HHQQQ', ZIP64_EXTRA_ID, 24, entry_size, entry_size, offset)
+            f.write(CENTRAL_DIRECTORY_HEADER.pack(
+                CENTRAL_DIRECTORY_SIGNATURE, UNIX_VERSION_MADE_BY, ZIP64_VERSION, 0, 0, 0,
+                DOS_DATE_1980_01_01, 0, ZIP64_LIMIT, ZIP64_LIMIT, len(name), len(extra), 0, 0, 0,
+                0o100644 << 16, ZIP64_LIMIT))
+            f.write(name + extra)
+        cd_size = f.tell() - cd_offset
+
+        zip64_eocd_offset = f.tell()
+        f.write(ZIP64_END_OF_CENTRAL_DIRECTORY.pack(
+            ZIP64_END_OF_CENTRAL_DIRECTORY_SIGNATURE, ZIP64_END_OF_CENTRAL_DIRECTORY.size - 12,
+            UNIX_VERSION_MADE_BY, ZIP64_VERSION, 0, 0, entries, entries, cd_size, cd_offset))
+        f.write(ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR.pack(
+            ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR_SIGNATURE, 0, zip64_eocd_offset, 1))
+        f.write(END_OF_CENTRAL_DIRECTORY.pack(
+            END_OF_CENTRAL_DIRECTORY_SIGNATURE, 0, 0,
+            min(entries, ZIP64_COUNT_LIMIT), min(entries, ZIP64_COUNT_LIMIT),
+            min(cd_size, ZIP64_LIMIT), min(cd_offset, ZIP64_LIMIT), 0))
+
+def make_sparse_zip64_corpus(directory):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for name, entries, entry_size in SPARSE_ZIP64_CORPUS:
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            make_sparse_zip64(path, entries, entry_size)
+        paths.append(path)
+    return paths
+
+DOS_TIME_12_00 = 12 << 11
+DOS_DATE_2024_01_01 = (44 << 9) | (1 << 5) | 1
+UNIX_TIME_2024_01_01 = 1704110400
+FILETIME_2024_01_01 = (UNIX_TIME_2024_01_01 + 11644473600) * 10 ** 7
+DATA_DESCRIPTOR_FLAG = 0x08
+UTF8_FLAG = 0x800
+# Entries up to this size are filled from a pool of text and deflated; larger ones are
+# stored holes like the sparse ZIP64 corpus
+INLINE_LIMIT = 1024 * 1024
+
+def ntfs_extra():
+    times = struct.pack('<QQQ', FILETIME_2024_01_01, FILETIME_2024_01_01, FILETIME_2024_01_01)
+    return struct.pack('<HHIHH', 0x000A, 32, 0, 0x0001, 24) + times
+
+# Extended timestamp (0x5455): flags, then the times the flags announce
+def extended_timestamp_extra(flags, times):
+    return struct.pack('<HHB', 0x5455, 1 + 4 * times, flags) + struct.pack('<I', UNIX_TIME_2024_01_01) * times
+
+# Info-ZIP new Unix extra (0x7875): version 1, 4-byte uid and gid
+def unix_uid_gid_extra():
+    return struct.pack('<HHBBIBI', 0x7875, 11, 1, 4, 1000, 4, 1000)
+
+# Info-ZIP Unicode path (0x7075): version 1, CRC of the header name, UTF-8 name
+def unicode_path_extra(raw_name, name):
+    utf8_name = name.encode('utf-8')
+    return struct.pack('<HHBI', 0x7075, 5 + len(utf8_name), 1, zlib.crc32(raw_name)) + utf8_name
+
+# What each archiver writes, after the archives it makes: version made by (host << 8 |
+# version), compression, data descriptors, UTF-8 names, the extra fields of the local and
+# central headers (functions of the raw and decoded name), a single root folder, and the
+# extra entries it adds (__MACOSX AppleDouble files, Thumbs.db)
+ORIGIN_STYLES = {
+    'explorer': {
+        'made_by': 20, 'method': 8, 'data_descriptor': False, 'utf8': False,
+        'local_extra': lambda raw, name: b'',
+        'central_extra': lambda raw, name: ntfs_extra(),
+        'root': None, 'macosx': False, 'thumbs_db': True, 'names': 'ascii',
+    },
+    'compress': {
+        'made_by': (3 << 8) | 21, 'method': 8, 'data_descriptor': True, 'utf8': True,
+        'local_extra': lambda raw, name: extended_timestamp_extra(3, 2) + unix_uid_gid_extra(),
+        'central_extra': lambda raw, name: extended_timestamp_extra(3, 1) + unix_uid_gid_extra(),
+        'root': 'Archive', 'macosx': True, 'thumbs_db': False, 'names': 'ascii',
+    },
+    'infozip': {
+        'made_by': (3 << 8) | 30, 'method': 8, 'data_descriptor': False, 'utf8': False,
+        'local_extra': lambda raw, name: extended_timestamp_extra(3, 2) + unix_uid_gid_extra(),
+        'central_extra': lambda raw, name: extended_timestamp_extra(3, 1) + unix_uid_gid_extra(),
+        'root': 'archive', 'macosx': False, 'thumbs_db': False, 'names': 'ascii',
+    },
+    '7zip': {
+        'made_by': 63, 'method': 0, 'data_descriptor': False, 'utf8': True,
+        'local_extra': lambda raw, name: b'',
+        'central_extra': lambda raw, name: ntfs_extra(),
+        'root': None, 'macosx': False, 'thumbs_db': False, 'names': 'unicode',
+    },
+    'winrar': {
+        'made_by': 20, 'method': 8, 'data_descriptor': False, 'utf8': False,
+        'local_extra': lambda raw, name: ntfs_extra() + unicode_path_extra(raw, name),
+        'central_extra': lambda raw, name: ntfs_extra() + unicode_path_extra(raw, name),
+        'root': None, 'macosx': False, 'thumbs_db': False, 'names': 'unicode',
+    },
+    'bandizip': {
+        'made_by': 20, 'method': 8, 'data_descriptor': False, 'utf8': True,
+        'local_extra': lambda raw, name: b'',
+        'central_extra': lambda raw, name: b'',
+        'root': 'archive', 'macosx': False, 'thumbs_db': False, 'names': 'unicode',
+    },
+}
+
+# (name, size) of the entries an archiver would write for entries files of entry_size
+# bytes spread over 16 folders; folders end with '/' and have no data
+def style_entry_names(style, entries, entry_size):
+    spec = ORIGIN_STYLES[style]
+    prefix = f"{spec['root']}/" if spec['root'] else ''
+    stem = 'файл' if spec['names'] == 'unicode' else 'file'
+    names = [(prefix, 0)] if prefix else []
+    folders = set()
+    for i in range(entries):
+        folder = f"{prefix}dir{i % 16}/"
+        if folder not in folders:
+            folders.add(folder)
+            names.append((folder, 0))
+        names.append((f"{folder}{stem}{i:07d}.txt", entry_size))
+    if spec['macosx']:
+        names += [(f"__MACOSX/{name.rpartition('/')[0]}/._{name.rpartition('/')[2]}", 82)
+                  for name, _ in names if not name.endswith('/')]
+    if spec['thumbs_db']:
+        names.append((f"{prefix}Thumbs.db", 512))
+    return names
+
+# Write an archive the way the given archiver (a key of ORIGIN_STYLES) would, with the
+# same content for the same seed. ZIP64 records are added when the counts, sizes or
+# offsets need them, so this covers 1 entry of 1 KB up to 1M entries or multi-GB files.
+def make_style_zip(file_path, style, entries, entry_size, seed=0):
+    spec = ORIGIN_STYLES[style]
+    pool = random.Random(seed).randbytes(INLINE_LIMIT // 2).hex().encode()
+    central = []
+    with open(file_path, 'wb', buffering=1024 * 1024) as f:
+        offset = 0
+        for i, (name, size) in enumerate(style_entry_names(style, entries, entry_size)):
+            raw_name = name.encode('utf-8') if spec['utf8'] else name.encode('cp437', 'replace')
+            flags = UTF8_FLAG if spec['utf8'] and not name.isascii() else 0
+            sparse = size > INLINE_LIMIT
+            method = 0 if sparse or name.endswith('/') else spec['method']
+            if sparse:
+                data, crc = b'', 0
+                compressed_size = size
+            else:
+                start = (i * 4099) % (len(pool) - size + 1)
+                raw_data = pool[start:start + size]
+                crc = zlib.crc32(raw_data)
+                data = zlib.compress(raw_data, 6, wbits=-15) if method == 8 else raw_data
+                compressed_size = len(data)
+            descriptor = spec['data_descriptor'] and not name.endswith('/')
+            if descriptor:
+                flags |= DATA_DESCRIPTOR_FLAG
+            zip64 = size >= ZIP64_LIMIT or compressed_size >= ZIP64_LIMIT
+
+            local_extra = spec['local_extra'](raw_name, name)
+            if zip64:
+                local_extra = struct.pack('<HHQQ', ZIP64_EXTRA_ID, 16, size, compressed_size) + local_extra
+            if descriptor:
+                header_sizes = (0, 0, 0)
+            elif zip64:
+                header_sizes = (crc, ZIP64_LIMIT, ZIP64_LIMIT)
+            else:
+                header_sizes = (crc, compressed_size, size)
+            f.write(LOCAL_FILE_HEADER.pack(
+                LOCAL_FILE_HEADER_SIGNATURE, 45 if zip64 else 20, flags, method, DOS_TIME_12_00,
+                DOS_DATE_2024_01_01, *header_sizes, len(raw_name), len(local_extra)))
+            f.write(raw_name + local_extra)
+            if sparse:
+                f.seek(size, os.SEEK_CUR)
+            else:
+                f.write(data)
+            if descriptor:
+                size_format = '<QQ' if zip64 else '<II'
+                f.write(DATA_DESCRIPTOR_SIGNATURE + struct.pack('<I', crc) + struct.pack(size_format, compressed_size, size))
+            central.append((raw_name, name, flags, method, crc, compressed_size, size, offset))
+            offset = f.tell()
+
+        cd_offset = offset
+        for raw_name, name, flags, method, crc, compressed_size, size, header_offset in central:
+            zip64_values = [value for value in (size, compressed_size, header_offset) if value >= ZIP64_LIMIT]
+            extra = spec['central_extra'](raw_name, name)
+            if zip64_values:
+                extra = struct.pack('<HH', ZIP64_EXTRA_ID, 8 * len(zip64_values)) + b''.join(
+                    struct.pack('<Q', value) for value in zip64_values) + extra
+            external_attr = (0o40755 << 16 | 0x10) if name.endswith('/') else (0o100644 << 16)
+            f.write(CENTRAL_DIRECTORY_HEADER.pack(
+                CENTRAL_DIRECTORY_SIGNATURE, spec['made_by'], 45 if zip64_values else 20, flags, method,
+                DOS_TIME_12_00, DOS_DATE_2024_01_01, crc, min(compressed_size, ZIP64_LIMIT), min(size, ZIP64_LIMIT),
+                len(raw_name), len(extra), 0, 0, 0, external_attr, min(header_offset, ZIP64_LIMIT)))
+            f.write(raw_name + extra)
+        cd_size = f.tell() - cd_offset
+        count = len(central)
+
+        if count >= ZIP64_COUNT_LIMIT or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+            zip64_eocd_offset = f.tell()
+            f.write(ZIP64_END_OF_CENTRAL_DIRECTORY.pack(
+                ZIP64_END_OF_CENTRAL_DIRECTORY_SIGNATURE, ZIP64_END_OF_CENTRAL_DIRECTORY.size - 12,
+                spec['made_by'], ZIP64_VERSION, 0, 0, count, count, cd_size, cd_offset))
+            f.write(ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR.pack(
+                ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR_SIGNATURE, 0, zip64_eocd_offset, 1))
+        f.write(END_OF_CENTRAL_DIRECTORY.pack(
+            END_OF_CENTRAL_DIRECTORY_SIGNATURE, 0, 0, min(count, ZIP64_COUNT_LIMIT), min(count, ZIP64_COUNT_LIMIT),
+            min(cd_size, ZIP64_LIMIT), min(cd_offset, ZIP64_LIMIT), 0))
+
+# (file name, style, entries, bytes per entry) of the benchmark corpus; the full corpus
+# adds the 1M-entry and multi-GB archives
+STYLE_CORPUS = [
+    ('explorer_1x1k.zip', 'explorer', 1, 1024),
+    ('compress_1kx4k.zip', 'compress', 1000, 4096),
+    ('infozip_10kx1k.zip', 'infozip', 10000, 1024),
+    ('7zip_100kx0.zip', '7zip', 100000, 0),
+    ('winrar_1kx64k.zip', 'winrar', 1000, 64 * 1024),
+    ('bandizip_5kx16k.zip', 'bandizip', 5000, 16 * 1024),
+]
+FULL_STYLE_CORPUS = STYLE_CORPUS + [
+    ('infozip_1mx0.zip', 'infozip', 1000000, 0),
+    ('7zip_2x3g.zip', '7zip', 2, 3 * 1024 ** 3),
+]
+
+# Generate the style corpus in directory (existing files are kept); returns the paths
+def make_style_corpus(directory, full=False):
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for name, style, entries, entry_size in (FULL_STYLE_CORPUS if full else STYLE_CORPUS):
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            make_style_zip(path, style, entries, entry_size)
+        paths.append(path)
+    return paths
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Generate ZIP archives for benchmarking the analyzers.')
+    parser.add_argument('-d', '--directory', type=str, required=True, help='Directory to write the corpus to')
+    parser.add_argument('--styles', action='store_true', help='Write archives in the styles of Windows Explorer, macOS Compress, Info-ZIP, 7-Zip, WinRAR and Bandizip instead of the sparse ZIP64 corpus')
+    parser.add_argument('--full', action='store_true', help='With --styles, add the 1M-entry and multi-GB archives')
+    args = parser.parse_args()
+
+    paths = make_style_corpus(args.directory, args.full) if args.styles else make_sparse_zip64_corpus(args.directory)
+    for path in paths:
+        print(f"{path}: {os.path.getsize(path)} bytes")
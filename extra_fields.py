@@ -0,0 +1,283 @@
+import struct
+import datetime
+from zip_records import ZIP64_EXTRA_ID, iter_extra_fields
+
+NTFS_EXTRA_ID = 0x000A
+EXTENDED_TIMESTAMP_EXTRA_ID = 0x5455
+INFOZIP_UNIX_EXTRA_ID = 0x5855
+UNIX_UID_GID_EXTRA_ID = 0x7875
+UNICODE_PATH_EXTRA_ID = 0x7075
+
+# NTFS: 4 reserved bytes, then (tag, size) attributes; tag 1 holds the three FILETIMEs
+NTFS_ATTRIBUTE = struct.Struct('<HH')
+NTFS_TIMES = struct.Struct('<QQQ')
+NTFS_TIMES_TAG = 0x0001
+NTFS_RESERVED_SIZE = 4
+FILETIME_EPOCH = datetime.datetime(1601, 1, 1)
+UNIX_TIME = struct.Struct('<I')
+# Info-ZIP Unix (0x5855): access and modification times, then uid and gid in local headers only
+INFOZIP_UNIX_TIMES = struct.Struct('<II')
+INFOZIP_UNIX_IDS = struct.Struct('<HH')
+UNICODE_PATH_HEADER = struct.Struct('<BI')
+ZIP64_VALUE = struct.Struct('<Q')
+
+# Extended timestamp flag bits, in the order the times are stored
+EXTENDED_TIMESTAMP_FLAGS = ((1, 'modified'), (2, 'accessed'), (4, 'created'))
+
+# Marks a lazy attribute that was not decoded yet (None is a valid decoded value)
+UNSET = object()
+
+# An attribute of a view decoded from its data on first access and kept in the slot
+# named '_' + attribute, so reading a view only pays for the values it uses. The slots
+# start out UNSET (see ExtraField.__init__), which is cheaper than catching AttributeError.
+class LazyField:
+    def __init__(self, decode):
+        self.decode = decode
+        self.slot = None
+
+    def __set_name__(self, owner, name):
+        self.slot = owner.__dict__['_' + name]
+        owner.lazy_slots = owner.lazy_slots + ('_' + name,)
+
+    def __get__(self, view, owner=None):
+        if view is None:
+            return self
+        value = self.slot.__get__(view, owner)
+        if value is UNSET:
+            value = self.decode(view)
+            self.slot.__set__(view, value)
+        return value
+
+def filetime_to_datetime(value):
+    try:
+        return FILETIME_EPOCH + datetime.timedelta(microseconds=value // 10)
+    except OverflowError:
+        return None
+
+def unix_time_to_datetime(value):
+    try:
+        return datetime.datetime.fromtimestamp(value)
+    except (OverflowError, OSError, ValueError):
+        return None
+
+# One extra field of an entry; subclasses registered in EXTRA_FIELD_DECODERS decode their
+# values lazily. Values missing from a truncated field are None.
+class ExtraField:
+    __slots__ = ('header_id', 'data')
+    type = 'Unknown'
+    title = 'Unknown extra field'
+    lazy_slots = ()
+
+    def __init__(self, header_id, data):
+        self.header_id = header_id
+        self.data = data
+        for slot in self.lazy_slots:
+            setattr(self, slot, UNSET)
+
+    # The values read_extra_info reports for this field
+    def report(self):
+        return {'type': self.type}
+
+class NtfsExtra(ExtraField):
+    __slots__ = ('_times', '_modified', '_accessed', '_created')
+    type = 'NTFS'
+    title = 'NTFS timestamps'
+
+    # (modified, accessed, created) FILETIMEs of the timestamps attribute, None without it
+    @LazyField
+    def times(self):
+        data = self.data
+        pos = NTFS_RESERVED_SIZE
+        while pos + NTFS_ATTRIBUTE.size <= len(data):
+            tag, size = NTFS_ATTRIBUTE.unpack_from(data, pos)
+            pos += NTFS_ATTRIBUTE.size
+            if tag == NTFS_TIMES_TAG and size >= NTFS_TIMES.size and pos + NTFS_TIMES.size <= len(data):
+                return NTFS_TIMES.unpack_from(data, pos)
+            pos += size
+        return None
+
+    @LazyField
+    def modified(self):
+        times = self.times
+        return filetime_to_datetime(times[0]) if times else None
+
+    @LazyField
+    def accessed(self):
+        times = self.times
+        return filetime_to_datetime(times[1]) if times else None
+
+    @LazyField
+    def created(self):
+        times = self.times
+        return filetime_to_datetime(times[2]) if times else None
+
+    def report(self):
+        return {'type': self.type, 'created': self.created, 'accessed': self.accessed, 'modified': self.modified}
+
+# Central directory copies usually keep the flags of the local header but only store the
+# modification time, so times announced by the flags may be missing
+class ExtendedTimestampExtra(ExtraField):
+    __slots__ = ('_times', '_modified', '_accessed', '_created')
+    type = 'Unix'
+    title = 'Extended timestamp'
+
+    # Unix times stored in the field, by name
+    @LazyField
+    def times(self):
+        data = self.data
+        times = {}
+        if not data:
+            return times
+        pos = 1
+        for bit, name in EXTENDED_TIMESTAMP_FLAGS:
+            if data[0] & bit:
+                if pos + UNIX_TIME.size > len(data):
+                    break
+                times[name] = UNIX_TIME.unpack_from(data, pos)[0]
+                pos += UNIX_TIME.size
+        return times
+
+    @LazyField
+    def modified(self):
+        time = self.times.get('modified')
+        return unix_time_to_datetime(time) if time is not None else None
+
+    @LazyField
+    def accessed(self):
+        time = self.times.get('accessed')
+        return unix_time_to_datetime(time) if time is not None else None
+
+    @LazyField
+    def created(self):
+        time = self.times.get('created')
+        return unix_time_to_datetime(time) if time is not None else None
+
+    def report(self):
+        return {'type': self.type, 'created': self.created, 'accessed': self.accessed, 'modified': self.modified}
+
+# Info-ZIP new Unix field: version, then uid and gid with their sizes
+class UnixUidGidExtra(ExtraField):
+    __slots__ = ('_ids',)
+    type = 'UID/GID'
+    title = 'Unix UID/GID'
+
+    @LazyField
+    def ids(self):
+        data = self.data
+        if len(data) < 2:
+            return None, None
+        uid_size = data[1]
+        gid_at = 2 + uid_size
+        if gid_at >= len(data) or gid_at + 1 + data[gid_at] > len(data):
+            return None, None
+        uid = int.from_bytes(data[2:gid_at], 'little')
+        gid = int.from_bytes(data[gid_at + 1:gid_at + 1 + data[gid_at]], 'little')
+        return uid, gid
+
+    @property
+    def uid(self):
+        return self.ids[0]
+
+    @property
+    def gid(self):
+        return self.ids[1]
+
+    def report(self):
+        return {'type': self.type, 'uid': self.uid, 'gid': self.gid}
+
+class InfoZipUnixExtra(ExtraField):
+    __slots__ = ('_accessed', '_modified', '_ids')
+    type = 'Info-ZIP Unix'
+    title = 'Info-ZIP Unix'
+
+    @LazyField
+    def accessed(self):
+        if len(self.data) < INFOZIP_UNIX_TIMES.size:
+            return None
+        return unix_time_to_datetime(INFOZIP_UNIX_TIMES.unpack_from(self.data)[0])
+
+    @LazyField
+    def modified(self):
+        if len(self.data) < INFOZIP_UNIX_TIMES.size:
+            return None
+        return unix_time_to_datetime(INFOZIP_UNIX_TIMES.unpack_from(self.data)[1])
+
+    @LazyField
+    def ids(self):
+        if len(self.data) < INFOZIP_UNIX_TIMES.size + INFOZIP_UNIX_IDS.size:
+            return None, None
+        return INFOZIP_UNIX_IDS.unpack_from(self.data, INFOZIP_UNIX_TIMES.size)
+
+    @property
+    def uid(self):
+        return self.ids[0]
+
+    @property
+    def gid(self):
+        return self.ids[1]
+
+    def report(self):
+        return {'type': self.type, 'accessed': self.accessed, 'modified': self.modified,
+                'uid': self.uid, 'gid': self.gid}
+
+# UTF-8 name of an entry whose header name is in a legacy code page, with the CRC-32 of
+# that header name to tell whether the name was changed without updating this field
+class UnicodePathExtra(ExtraField):
+    __slots__ = ('_header', '_name')
+    type = 'Unicode Path'
+    title = 'Info-ZIP Unicode path'
+
+    # (version, CRC-32 of the header name)
+    @LazyField
+    def header(self):
+        if len(self.data) < UNICODE_PATH_HEADER.size:
+            return None, None
+        return UNICODE_PATH_HEADER.unpack_from(self.data)
+
+    @LazyField
+    def name(self):
+        if len(self.data) < UNICODE_PATH_HEADER.size:
+            return None
+        return bytes(self.data[UNICODE_PATH_HEADER.size:]).decode('utf-8', errors='replace')
+
+    def report(self):
+        return {'type': self.type, 'name': self.name}
+
+# Only the values whose header field overflowed are stored, as 8-byte sizes/offsets
+# (a 4-byte disk number may follow; it is not decoded here)
+class Zip64Extra(ExtraField):
+    __slots__ = ('_values',)
+    type = 'ZIP64'
+    title = 'ZIP64 extended information'
+
+    @LazyField
+    def values(self):
+        data = self.data
+        return [ZIP64_VALUE.unpack_from(data, i)[0] for i in range(0, len(data) - len(data) % 8, 8)]
+
+    def report(self):
+        return {'type': self.type, 'values': self.values}
+
+# Header ID -> view class of every extra field the tool decodes
+EXTRA_FIELD_DECODERS = {
+    NTFS_EXTRA_ID: NtfsExtra,
+    EXTENDED_TIMESTAMP_EXTRA_ID: ExtendedTimestampExtra,
+    UNIX_UID_GID_EXTRA_ID: UnixUidGidExtra,
+    INFOZIP_UNIX_EXTRA_ID: InfoZipUnixExtra,
+    UNICODE_PATH_EXTRA_ID: UnicodePathExtra,
+    ZIP64_EXTRA_ID: Zip64Extra,
+}
+
+# Views of the known fields among the (header_id, data) pairs of an extra field; nothing
+# is decoded until a view attribute is read
+def decode_extra_fields(fields):
+    views = []
+    for header_id, data in fields:
+        decoder = EXTRA_FIELD_DECODERS.get(header_id)
+        if decoder is not None:
+            views.append(decoder(header_id, data))
+    return views
+
+# Views of the known fields of raw extra field bytes
+def read_extra_fields(extra):
+    return decode_extra_fields(iter_extra_fields(extra))
@@ -1,35 +1,72 @@
-import binascii
+import sys
+import contextlib
+import metrics
+from zip_records import (LocalFileHeader, CentralDirectoryHeader,
+                         EndOfCentralDirectory, Zip64EndOfCentralDirectory,
+                         Zip64EndOfCentralDirectoryLocator, iter_zip_records,
+                         seek_zip_records, read_zip64_extra, ZIP64_EXTRA_ID)
+from extra_fields import read_extra_fields
+from archive import shared_archive
+from byte_source import open_source, close_source
+from cache import cached_result
 
-def view_zip_in_hex(file_path):
+BYTES_PER_LINE = 16
+SECTOR_SIZE = 512
+DUMP_BLOCK_SIZE = 64 * 1024
+
+# Printable ASCII maps to itself, everything else to '.'
+ASCII_TABLE = bytes(b if 32 <= b <= 126 else ord('.') for b in range(256))
+
+# Format one block of the dump; address is the file offset of block[0]
+def format_hex_block(block, address):
+    hex_text = block.hex(' ').upper()
+    ascii_text = block.translate(ASCII_TABLE).decode('ascii')
+    lines = []
+    for i in range(0, len(block), BYTES_PER_LINE):
+        position = address + i
+        if position % SECTOR_SIZE == 0 and position != 0:
+            lines.append(f"-- Sector {position // SECTOR_SIZE} -- Assuming 512 Bytes ---")
+        hex_line = hex_text[i * 3:(i + BYTES_PER_LINE) * 3 - 1]
+        lines.append(f"[{position:08X}] {hex_line}  {ascii_text[i:i + BYTES_PER_LINE]}")
+    lines.append('')
+    return '\n'.join(lines)
+
+# Map a whole file read-only (an empty file maps to b''); URLs are read with range requests
+@contextlib.contextmanager
+def map_file(file_path):
+    data = open_source(file_path)[0]
+    try:
+        yield data
+    finally:
+        close_source(data)
+
+# Data of the archive opened by the caller (or the buffer it passed as data), or of
+# file_path mapped for the duration. Unlike archive.shared_archive this also works on
+# files that are not valid archives.
+@contextlib.contextmanager
+def archive_data(file_path, archive=None, data=None):
+    if archive is not None:
+        yield archive.data
+    elif data is not None:
+        yield data
+    else:
+        with map_file(file_path) as data:
+            yield data
+
+def view_zip_in_hex(file_path, offset=0, length=None, archive=None, data=None):
     print(f"\nViewing ZIP file in hex format: {file_path}\n")
-    with open(file_path, 'rb') as f:
-        content = f.read()
-        hex_content = binascii.hexlify(content).decode('utf-8')
-        for i in range(0, len(hex_content), 32):
-            if i % 1024 == 0 and i != 0:
-                sector_number = i // 1024
-                print(f"-- Sector {sector_number} -- Assuming 512 Bytes ---")
-            hex_line = hex_content[i:i+32]
-            ascii_line = ''.join(chr(int(hex_line[j:j+2], 16)) if 32 <= int(hex_line[j:j+2], 16) <= 126 else '.' for j in range(0, len(hex_line), 2))
-            print(f"[{i//2:08X}] {' '.join(hex_line[k:k+2].upper() for k in range(0, len(hex_line), 2))}  {ascii_line}")
-
-def big_edian_2B(little_endian_hex):
-    big_endian_hex = little_endian_hex[6:8] + little_endian_hex[4:6] + little_endian_hex[2:4] + little_endian_hex[0:2]
-    dec = int(big_endian_hex, 16) * 2
-    return dec
-
-def big_edian_4B(little_endian_hex):
-    big_endian_hex = little_endian_hex[14:16] + little_endian_hex[12:14] + little_endian_hex[10:12] + little_endian_hex[8:10] + little_endian_hex[6:8] + little_endian_hex[4:6] + little_endian_hex[2:4] + little_endian_hex[0:2]
-    dec = int(big_endian_hex, 16) * 2
-    return dec
-
-def find_next_tag(hex_content, index):
-    while index < len(hex_content):
-        starting_tag = hex_content[index:index + 8]
-        if starting_tag == "504B0304" or starting_tag == "504B0102" or starting_tag == "504B0506":
-            return index
-        index += 1
-    return -1
+    with archive_data(file_path, archive, data) as data:
+        file_size = len(data)
+        if offset < 0 or offset > file_size:
+            print(f"Error: Offset {offset} is outside the file ({file_size} bytes).")
+            return
+        end = file_size if length is None else min(file_size, offset + length)
+        out = sys.stdout
+        with metrics.stage('hex_dump'):
+            for position in range(offset, end, DUMP_BLOCK_SIZE):
+                block = data[position:min(end, position + DUMP_BLOCK_SIZE)]
+                out.write(format_hex_block(block, position))
+        metrics.count('hex_dump_bytes', max(0, end - offset))
 
 def dec_date(decimal_value):
     decimal_value //= 2
@@ -47,193 +84,175 @@ def dec_time(decimal_value):
     # print(f"{decimal_value} = {hours:02}:{minutes:02}:{seconds:02}")
     return f"{hours:02}:{minutes:02}:{seconds:02}"
 
-def extrafield_infos(extra_field):
-    ID = extra_field[0:4]
-    size_of_extra_field = extra_field[4:8]
-    if ID == "0A00":
-        type = "NTFS"
-        reserved = extra_field[8:16]
-        tag_of_attribute = extra_field[16:20]
-        size_of_attribute = extra_field[20:24]
-        last_modified = extra_field[24:40]
-        last_accessed = extra_field[40:56]
-        created = extra_field[56:72]
-    if ID == "5554":
-        type = "Extended Timestamp"
-        info_bits = extra_field[8:10]
-        last_modified = extra_field[10:18]
-        last_accessed = extra_field[18:26]
-        change = extra_field[26:34]
-    if ID == "7578":
-        type = "Unix UID/GID"
-        version = extra_field[8:10]
-        size_of_UID_field = extra_field[10:12]
-        size_of_UID_field_dec = int(size_of_UID_field, 16) * 2
-        UID = extra_field[12:12 + size_of_UID_field_dec]
-        size_of_GID_field = extra_field[12 + size_of_UID_field_dec:12 + size_of_UID_field_dec + 2]
-        size_of_GID_field_dec = int(size_of_GID_field, 16) * 2
-        GID = extra_field[12 + size_of_UID_field_dec + 2:12 + size_of_UID_field_dec + 2 + size_of_GID_field_dec]
-    if ID == "5558":
-        type = "Unix"
-        last_accessed = extra_field[8:16]
-        last_modified = extra_field[16:24]
-        UID = extra_field[24:28]
-        GID = extra_field[28:32]
-    if ID == "7570":
-        type = "Info-ZIP unicode path"
-        version = extra_field[8:10]
-        CRC32_file_name = extra_field[10:18]
-        file_name = extra_field[18:]
-
-def parse_zip_file(hex_content):
-    index = 0
-    while index < len(hex_content):
-        starting_tag = hex_content[index:index + 8]
-        # print(f"\nIndex: {index} = {starting_tag}")
-
-        if starting_tag == "504B0304":
-            #? Local File Header
-            version = hex_content[index + 8:index + 12]
-            general_purpose_bit_flag = hex_content[index + 12:index + 16]
-            compression_method = hex_content[index + 16:index + 20]
-            file_last_mod_time = hex_content[index + 20:index + 24]
-            file_last_mod_date = hex_content[index + 24:index + 28]
-            crc = hex_content[index + 28:index + 36]
-            compressed_size = hex_content[index + 36:index + 44]
-            uncompressed_size = hex_content[index + 44:index + 52]
-            file_name_length = hex_content[index + 52:index + 56]
-            extra_field_length = hex_content[index + 56:index + 60]
-
-        elif starting_tag == "504B0102":
-            #? Central Directory File Header
-            version_made = hex_content[index + 8:index + 12]
-            version = hex_content[index + 12:index + 16]
-            general_purpose_bit_flag = hex_content[index + 16:index + 20]
-            compression_method = hex_content[index + 20:index + 24]
-            file_last_mod_time = hex_content[index + 24:index + 28]
-            file_last_mod_date = hex_content[index + 28:index + 32]
-            crc = hex_content[index + 32:index + 40]
-            compressed_size = hex_content[index + 40:index + 48]
-            uncompressed_size = hex_content[index + 48:index + 56]
-            file_name_length = hex_content[index + 56:index + 60]
-            extra_field_length = hex_content[index + 60:index + 64]
-            file_comment_length = hex_content[index + 64:index + 68]
-            disk_number_start = hex_content[index + 68:index + 72]
-            internal_file_attributes = hex_content[index + 72:index + 76]
-            external_file_attributes = hex_content[index + 76:index + 84]
-            relative_offset_local_header = hex_content[index + 84:index + 92]
-
-        elif starting_tag == "504B0506":
-            #? End of Central Directory
-            print(f"\nStarting tag: {starting_tag} = End of Central Directory")
-            number_of_this_disk = hex_content[index + 8:index + 12]
-            disk_where_central_directory_starts = hex_content[index + 12:index + 16]
-            number_of_central_directory_records_on_this_disk = hex_content[index + 16:index + 20]
-            total_number_of_central_directory_records = hex_content[index + 20:index + 24]
-            size_of_central_directory = hex_content[index + 24:index + 32]
-            offset_of_start_of_central_directory = hex_content[index + 32:index + 40]
-            zip_file_comment_length = hex_content[index + 40:index + 44]
-
-        if starting_tag != "504B0506":
-            file_name_length_dec = big_edian_2B(file_name_length)
-            extra_field_length_dec = big_edian_2B(extra_field_length)
-            if starting_tag == "504B0102":
-                file_comment_length_dec = big_edian_2B(file_comment_length)
-            compressed_size_dec = big_edian_4B(compressed_size)
-
-            if starting_tag == "504B0304":
-                file_name = hex_content[index + 60:index + 60 + file_name_length_dec]
-                filename = bytes.fromhex(file_name).decode('utf-8', errors='replace')
-                extra_field = hex_content[index + 60 + file_name_length_dec:index + 60 + file_name_length_dec + extra_field_length_dec]
-                # extrafield = bytes.fromhex(extra_field).decode('utf-8', errors='replace')
-
-                if filename.endswith('/'):
-                    print(f"\nStarting tag: {starting_tag} = Local Folder Header")
-                else:
-                    print(f"\nStarting tag: {starting_tag} = Local File Header")
-            elif starting_tag == "504B0102":
-                file_name = hex_content[index + 92:index + 92 + file_name_length_dec]
-                filename = bytes.fromhex(file_name).decode('utf-8', errors='replace')
-                extra_field = hex_content[index + 92 + file_name_length_dec:index + 92 + file_name_length_dec + extra_field_length_dec]
-                # extrafield = bytes.fromhex(extra_field).decode('utf-8', errors='replace')
-                file_comment = hex_content[index + 92 + file_name_length_dec + extra_field_length_dec:index + 92 + file_name_length_dec + extra_field_length_dec + file_comment_length_dec]
-                filecomment = bytes.fromhex(file_comment).decode('utf-8', errors='replace')
-
-                if filename.endswith('/'):
-                    print(f"\nStarting tag: {starting_tag} = Central Directory Folder Header")
-                else:
-                    print(f"\nStarting tag: {starting_tag} = Central Directory File Header")
-
-            if starting_tag == "504B0102":
-                print(f"Version made by: {version_made} = {big_edian_2B(version)}")
-
-            print(f"Version need to extract: {version} = {big_edian_2B(version)}")
-            print(f"General purpose bit flag: {general_purpose_bit_flag} = {big_edian_2B(general_purpose_bit_flag)}")
-            print(f"Compression method: {compression_method} = {big_edian_2B(compression_method)}")
-            print(f"File last modification time: {file_last_mod_time} = {dec_time(big_edian_2B(file_last_mod_time))}")
-            print(f"File last modification date: {file_last_mod_date} = {dec_date(big_edian_2B(file_last_mod_date))}")
-            print(f"CRC-32: {crc} = {big_edian_4B(crc)}")
-            print(f"Compressed size: {compressed_size} = {compressed_size_dec}")
-            print(f"Uncompressed size: {uncompressed_size} = {big_edian_4B(uncompressed_size)}")
-            print(f"File name length: {file_name_length} = {file_name_length_dec}")
-            print(f"Extra field length: {extra_field_length} = {extra_field_length_dec}")
-
-            if starting_tag == "504B0102":
-                print(f"File comment length: {file_comment_length} = {big_edian_2B(file_comment_length)}")
-                print(f"Disk number starts: {disk_number_start} = {big_edian_2B(disk_number_start)}")
-                print(f"Internal file attributes: {internal_file_attributes} = {big_edian_2B(internal_file_attributes)}")
-                print(f"External file attributes: {external_file_attributes} = {big_edian_4B(external_file_attributes)}")
-                print(f"Relative offset of local header: {relative_offset_local_header} = {big_edian_4B(relative_offset_local_header)}")
-
-            if filename.endswith('/'):
-                print(f"Folder name: {file_name} = {filename}")
-            else:
-                print(f"File name: {file_name} = {filename}")
-            if extra_field_length_dec > 0:
-                print(f"Extra field: {extra_field}")
-            if starting_tag == "504B0102" and file_comment_length_dec > 0:
-                print(f"File comment: {file_comment} = {filecomment}")
-
-            #! Move to the next file part
-            if starting_tag == "504B0304": #? Local File Header
-                file_data_start = index + 60 + file_name_length_dec + extra_field_length_dec
-                # print(f"File data start: {file_data_start}")
-                if compressed_size_dec > 0:
-                    index = file_data_start + compressed_size_dec
-                else:
-                    index = find_next_tag(hex_content, file_data_start)
-                    if index == -1:
-                        break
-            else: #? Central Directory File Header
-                index = index + 92 + file_name_length_dec + extra_field_length_dec + file_comment_length_dec
-
-        elif starting_tag == "504B0506":
-            zip_file_comment_length_dec = big_edian_2B(zip_file_comment_length)
-
-            zip_comment = hex_content[index + 44:index + 44 + zip_file_comment_length_dec]
-            zipcomment = bytes.fromhex(zip_comment).decode('utf-8', errors='replace')
-
-            print(f"Number of this disk: {number_of_this_disk} = {big_edian_2B(number_of_this_disk)}")
-            print(f"Disk where central directory starts: {disk_where_central_directory_starts} = {big_edian_2B(disk_where_central_directory_starts)}")
-            print(f"Number of central directory records on this disk: {number_of_central_directory_records_on_this_disk} = {big_edian_2B(number_of_central_directory_records_on_this_disk)}")
-            print(f"Total number of central directory records: {total_number_of_central_directory_records} = {big_edian_2B(total_number_of_central_directory_records)}")
-            print(f"Size of central directory: {size_of_central_directory} = {big_edian_4B(size_of_central_directory)}")
-            print(f"Offset of start of central directory: {offset_of_start_of_central_directory} = {big_edian_4B(offset_of_start_of_central_directory)}")
-            print(f"ZIP file comment length: {zip_file_comment_length} = {zip_file_comment_length_dec}")
-            if zip_file_comment_length_dec > 0:
-                print(f"ZIP file comment: {zip_comment} = {zipcomment}")
-
-            #? Move to the end of the ZIP file
-            index = index + 44 + zip_file_comment_length_dec
-
-        else:
-            print(f"\nStarting tag: {starting_tag} = Unknown")
-            break
+# One line per known extra field of a header, with the values decoded by extra_fields.py.
+# ZIP64 values are printed next to the header fields they replace instead.
+def extrafield_infos(extra):
+    lines = []
+    for field in read_extra_fields(extra):
+        if field.header_id == ZIP64_EXTRA_ID:
+            continue
+        values = ', '.join(f"{name} {value}" for name, value in field.report().items()
+                           if name != 'type' and value is not None)
+        lines.append(f"{field.title}: {le_hex(field.header_id, 2)} = {values or 'no values'}")
+    return lines
+
+# Little endian hex of a header field, as it appears in the file
+def le_hex(value, size):
+    return value.to_bytes(size, 'little').hex().upper()
+
+# Decimal column of the report, kept in the nibble units of the original hex-string walker
+def dec(value):
+    return value * 2
+
+def print_header_record(record):
+    is_central = isinstance(record, CentralDirectoryHeader)
+    starting_tag = "504B0102" if is_central else "504B0304"
+    filename = record.file_name.decode('utf-8', errors='replace')
+    file_name = record.file_name.hex().upper()
+    extra_field = record.extra.hex().upper()
+
+    kind = "Central Directory" if is_central else "Local"
+    if filename.endswith('/'):
+        print(f"\nStarting tag: {starting_tag} = {kind} Folder Header")
+    else:
+        print(f"\nStarting tag: {starting_tag} = {kind} File Header")
+
+    if is_central:
+        print(f"Version made by: {le_hex(record.version_made_by, 2)} = {dec(record.version_needed)}")
+
+    print(f"Version need to extract: {le_hex(record.version_needed, 2)} = {dec(record.version_needed)}")
+    print(f"General purpose bit flag: {le_hex(record.flags, 2)} = {dec(record.flags)}")
+    print(f"Compression method: {le_hex(record.compression_method, 2)} = {dec(record.compression_method)}")
+    print(f"File last modification time: {le_hex(record.mod_time, 2)} = {dec_time(dec(record.mod_time))}")
+    print(f"File last modification date: {le_hex(record.mod_date, 2)} = {dec_date(dec(record.mod_date))}")
+    print(f"CRC-32: {le_hex(record.crc32, 4)} = {dec(record.crc32)}")
+    print(f"Compressed size: {le_hex(record.compressed_size, 4)} = {dec(record.compressed_size)}")
+    print(f"Uncompressed size: {le_hex(record.uncompressed_size, 4)} = {dec(record.uncompressed_size)}")
+    print(f"File name length: {le_hex(len(record.file_name), 2)} = {dec(len(record.file_name))}")
+    print(f"Extra field length: {le_hex(len(record.extra), 2)} = {dec(len(record.extra))}")
+
+    if is_central:
+        print(f"File comment length: {le_hex(len(record.comment), 2)} = {dec(len(record.comment))}")
+        print(f"Disk number starts: {le_hex(record.disk_number_start, 2)} = {dec(record.disk_number_start)}")
+        print(f"Internal file attributes: {le_hex(record.internal_attributes, 2)} = {dec(record.internal_attributes)}")
+        print(f"External file attributes: {le_hex(record.external_attributes, 4)} = {dec(record.external_attributes)}")
+        print(f"Relative offset of local header: {le_hex(record.local_header_offset, 4)} = {dec(record.local_header_offset)}")
+
+    if filename.endswith('/'):
+        print(f"Folder name: {file_name} = {filename}")
+    else:
+        print(f"File name: {file_name} = {filename}")
+    if record.extra:
+        print(f"Extra field: {extra_field}")
+        for line in extrafield_infos(record.extra):
+            print(line)
+    for name, value in read_zip64_extra(record).items():
+        size = 4 if name == 'disk_number_start' else 8
+        print(f"ZIP64 {name.replace('_', ' ')}: {le_hex(value, size)} = {value}")
+    if is_central and record.comment:
+        filecomment = record.comment.decode('utf-8', errors='replace')
+        print(f"File comment: {record.comment.hex().upper()} = {filecomment}")
+
+def print_end_of_central_directory(record):
+    print(f"\nStarting tag: 504B0506 = End of Central Directory")
+    print(f"Number of this disk: {le_hex(record.disk_number, 2)} = {dec(record.disk_number)}")
+    print(f"Disk where central directory starts: {le_hex(record.cd_start_disk, 2)} = {dec(record.cd_start_disk)}")
+    print(f"Number of central directory records on this disk: {le_hex(record.cd_entries_this_disk, 2)} = {dec(record.cd_entries_this_disk)}")
+    print(f"Total number of central directory records: {le_hex(record.cd_entries_total, 2)} = {dec(record.cd_entries_total)}")
+    print(f"Size of central directory: {le_hex(record.cd_size, 4)} = {dec(record.cd_size)}")
+    print(f"Offset of start of central directory: {le_hex(record.cd_offset, 4)} = {dec(record.cd_offset)}")
+    print(f"ZIP file comment length: {le_hex(len(record.comment), 2)} = {dec(len(record.comment))}")
+    if record.comment:
+        zipcomment = record.comment.decode('utf-8', errors='replace')
+        print(f"ZIP file comment: {record.comment.hex().upper()} = {zipcomment}")
+
+def print_zip64_end_of_central_directory(record):
+    print(f"\nStarting tag: 504B0606 = ZIP64 End of Central Directory")
+    print(f"Size of ZIP64 end of central directory record: {le_hex(record.record_size, 8)} = {record.record_size}")
+    print(f"Version made by: {le_hex(record.version_made_by, 2)} = {record.version_made_by}")
+    print(f"Version need to extract: {le_hex(record.version_needed, 2)} = {record.version_needed}")
+    print(f"Number of this disk: {le_hex(record.disk_number, 4)} = {record.disk_number}")
+    print(f"Disk where central directory starts: {le_hex(record.cd_start_disk, 4)} = {record.cd_start_disk}")
+    print(f"Number of central directory records on this disk: {le_hex(record.cd_entries_this_disk, 8)} = {record.cd_entries_this_disk}")
+    print(f"Total number of central directory records: {le_hex(record.cd_entries_total, 8)} = {record.cd_entries_total}")
+    print(f"Size of central directory: {le_hex(record.cd_size, 8)} = {record.cd_size}")
+    print(f"Offset of start of central directory: {le_hex(record.cd_offset, 8)} = {record.cd_offset}")
+    if record.extensible_data:
+        print(f"Extensible data: {record.extensible_data.hex().upper()}")
+
+def print_zip64_end_of_central_directory_locator(record):
+    print(f"\nStarting tag: 504B0607 = ZIP64 End of Central Directory Locator")
+    print(f"Disk with ZIP64 end of central directory: {le_hex(record.zip64_eocd_disk, 4)} = {record.zip64_eocd_disk}")
+    print(f"Offset of ZIP64 end of central directory: {le_hex(record.zip64_eocd_offset, 8)} = {record.zip64_eocd_offset}")
+    print(f"Total number of disks: {le_hex(record.total_disks, 4)} = {record.total_disks}")
+
+# JSON-ready form of a record: its type, fields, and byte fields as hex
+def record_to_dict(record):
+    fields = {'type': type(record).__name__}
+    for name, value in record._asdict().items():
+        fields[name] = value.hex().upper() if isinstance(value, (bytes, bytearray)) else value
+    return fields
+
+# scan=True walks the file front to back instead of seeking from the central directory;
+# sharded is a parallel.ShardedArchive to parse the records on its worker processes
+def read_zip_hex(file_path, scan=False, archive=None, cache=None, sharded=None):
+    if sharded is not None and not scan and cache is None:
+        return sharded.read_zip_hex()
+    if cache is not None:
+        return [record_to_dict(record) for record in read_zip_records(file_path, scan, archive, cache)]
+    if archive is not None:
+        return [record_to_dict(record) for record in archive.records(scan)]
+    with map_file(file_path) as data:
+        records = iter_zip_records(data) if scan else seek_zip_records(data)
+        return [record_to_dict(record) for record in records]
+
+# All records as a list, from the cache when this exact file content was parsed before
+def read_zip_records(file_path, scan=False, archive=None, cache=None):
+    def read():
+        with shared_archive(file_path, archive) as zip_file:
+            return list(zip_file.records(scan))
+    return cached_result(cache, file_path, f"records:scan={scan:d}", read, content=True)
+
+def print_zip_record(record):
+    if isinstance(record, (LocalFileHeader, CentralDirectoryHeader)):
+        print_header_record(record)
+    elif isinstance(record, EndOfCentralDirectory):
+        print_end_of_central_directory(record)
+    elif isinstance(record, Zip64EndOfCentralDirectory):
+        print_zip64_end_of_central_directory(record)
+    elif isinstance(record, Zip64EndOfCentralDirectoryLocator):
+        print_zip64_end_of_central_directory_locator(record)
+    else:
+        print(f"\nStarting tag: {record.signature.hex().upper()} = Unknown")
+
+# Records are parsed as they are printed, so the 'records' stage covers both
+def print_zip_records(records):
+    count = 0
+    with metrics.stage('records'):
+        for record in records:
+            count += 1
+            print_zip_record(record)
+    metrics.count('records_parsed', count)
 
     print("\n-----End of ZIP file-----")
 
-def analyze_zip_hex(file_path):
+def parse_zip_file(data, scan=False):
+    print_zip_records(iter_zip_records(data) if scan else seek_zip_records(data))
+
+# sharded is a parallel.ShardedArchive to format the records on its worker processes
+def analyze_zip_hex(file_path, scan=False, archive=None, cache=None, sharded=None):
+    if sharded is not None and not scan and cache is None:
+        print(f"\nAnalyzing ZIP file in hex format (little endian): {file_path}")
+        sharded.print_zip_records()
+        return
+    if cache is not None:
+        records = read_zip_records(file_path, scan, archive, cache)
+        print(f"\nAnalyzing ZIP file in hex format (little endian): {file_path}")
+        print_zip_records(records)
+        return
     print(f"\nAnalyzing ZIP file in hex format (little endian): {file_path}")
-    with open(file_path, 'rb') as f:
-        hex_content = f.read().hex().upper()
-    parse_zip_file(hex_content)
+    if archive is not None:
+        print_zip_records(archive.records(scan))
+        return
+    with map_file(file_path) as data:
+        parse_zip_file(data, scan)
@@ -0,0 +1,44 @@
+import json
+import datetime
+
+WRITE_BUFFER_SIZE = 1 << 16
+
+def json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return bytes(value).hex().upper()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+# Write one compact JSON record per line, flushing to the stream in large blocks
+class JsonlWriter:
+    def __init__(self, stream, buffer_size=WRITE_BUFFER_SIZE):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered = 0
+        self.encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False, default=json_default)
+
+    def write(self, record):
+        line = self.encoder.encode(record)
+        self.buffer.append(line)
+        self.buffer.append('\n')
+        self.buffered += len(line) + 1
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.stream.write(''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+        self.stream.flush()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
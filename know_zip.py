@@ -1,45 +1,142 @@
-import os
 import sys
-import datetime
-import zipfile
 import argparse
-from tree_map import print_file_tree
-from analyze import analyze_zip_file
-from hex import view_zip_in_hex, analyze_zip_hex
+import contextlib
+import metrics
+from archive import ZipArchive, BadZipFile, read_zip_info, probed_source
+from byte_source import source_exists
+from cache import ResultCache, DEFAULT_CACHE_SIZE, deferred_parse, format_cache_stats
 
-def print_zip_info(file_path):
-    print(f"ZIP File: {file_path}")
-    print(f"  File Size: {os.path.getsize(file_path)} bytes")
-    print(f"  Last Modified: {datetime.datetime.fromtimestamp(os.path.getmtime(file_path)).strftime('%Y-%m-%d %H:%M:%S')}")
+# This CLI is run from shell pipelines many times over, so the modules of each mode
+# (analysis, tree, hex view, carving, batch, rules) are imported only by the runs that use them
+
+def print_zip_info(file_path, archive=None):
+    info = read_zip_info(file_path, archive)
+    print(f"ZIP File: {info['file']}")
+    print(f"  File Size: {info['size']} bytes")
+    modified = info['modified']
+    print(f"  Last Modified: {'unknown' if modified is None else modified.strftime('%Y-%m-%d %H:%M:%S')}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Analyze a ZIP file.')
-    parser.add_argument('-f', '--file', type=str, required=True, help='Path to the ZIP file to analyze')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-f', '--file', type=str, help='Path or http(s) URL of the ZIP file to analyze (URLs are read with range requests)')
+    source.add_argument('-b', '--batch', type=str, nargs='+', metavar='SOURCE', help='Analyze many ZIP files: directories, glob patterns, or - to read paths from stdin')
     parser.add_argument('-o', '--output', type=str, help='Path to the output file')
     parser.add_argument('-a', '--analyze', action='store_true', help='Analyze the ZIP file')
     parser.add_argument('-t', '--tree', action='store_true', help='Print the file tree of the ZIP file')
     parser.add_argument('-x', '--hex', action='store_true', help='View the ZIP file in hex format (Can use with -a)')
+    parser.add_argument('--scan', action='store_true', help='Walk every record front to back instead of seeking from the central directory (with -a -x)')
+    parser.add_argument('--carve', action='store_true', help='Carve ZIP records out of any file (disk images, truncated or embedded archives) instead of requiring a valid archive (with -a, or -a -x for the records)')
+    parser.add_argument('--offset', type=lambda s: int(s, 0), default=0, help='Start offset of the hex view (with -x)')
+    parser.add_argument('--length', type=lambda s: int(s, 0), help='Number of bytes to show in the hex view (with -x)')
+    parser.add_argument('-j', '--jobs', type=int, help='Worker processes for --batch (default: number of CPUs), or to shard the analysis of one large archive (with -a, or -a -x without --scan)')
+    parser.add_argument('--chunk-size', type=int, default=16, help='Files sent to a worker as one task in --batch')
+    parser.add_argument('--timeout', type=float, help='Seconds allowed per file in --batch')
+    parser.add_argument('--format', choices=['text', 'jsonl'], default='text', help='Output format: text report or one JSON record per archive')
+    parser.add_argument('--max-depth', type=int, help='Show the tree down to this many path levels (with -t)')
+    parser.add_argument('--subtree', type=str, action='append', metavar='PATH', help='Show only this folder of the tree and its parents (with -t, repeatable)')
+    parser.add_argument('--rules', type=str, help='Fingerprint rule file (.json, .toml or .yaml) used instead of fingerprints.json')
+    parser.add_argument('--cache', type=str, metavar='PATH', help='SQLite file caching results of archives analyzed before (with -a or -t)')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE // (1024 * 1024), metavar='MB', help='Size limit of the result cache; least recently used results are dropped')
+    parser.add_argument('--cache-stats', action='store_true', help='Print the cache hit/miss counters to stderr')
+    parser.add_argument('--profile', action='store_true', help='Print the time spent in each analysis stage and the work counters to stderr')
+    parser.add_argument('--metrics-format', choices=['table', 'prometheus', 'json'], default='table', help='Format of the --profile output')
+    parser.add_argument('--cprofile', type=str, metavar='PATH', help='Run the analysis of one archive (-f) under cProfile and write the stats to PATH')
+    parser.add_argument('--tracemalloc', action='store_true', help='Trace the memory allocated analyzing one archive (-f) and print the top sites')
     parser.add_argument('-v', '--verbose', action="store_true", help="Enable verbose output.")
     args = parser.parse_args()
 
+    if args.rules:
+        from scoring import set_rules_path, load_rules
+        try:
+            load_rules(args.rules)
+        except (OSError, ValueError) as e:
+            parser.error(f"--rules: {e}")
+        set_rules_path(args.rules)
+
+    if args.batch and (args.cprofile or args.tracemalloc):
+        parser.error("--cprofile and --tracemalloc profile a single archive (-f)")
+    if args.profile:
+        metrics.enable()
+
     if args.output:
         sys.stdout = open(args.output, 'w')
 
-    if not os.path.exists(args.file):
-        print(f"Error: The file '{args.file}' does not exist.")
-    elif not zipfile.is_zipfile(args.file):
-        print(f"Error: The file '{args.file}' is not a valid ZIP file.")
+    cache_size = args.cache_size * 1024 * 1024
+    cache = ResultCache(args.cache, cache_size) if args.cache and not args.batch else None
+
+    if args.batch:
+        from batch import print_batch
+        print_batch(args.batch, args.jobs, args.chunk_size, args.timeout, args.verbose, args.format, args.rules,
+                    args.cache, cache_size, args.carve, args.profile, args.metrics_format)
     else:
-        if args.analyze and args.hex:
-            analyze_zip_hex(args.file)
-        elif args.analyze:
-            analyze_zip_file(args.file, verbose=args.verbose)
-        elif args.tree:
-            print_file_tree(args.file)
-        elif args.hex:
-            view_zip_in_hex(args.file)
-        else:
-            print_zip_info(args.file)
+        with metrics.capture(args.cprofile, args.tracemalloc):
+            if args.format == 'jsonl':
+                from jsonl import JsonlWriter
+                from report import build_report
+                with JsonlWriter(sys.stdout) as writer:
+                    writer.write(build_report(args.file, args.analyze, args.tree, args.hex, args.verbose, args.scan, cache,
+                                              args.max_depth, args.subtree, args.carve, args.jobs))
+            elif not source_exists(args.file):
+                print(f"Error: The file '{args.file}' does not exist.")
+            elif args.carve:
+                from carve import carve_zip_file, carve_zip_hex
+                try:
+                    if args.analyze and args.hex:
+                        carve_zip_hex(args.file)
+                    else:
+                        carve_zip_file(args.file, verbose=args.verbose, cache=cache)
+                except OSError as e:
+                    print(f"Error: {e}")
+            else:
+                try:
+                    with contextlib.ExitStack() as stack:
+                        archive = sharded = None
+                        info_only = not (args.analyze or args.tree or args.hex)
+                        hex_only = args.hex and not (args.analyze or args.tree)
+                        # With -j a large archive is analyzed on a process pool that parses it in
+                        # shards, and -t parses it on its own
+                        if args.jobs and args.analyze and not (args.hex and args.scan):
+                            from parallel import open_sharded_archive
+                            sharded = open_sharded_archive(args.file, args.jobs)
+                            if sharded is not None:
+                                stack.enter_context(sharded)
+                        # Every requested view reads from the same parsed archive; with --cache it
+                        # is only parsed when a view misses the cache, and the info alone only
+                        # needs the quick check of read_zip_info (the hex view that of probed_source)
+                        if not (info_only or hex_only or sharded is not None or deferred_parse(cache, args.analyze, args.tree)):
+                            archive = stack.enter_context(ZipArchive(args.file))
+                        if args.analyze and args.hex:
+                            from hex import analyze_zip_hex
+                            analyze_zip_hex(args.file, args.scan, archive, cache, sharded)
+                        elif args.analyze:
+                            from analyze import analyze_zip_file
+                            analyze_zip_file(args.file, verbose=args.verbose, archive=archive, cache=cache, sharded=sharded)
+                        if args.tree:
+                            from tree_map import print_file_tree
+                            print_file_tree(args.file, archive=archive, cache=cache, max_depth=args.max_depth,
+                                            subtrees=args.subtree, stats=args.verbose)
+                        if args.hex and not args.analyze:
+                            from hex import view_zip_in_hex
+                            if archive is None:
+                                data = stack.enter_context(probed_source(args.file))[0]
+                                view_zip_in_hex(args.file, args.offset, args.length, data=data)
+                            else:
+                                view_zip_in_hex(args.file, args.offset, args.length, archive)
+                        if info_only:
+                            print_zip_info(args.file, archive)
+                except BadZipFile:
+                    print(f"Error: The file '{args.file}' is not a valid ZIP file.")
+                except OSError as e:
+                    print(f"Error: {e}")
+
+    if cache is not None:
+        if args.cache_stats:
+            print(format_cache_stats(cache.stats()), file=sys.stderr)
+        cache.close()
+
+    if args.profile and not args.batch:
+        print(metrics.format_metrics(metrics.snapshot(), args.metrics_format), file=sys.stderr)
 
     if args.output:
         sys.stdout.close()
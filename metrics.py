@@ -0,0 +1,149 @@
+import sys
+import time
+import contextlib
+
+# Instrumentation is off until enable(): stage() then hands out one shared no-op context
+# and count() returns after a single check, so the hooks stay in the hot paths for free.
+# State is per process; batch and server workers send snapshot() back to be merge()d.
+enabled = False
+stages = {}
+counters = {}
+started = None
+
+NO_STAGE = contextlib.nullcontext()
+
+def enable():
+    global enabled, started
+    enabled = True
+    if started is None:
+        started = time.perf_counter()
+
+def reset():
+    global started
+    stages.clear()
+    counters.clear()
+    started = time.perf_counter() if enabled else None
+
+# Time spent in one named stage; nested stages are timed on their own as well
+class Stage:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        totals = stages.get(self.name)
+        if totals is None:
+            stages[self.name] = [1, elapsed]
+        else:
+            totals[0] += 1
+            totals[1] += elapsed
+
+def stage(name):
+    return Stage(name) if enabled else NO_STAGE
+
+def count(name, n=1):
+    if enabled:
+        counters[name] = counters.get(name, 0) + n
+
+# Picklable copy of the stages, counters and the wall time they cover
+def snapshot():
+    return {
+        'wall_seconds': time.perf_counter() - started if started is not None else 0.0,
+        'stages': {name: {'calls': calls, 'seconds': seconds} for name, (calls, seconds) in stages.items()},
+        'counters': dict(counters),
+    }
+
+# Add a snapshot from another process to the totals of this one
+def merge(other):
+    for name, totals in other['stages'].items():
+        mine = stages.setdefault(name, [0, 0.0])
+        mine[0] += totals['calls']
+        mine[1] += totals['seconds']
+    for name, value in other['counters'].items():
+        counters[name] = counters.get(name, 0) + value
+
+def format_table(metrics):
+    wall = metrics['wall_seconds']
+    lines = [f"{'Stage':<28} {'Calls':>8} {'Total ms':>12} {'Mean ms':>10} {'Share':>7}"]
+    for name, totals in sorted(metrics['stages'].items(), key=lambda item: -item[1]['seconds']):
+        seconds = totals['seconds']
+        share = f"{100 * seconds / wall:.1f}%" if wall else '-'
+        lines.append(f"{name:<28} {totals['calls']:>8} {seconds * 1000:>12.2f} "
+                     f"{seconds * 1000 / totals['calls']:>10.3f} {share:>7}")
+    lines.append(f"{'(wall time)':<28} {'':>8} {wall * 1000:>12.2f}")
+    if metrics['counters']:
+        lines.append('')
+        lines.append(f"{'Counter':<28} {'Value':>14}")
+        for name, value in sorted(metrics['counters'].items()):
+            lines.append(f"{name:<28} {value:>14,}")
+    return '\n'.join(lines)
+
+# Prometheus text exposition format; counters and gauges hold further values by name
+# (e.g. the request totals and in-flight requests of the server)
+def format_prometheus(metrics, prefix='know_zip', counters=None, gauges=None):
+    lines = [f"# HELP {prefix}_stage_seconds_total Time spent in each analysis stage.",
+             f"# TYPE {prefix}_stage_seconds_total counter"]
+    for name, totals in sorted(metrics['stages'].items()):
+        lines.append(f'{prefix}_stage_seconds_total{{stage="{name}"}} {totals["seconds"]:.6f}')
+    lines += [f"# HELP {prefix}_stage_calls_total Times each analysis stage ran.",
+              f"# TYPE {prefix}_stage_calls_total counter"]
+    for name, totals in sorted(metrics['stages'].items()):
+        lines.append(f'{prefix}_stage_calls_total{{stage="{name}"}} {totals["calls"]}')
+    for name, value in sorted(metrics['counters'].items()):
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.append(f"{prefix}_{name}_total {value}")
+    for name, value in sorted((counters or {}).items()):
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.append(f"{prefix}_{name}_total {value}")
+    for name, value in sorted((gauges or {}).items()):
+        lines.append(f"# TYPE {prefix}_{name} gauge")
+        lines.append(f"{prefix}_{name} {value}")
+    return '\n'.join(lines) + '\n'
+
+def format_metrics(metrics, output_format='table'):
+    if output_format == 'json':
+        import json
+        return json.dumps(metrics, indent=2)
+    if output_format == 'prometheus':
+        return format_prometheus(metrics)
+    return format_table(metrics)
+
+# Capture a cProfile (dumped to cprofile_path, top functions printed) and/or the
+# tracemalloc peak and top allocation sites of the work inside the block
+@contextlib.contextmanager
+def capture(cprofile_path=None, trace_memory=False, out=None, top=15):
+    # Only imported when asked for, to keep them out of the startup of every run
+    if cprofile_path:
+        import pstats
+        import cProfile
+    if trace_memory:
+        import tracemalloc
+    out = out or sys.stderr
+    profiler = cProfile.Profile() if cprofile_path else None
+    if trace_memory:
+        tracemalloc.start()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        if trace_memory:
+            memory = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        if profiler is not None:
+            profiler.dump_stats(cprofile_path)
+            print(f"\ncProfile written to {cprofile_path}; top {top} by cumulative time:", file=out)
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(top)
+        if trace_memory:
+            print(f"\ntracemalloc: peak {peak / (1024 * 1024):.1f} MB traced; top {top} allocation sites:", file=out)
+            for statistic in memory.statistics('lineno')[:top]:
+                print(f"  {statistic}", file=out)
@@ -0,0 +1,232 @@
+import io
+import sys
+import mmap
+import contextlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import metrics
+import scoring
+from zip_records import (LOCAL_FILE_HEADER_SIGNATURE, UnknownRecord, locate_central_directory,
+                         split_central_directory, iter_central_directory, read_local_file_header,
+                         resolve_zip64)
+from archive import read_zip_entries
+from byte_source import is_url, open_source, close_source
+from analyze import read_entry_report
+from hex import print_zip_record, record_to_dict
+
+# Central directory headers per shard: enough work to outweigh sending the task and its
+# result between processes, few enough to keep the workers balanced and the -a -x text
+# of the shards waiting to be printed small
+SHARD_ENTRIES = 4096
+# Archives with fewer entries are analyzed serially, as starting the pool costs more
+MIN_SHARDED_ENTRIES = 2 * SHARD_ENTRIES
+# Shards in flight per worker; results are used in shard order
+SHARDS_AHEAD_PER_WORKER = 2
+
+# The archive as mapped by this worker process (see open_worker_archive). Local files
+# are mapped read-only, so every worker reads the same pages of the page cache.
+worker_data = None
+
+def open_worker_archive(file_path, rules_path):
+    global worker_data
+    scoring.set_rules_path(rules_path)
+    worker_data = open_source(file_path)[0]
+
+# Feature counts of the entries of one shard, with their -a -v reports when verbose
+def analyze_shard(location, verbose):
+    entries = read_zip_entries(worker_data, location)
+    reports = [read_entry_report(info) for info in entries] if verbose else []
+    return scoring.count_features(entries, scoring.default_rules()), reports, len(entries)
+
+# Local header offsets listed by the central directory headers of one shard
+def local_header_offsets_shard(location):
+    return [location.base + resolve_zip64(record).local_header_offset
+            for record in iter_central_directory(worker_data, location)]
+
+# The local headers at the given offsets, as seek_zip_records yields them
+def iter_local_headers(offsets):
+    for offset in offsets:
+        signature = worker_data[offset:offset + 4]
+        record = None
+        if signature == LOCAL_FILE_HEADER_SIGNATURE:
+            record = read_local_file_header(worker_data, offset)
+        yield record if record is not None else UnknownRecord(offset, signature)
+
+# -a -x text of the local headers at the given offsets, as print_zip_records prints them
+def format_local_headers_shard(offsets):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        for record in iter_local_headers(offsets):
+            print_zip_record(record)
+    return out.getvalue()
+
+# -a -x --format jsonl records of the local headers at the given offsets
+def local_header_dicts_shard(offsets):
+    return [record_to_dict(record) for record in iter_local_headers(offsets)]
+
+# -a -x text of the central directory headers of one shard
+def format_directory_shard(location):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        for record in iter_central_directory(worker_data, location):
+            print_zip_record(record)
+    return out.getvalue()
+
+# -a -x --format jsonl records of the central directory headers of one shard
+def directory_dicts_shard(location):
+    return [record_to_dict(record) for record in iter_central_directory(worker_data, location)]
+
+# A large local archive analyzed on a process pool: the central directory is split into
+# shards of SHARD_ENTRIES headers without being parsed, and each worker maps the file and
+# parses, scores or formats the shards it is given. Results are merged in shard order,
+# so the output is the same as the serial analysis. If a worker dies (killed, out of
+# memory) the shards left are run in this process instead.
+class ShardedArchive:
+    def __init__(self, file_path, jobs, location, shards):
+        self.file_path = file_path
+        self.jobs = jobs
+        self.location = location
+        self.shards = shards
+        self.executor = None
+        self.broken = False
+
+    # Results of func(*task) for each task, in task order
+    def map(self, func, tasks):
+        if self.executor is None and not self.broken:
+            self.executor = ProcessPoolExecutor(max_workers=self.jobs, initializer=open_worker_archive,
+                                                initargs=(self.file_path, scoring.RULES_PATH))
+        tasks = iter(tasks)
+        pending = deque()
+        while True:
+            while not self.broken and len(pending) < self.jobs * SHARDS_AHEAD_PER_WORKER:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                pending.append((self.executor.submit(func, *task), task))
+            if pending:
+                future, task = pending.popleft()
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    self.run_serially()
+                    result = func(*task)
+            else:
+                task = next(tasks, None)
+                if task is None:
+                    break
+                result = func(*task)
+            yield result
+
+    # Give up the broken pool and map the archive in this process, as a worker would
+    def run_serially(self):
+        if self.broken:
+            return
+        print(f"Warning: a worker process died; analyzing the rest of {self.file_path} serially",
+              file=sys.stderr)
+        self.close()
+        self.broken = True
+        open_worker_archive(self.file_path, scoring.RULES_PATH)
+
+    # The same analysis as analyze.analyze_entries
+    def analyze_entries(self, verbose=False):
+        rules = scoring.default_rules()
+        partials = []
+        entries = []
+        total = 0
+        with metrics.stage('sharded_analysis'):
+            for counts, reports, count in self.map(analyze_shard, ((shard, verbose) for shard in self.shards)):
+                partials.append(counts)
+                entries += reports
+                total += count
+        with metrics.stage('scoring'):
+            origin = scoring.score_feature_counts(scoring.merge_feature_counts(partials, rules), total, rules)
+        metrics.count('entries_parsed', total)
+        metrics.count('entries_scored', total)
+        if verbose:
+            metrics.count('extra_fields_decoded', sum(len(entry['extra_fields']) for entry in entries))
+        return {'file': self.file_path, 'entries': entries, 'origin': origin}
+
+    # Tasks of SHARD_ENTRIES local header offsets each, in file order
+    def local_header_tasks(self):
+        offsets = []
+        for shard_offsets in self.map(local_header_offsets_shard, ((shard,) for shard in self.shards)):
+            offsets += shard_offsets
+        offsets.sort()
+        return [(offsets[i:i + SHARD_ENTRIES],) for i in range(0, len(offsets), SHARD_ENTRIES)]
+
+    # The records after the central directory, which were parsed to locate it
+    def end_records(self):
+        location = self.location
+        records = [location.zip64_eocd, location.zip64_locator, location.eocd]
+        return [record for record in records if record is not None]
+
+    # The same text as hex.print_zip_records(archive.records()): the local headers in
+    # file order, then the central directory and the end records
+    def print_zip_records(self):
+        with metrics.stage('records'):
+            tasks = self.local_header_tasks()
+            for text in self.map(format_local_headers_shard, tasks):
+                print(text, end='')
+            for text in self.map(format_directory_shard, ((shard,) for shard in self.shards)):
+                print(text, end='')
+            tail = self.end_records()
+            for record in tail:
+                print_zip_record(record)
+        metrics.count('records_parsed', 2 * sum(len(offsets) for offsets, in tasks) + len(tail))
+        print("\n-----End of ZIP file-----")
+
+    # The same records as hex.read_zip_hex, as a list
+    def read_zip_hex(self):
+        records = []
+        with metrics.stage('records'):
+            for dicts in self.map(local_header_dicts_shard, self.local_header_tasks()):
+                records += dicts
+            for dicts in self.map(directory_dicts_shard, ((shard,) for shard in self.shards)):
+                records += dicts
+            records += [record_to_dict(record) for record in self.end_records()]
+        metrics.count('records_parsed', len(records))
+        return records
+
+    def close(self):
+        global worker_data
+        if self.executor is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.executor = None
+        if self.broken and worker_data is not None:
+            close_source(worker_data)
+            worker_data = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# A ShardedArchive of file_path on jobs worker processes, or None when the archive is
+# better analyzed serially: one job, a URL or a file that cannot be mapped, fewer than
+# MIN_SHARDED_ENTRIES entries, or a damaged central directory (the serial analysis
+# reports it)
+def open_sharded_archive(file_path, jobs):
+    if not jobs or jobs < 2 or is_url(file_path):
+        return None
+    data = open_source(file_path)[0]
+    try:
+        if not isinstance(data, mmap.mmap):
+            return None
+        file_size = len(data)
+        location = locate_central_directory(data)
+        if location is None or location.entries < MIN_SHARDED_ENTRIES:
+            return None
+        with metrics.stage('split_central_directory'):
+            ranges = split_central_directory(data, location, SHARD_ENTRIES)
+        if ranges is None:
+            return None
+    finally:
+        close_source(data)
+    metrics.count('archives_opened')
+    metrics.count('archive_bytes', file_size)
+    metrics.count('central_directory_bytes', location.size)
+    metrics.count('shards', len(ranges))
+    shards = [location._replace(offset=offset, size=size) for offset, size in ranges]
+    return ShardedArchive(file_path, jobs, location, shards)
@@ -0,0 +1,51 @@
+import contextlib
+from archive import ZipArchive, BadZipFile, read_zip_info
+from byte_source import source_exists
+from analyze import read_zip_analysis
+from tree_map import build_file_tree
+from hex import read_zip_hex
+from carve import read_carved_zip, read_carved_records
+from cache import deferred_parse
+from parallel import open_sharded_archive
+
+# Build the result of one archive for the same mode selection as know_zip.py,
+# with every requested view read from a single parse of the archive. With carve the
+# file does not have to be a valid archive: records are carved out of any data. With jobs
+# the analysis (-a) of a large archive is sharded across that many worker processes.
+def build_report(file_path, analyze=False, tree=False, hex_view=False, verbose=False, scan=False, cache=None,
+                 max_depth=None, subtrees=None, carve=False, jobs=None):
+    report = {'file': file_path}
+    if not source_exists(file_path):
+        report['error'] = f"The file '{file_path}' does not exist."
+        return report
+    try:
+        if carve and analyze and hex_view:
+            report['records'] = read_carved_records(file_path)
+            return report
+        if carve:
+            return read_carved_zip(file_path, verbose, cache)
+        with contextlib.ExitStack() as stack:
+            archive = sharded = None
+            info_only = not (analyze or tree or hex_view)
+            if jobs and analyze and not (hex_view and scan):
+                sharded = open_sharded_archive(file_path, jobs)
+                if sharded is not None:
+                    stack.enter_context(sharded)
+            # The info alone only needs the quick check of read_zip_info
+            if not (info_only or sharded is not None or deferred_parse(cache, analyze, tree)):
+                archive = stack.enter_context(ZipArchive(file_path))
+            if analyze and hex_view:
+                report['records'] = read_zip_hex(file_path, scan, archive, cache, sharded)
+            elif analyze:
+                report.update(read_zip_analysis(file_path, verbose, archive, cache, sharded))
+            if tree:
+                report['tree'] = build_file_tree(file_path, archive, cache).to_dict(max_depth, subtrees)
+            if hex_view and not analyze:
+                report['error'] = "The hex view (-x) is text only; use -a -x for the parsed records."
+            if info_only:
+                report.update(read_zip_info(file_path, archive))
+    except BadZipFile:
+        return {'file': file_path, 'error': f"The file '{file_path}' is not a valid ZIP file."}
+    except OSError as e:
+        return {'file': file_path, 'error': str(e)}
+    return report
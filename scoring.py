@@ -0,0 +1,282 @@
+import os
+import re
+import json
+import hashlib
+from zip_records import EXTRA_FIELD_HEADER
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Fingerprint rules shipped with the tool; ZIP_FINGERPRINTS or --rules points at another file
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fingerprints.json')
+RULES_PATH = os.environ.get('ZIP_FINGERPRINTS') or DEFAULT_RULES_PATH
+
+# Counted for every archive whatever the rule file says: an extra field ending in a truncated header
+EXTRA_FIELD_ERROR_FEATURE = 'extra_field_error'
+
+# Compiled rule sets keyed by the SHA-256 of the rule file they were built from
+compiled_rules = {}
+active_rules = None
+
+# A fingerprint rule file compiled for counting:
+#   extra_field_index: (header_id, data_size) -> ((feature index, data check or None), ...),
+#                      already merged with the rules that match any size of that header_id
+#   extra_field_any_size: header_id -> ((feature index, data check or None), ...)
+#   filename_rules / lower_filename_rules: [(feature index, test on the filename / lowercased filename)]
+#   entry_rules: [(feature index, predicate on the entry)] for rules on the other header fields
+class RuleSet:
+    def __init__(self, rules, digest=None):
+        self.digest = digest
+        self.origins = list(rules['origins'])
+        self.features = [feature['name'] for feature in rules['features']] + [EXTRA_FIELD_ERROR_FEATURE]
+        self.feature_index = {name: i for i, name in enumerate(self.features)}
+        if len(self.feature_index) != len(self.features):
+            raise ValueError("duplicate feature names")
+        self.extra_field_error = self.feature_index[EXTRA_FIELD_ERROR_FEATURE]
+        self.archive_features = [i for i, feature in enumerate(rules['features']) if feature.get('scope') == 'archive']
+        self.reported = list(rules.get('reported_features', []))
+        for name in self.reported:
+            if name not in self.feature_index:
+                raise ValueError(f"reported feature '{name}' is not defined")
+
+        self.weight_matrix = []
+        for feature in rules['features']:
+            weights = feature.get('weights', {})
+            for origin in weights:
+                if origin not in self.origins:
+                    raise ValueError(f"feature '{feature['name']}' weights unknown origin '{origin}'")
+            self.weight_matrix.append([weights.get(origin, 0) for origin in self.origins])
+        self.weight_matrix.append([0] * len(self.origins))
+
+        exact = {}
+        any_size = {}
+        self.filename_rules = []
+        self.lower_filename_rules = []
+        self.entry_rules = []
+        for i, feature in enumerate(rules['features']):
+            if 'extra_field' in feature:
+                spec = feature['extra_field']
+                hit = (i, compile_data_check(spec))
+                for header_id in parse_header_ids(spec.get('header_id')):
+                    if spec.get('data_size') is None:
+                        any_size.setdefault(header_id, []).append(hit)
+                    else:
+                        exact.setdefault((header_id, int(spec['data_size'])), []).append(hit)
+            if 'filename' in feature:
+                test = compile_filename_predicate(feature['filename'])
+                if 'entry' in feature:
+                    entry_test = compile_entry_predicate(feature['entry'])
+                    fold = str.lower if feature['filename'].get('ignore_case', False) else str
+                    self.entry_rules.append((i, lambda entry, test=test, entry_test=entry_test, fold=fold:
+                                             entry_test(entry) and test(fold(entry.filename))))
+                elif feature['filename'].get('ignore_case', False):
+                    self.lower_filename_rules.append((i, test))
+                else:
+                    self.filename_rules.append((i, test))
+            elif 'entry' in feature:
+                self.entry_rules.append((i, compile_entry_predicate(feature['entry'])))
+            elif 'extra_field' not in feature:
+                raise ValueError(f"feature '{feature['name']}' has no extra_field, filename or entry rule")
+
+        self.extra_field_any_size = {header_id: tuple(hits) for header_id, hits in any_size.items()}
+        self.extra_field_index = {key: tuple(any_size.get(key[0], [])) + tuple(hits) for key, hits in exact.items()}
+
+def parse_header_ids(value):
+    if value is None:
+        raise ValueError("extra_field rule without header_id")
+    values = value if isinstance(value, list) else [value]
+    return [int(v, 0) if isinstance(v, str) else int(v) for v in values]
+
+# Optional test on the data of a matching extra field
+def compile_data_check(spec):
+    if 'data_suffix' in spec:
+        suffix = bytes.fromhex(spec['data_suffix'])
+        return lambda data: data.endswith(suffix)
+    if 'data_prefix' in spec:
+        prefix = bytes.fromhex(spec['data_prefix'])
+        return lambda data: data.startswith(prefix)
+    return None
+
+# Test on the filename; with ignore_case it is given the lowercased name
+def compile_filename_predicate(spec):
+    ignore_case = spec.get('ignore_case', False)
+    fold = str.lower if ignore_case else str
+    tests = []
+    if 'startswith' in spec:
+        prefix = fold(spec['startswith'])
+        tests.append(lambda name: name.startswith(prefix))
+    if 'endswith' in spec:
+        suffix = fold(spec['endswith'])
+        tests.append(lambda name: name.endswith(suffix))
+    if 'equals' in spec:
+        value = fold(spec['equals'])
+        tests.append(lambda name: name == value)
+    if 'contains' in spec:
+        value = fold(spec['contains'])
+        tests.append(lambda name: value in name)
+    if 'regex' in spec:
+        pattern = re.compile(spec['regex'], re.IGNORECASE if ignore_case else 0)
+        tests.append(lambda name: pattern.search(name) is not None)
+    if 'slash_count' in spec:
+        count = int(spec['slash_count'])
+        tests.append(lambda name: name.count('/') == count)
+    if not tests:
+        raise ValueError(f"empty filename rule: {spec}")
+    if len(tests) == 1:
+        return tests[0]
+    return lambda name: all(test(name) for test in tests)
+
+def compile_entry_predicate(spec):
+    tests = []
+    if 'compress_type' in spec:
+        compress_type = int(spec['compress_type'])
+        tests.append(lambda entry: entry.compress_type == compress_type)
+    if 'flag_bits' in spec:
+        mask = int(spec['flag_bits'], 0) if isinstance(spec['flag_bits'], str) else int(spec['flag_bits'])
+        tests.append(lambda entry: entry.flag_bits & mask == mask)
+    if 'extra_prefix' in spec:
+        prefix = bytes.fromhex(spec['extra_prefix'])
+        tests.append(lambda entry: entry.extra.startswith(prefix))
+    if not tests:
+        raise ValueError(f"empty entry rule: {spec}")
+    if len(tests) == 1:
+        return tests[0]
+    return lambda entry: all(test(entry) for test in tests)
+
+# Decode a rule file by its extension: .json, .toml (Python 3.11+) or .yaml/.yml (PyYAML).
+# The TOML and YAML parsers are imported only for such files.
+def parse_rules(raw, path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.toml':
+        try:
+            import tomllib
+        except ImportError:
+            raise ValueError(f"{path}: TOML rule files need Python 3.11 or later") from None
+        return tomllib.loads(raw.decode('utf-8'))
+    if extension in ('.yaml', '.yml'):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError(f"{path}: YAML rule files need PyYAML (pip install pyyaml)") from None
+        return yaml.safe_load(raw)
+    return json.loads(raw)
+
+# Read and compile a rule file; a file already compiled (same content hash) is reused
+def load_rules(path=None):
+    path = path or RULES_PATH
+    with open(path, 'rb') as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw).hexdigest()
+    rules = compiled_rules.get(digest)
+    if rules is None:
+        try:
+            data = parse_rules(raw, path)
+            if not isinstance(data, dict):
+                raise ValueError("expected a mapping with 'origins' and 'features'")
+            rules = RuleSet(data, digest)
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"{path}: invalid fingerprint rules: {e}") from None
+        compiled_rules[digest] = rules
+    return rules
+
+# Switch the rules used by default (e.g. from --rules); also the batch worker initializer
+def set_rules_path(path):
+    global RULES_PATH, active_rules
+    RULES_PATH = path or DEFAULT_RULES_PATH
+    active_rules = None
+
+# The rule set compiled once per process from RULES_PATH
+def default_rules():
+    global active_rules
+    if active_rules is None:
+        active_rules = load_rules(RULES_PATH)
+    return active_rules
+
+# Add the features of one entry (a ZipEntry or zipfile.ZipInfo) to the counts vector
+def count_entry_features(entry, counts, rules):
+    extra_field_index = rules.extra_field_index
+    extra_field_any_size = rules.extra_field_any_size
+    extra = entry.extra
+    size = len(extra)
+    idx = 0
+    while idx + 4 <= size:
+        header_id, data_size = EXTRA_FIELD_HEADER.unpack_from(extra, idx)
+        hits = extra_field_index.get((header_id, data_size))
+        if hits is None:
+            hits = extra_field_any_size.get(header_id)
+        if hits:
+            for feature, check in hits:
+                if check is None or check(extra[idx + 4:idx + 4 + data_size]):
+                    counts[feature] += 1
+        idx += 4 + data_size
+    if idx < size:
+        counts[rules.extra_field_error] += 1
+
+    filename = entry.filename
+    for feature, test in rules.filename_rules:
+        if test(filename):
+            counts[feature] += 1
+    if rules.lower_filename_rules:
+        filename = filename.lower()
+        for feature, test in rules.lower_filename_rules:
+            if test(filename):
+                counts[feature] += 1
+    for feature, predicate in rules.entry_rules:
+        if predicate(entry):
+            counts[feature] += 1
+
+# One pass over the entries; returns the feature counts vector
+def count_features(entries, rules):
+    counts = [0] * len(rules.features)
+    for entry in entries:
+        count_entry_features(entry, counts, rules)
+    for feature in rules.archive_features:
+        counts[feature] = min(counts[feature], 1)
+    return counts
+
+# Per-origin totals: the counts vector times the weight matrix
+def score_counts(counts, rules):
+    if numpy is not None:
+        totals = numpy.asarray(counts, dtype=numpy.int64) @ numpy.asarray(rules.weight_matrix, dtype=numpy.int64)
+        return dict(zip(rules.origins, totals.tolist()))
+    return {origin: sum(count * row[j] for count, row in zip(counts, rules.weight_matrix) if count)
+            for j, origin in enumerate(rules.origins)}
+
+# Sum the counts vectors of parts of an archive (the shards of parallel.py), giving the
+# vector count_features returns for all of its entries
+def merge_feature_counts(partials, rules):
+    counts = [sum(column) for column in zip(*partials)] if partials else [0] * len(rules.features)
+    for feature in rules.archive_features:
+        counts[feature] = min(counts[feature], 1)
+    return counts
+
+# Score the operating systems and apps that may have created the archive from all of its entries
+def score_zip_origin(zip_info_list, rules=None):
+    rules = rules or default_rules()
+    return score_feature_counts(count_features(zip_info_list, rules), len(zip_info_list), rules)
+
+# The origin report of an archive of entry_count entries from its feature counts vector
+def score_feature_counts(counts, entry_count, rules):
+    characteristics = score_counts(counts, rules)
+    features = {name: counts[rules.feature_index[name]] > 0 for name in rules.reported}
+
+    total = sum(characteristics.values())
+    confidence = {origin: round(score / total, 4) if total else 0.0 for origin, score in characteristics.items()}
+    max_score = max(characteristics.values())
+    likely_OS_apps = [key for key, value in characteristics.items() if value == max_score]
+
+    warnings = []
+    if counts[rules.extra_field_error]:
+        warnings.append("Error reading extra field data")
+
+    return {
+        'origins': likely_OS_apps,
+        'scores': characteristics,
+        'confidence': confidence,
+        'features': features,
+        'feature_counts': dict(zip(rules.features, counts)),
+        'entries': entry_count,
+        'warnings': warnings,
+    }
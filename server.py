@@ -0,0 +1,406 @@
+import os
+import re
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import tempfile
+import metrics
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from batch import AnalysisTimeout, raise_analysis_timeout, open_worker_cache
+from cache import DEFAULT_CACHE_SIZE
+from byte_source import is_url, source_exists
+from jsonl import json_default
+from report import build_report
+from scoring import set_rules_path, load_rules
+
+# Report sections of each endpoint, as the matching know_zip.py flags
+ENDPOINTS = {
+    '/analyze': {'analyze': True},
+    '/tree': {'tree': True},
+    '/records': {'analyze': True, 'hex_view': True},
+    '/info': {},
+}
+# ?path= values naming a URL rather than a file (http(s) ones are fetched by build_report)
+URL_PATTERN = re.compile(r'[A-Za-z][A-Za-z0-9+.-]*://')
+MAX_HEADER_SIZE = 64 * 1024
+DEFAULT_QUEUE_LIMIT = 64
+DEFAULT_TIMEOUT = 30.0
+DEFAULT_MAX_UPLOAD = 256 * 1024 * 1024
+STATUS_TEXT = {
+    200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+    411: 'Length Required', 413: 'Payload Too Large', 422: 'Unprocessable Content',
+    431: 'Request Header Fields Too Large',
+    500: 'Internal Server Error', 503: 'Service Unavailable', 504: 'Gateway Timeout',
+}
+
+class HttpError(Exception):
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+# Runs once in every worker process: the fingerprint rules to use, whether to time the
+# analysis stages, and leave Ctrl+C to the server
+def init_worker(rules_path, profile=False):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if profile:
+        metrics.enable()
+    if rules_path:
+        set_rules_path(rules_path)
+
+# Build the report of one archive in a worker. deadline is the request deadline as a
+# time.time() value, so the wait in the queue counts against it: work that starts after
+# it is skipped, and with use_alarm (process workers) the analysis is interrupted when it
+# passes, which frees the worker.
+# Returns (status, report, metrics). The status is 200, 404 for a missing file, 422 for
+# an archive that could not be analyzed, or 504 once the deadline has passed. A process
+# worker with metrics enabled sends the stages of this request back to the server;
+# thread workers add to the server's own totals.
+def serve_report(file_path, name, sections, options, deadline=None, use_alarm=False,
+                 cache_path=None, cache_size=DEFAULT_CACHE_SIZE):
+    profiled = use_alarm and metrics.enabled
+    if profiled:
+        metrics.reset()
+    status = 200
+    try:
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                raise AnalysisTimeout()
+            if use_alarm:
+                signal.signal(signal.SIGALRM, raise_analysis_timeout)
+                signal.setitimer(signal.ITIMER_REAL, remaining)
+        cache = open_worker_cache(cache_path, cache_size)
+        report = build_report(file_path, cache=cache, **sections, **options)
+    except AnalysisTimeout:
+        status = 504
+        report = {'file': file_path, 'error': "timed out at the request deadline"}
+    finally:
+        if use_alarm and deadline is not None:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+    # Uploads are reported under the name the client gave, never the spool file
+    if name is not None:
+        report['file'] = name
+        if 'error' in report:
+            report['error'] = report['error'].replace(file_path, name)
+    if status == 200 and 'error' in report:
+        status = 422 if source_exists(file_path) else 404
+    return status, report, metrics.snapshot() if profiled else None
+
+def spool_upload(body):
+    fd, path = tempfile.mkstemp(prefix='know_zip_', suffix='.zip')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(body)
+    return path
+
+def parse_flag(query, name):
+    return query.get(name, ['0'])[-1].lower() in ('1', 'true', 'yes')
+
+def parse_number(query, name, kind, default=None):
+    if name not in query:
+        return default
+    try:
+        value = kind(query[name][-1])
+    except ValueError:
+        raise HttpError(400, f"{name} must be a number") from None
+    if value <= 0:
+        raise HttpError(400, f"{name} must be positive")
+    return value
+
+# Accepts analysis requests over HTTP/1.1 and runs them on a bounded pool. At most
+# workers + queue_limit requests are admitted at a time; the rest get 503 straight away
+# so that callers back off instead of piling up. Every request has a deadline covering
+# the upload, the wait in the queue and the analysis, after which it gets 504.
+class AnalysisServer:
+    def __init__(self, workers=None, queue_limit=DEFAULT_QUEUE_LIMIT, timeout=DEFAULT_TIMEOUT,
+                 max_upload=DEFAULT_MAX_UPLOAD, root=None, cache_path=None, cache_size=DEFAULT_CACHE_SIZE,
+                 rules_path=None, threads=False, profile=False, allow_urls=False):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_limit = queue_limit
+        self.timeout = timeout
+        self.max_upload = max_upload
+        self.root = os.path.realpath(root) if root else None
+        self.allow_urls = allow_urls
+        self.cache_path = cache_path
+        self.cache_size = cache_size
+        self.rules_path = rules_path
+        self.threads = threads
+        self.profile = profile
+        if profile:
+            metrics.enable()
+        self.admitted = 0
+        self.counters = {'requests': 0, 'completed': 0, 'rejected': 0, 'timeouts': 0, 'errors': 0}
+        self.executor = self.make_executor()
+
+    def make_executor(self):
+        if self.threads:
+            if self.rules_path:
+                set_rules_path(self.rules_path)
+            return ThreadPoolExecutor(max_workers=self.workers)
+        return ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                   initargs=(self.rules_path, self.profile))
+
+    def stats(self):
+        return {**self.counters, 'in_flight': self.admitted, 'workers': self.workers,
+                'queue_limit': self.queue_limit, 'pool': 'thread' if self.threads else 'process'}
+
+    # Stage timings (with --profile) and the request counters, as Prometheus text or JSON
+    def metrics_report(self, output_format):
+        snapshot = metrics.snapshot()
+        if output_format == 'json':
+            return {'server': self.stats(), 'analysis': snapshot}
+        if output_format != 'prometheus':
+            raise HttpError(400, "format must be prometheus or json")
+        gauges = {'in_flight': self.admitted, 'workers': self.workers}
+        return metrics.format_prometheus(snapshot, counters=self.counters, gauges=gauges)
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self.read_head(reader)
+                    if request is None:
+                        break
+                    method, target, version, headers = request
+                    keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+                    status, payload, extra_headers = await self.handle_request(method, target, headers, reader)
+                except HttpError as e:
+                    status, payload, extra_headers = e.status, {'error': str(e)}, e.headers
+                    keep_alive = False
+                await self.write_response(writer, status, payload, extra_headers, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_head(self, reader):
+        try:
+            head = await reader.readuntil(b'\r\n\r\n')
+        except asyncio.IncompleteReadError as e:
+            if e.partial.strip():
+                raise HttpError(400, "incomplete request") from None
+            return None
+        except asyncio.LimitOverrunError:
+            raise HttpError(431, "request head too large") from None
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ')
+        except ValueError:
+            raise HttpError(400, "malformed request line") from None
+        headers = {}
+        for line in lines[1:]:
+            if line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+        return method, target, version, headers
+
+    # Text payloads (/metrics in the Prometheus format) are sent as they are, the rest as JSON
+    async def write_response(self, writer, status, payload, extra_headers, keep_alive):
+        if isinstance(payload, str):
+            body = payload.encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            body = json.dumps(payload, default=json_default, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+            content_type = 'application/json'
+        head = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+                f"Content-Type: {content_type}",
+                f"Content-Length: {len(body)}",
+                f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+        head.extend(f"{name}: {value}" for name, value in extra_headers.items())
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+    async def handle_request(self, method, target, headers, reader):
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        if url.path == '/health':
+            return 200, {'status': 'ok'}, {}
+        if url.path == '/stats':
+            return 200, self.stats(), {}
+        if url.path == '/metrics':
+            return 200, self.metrics_report(query.get('format', ['prometheus'])[-1]), {}
+        if url.path not in ENDPOINTS:
+            raise HttpError(404, f"unknown endpoint {url.path}")
+        if method not in ('GET', 'POST'):
+            raise HttpError(405, "use GET with ?path= or POST the archive bytes", {'Allow': 'GET, POST'})
+
+        self.counters['requests'] += 1
+        loop = asyncio.get_running_loop()
+        timeout = parse_number(query, 'timeout', float, self.timeout)
+        deadline = loop.time() + timeout
+        options = {
+            'verbose': parse_flag(query, 'verbose'),
+            'scan': parse_flag(query, 'scan'),
+            'carve': parse_flag(query, 'carve'),
+            'max_depth': parse_number(query, 'max_depth', int),
+            'subtrees': query.get('subtree'),
+        }
+
+        # Admission control: refuse before reading any upload
+        if self.admitted >= self.workers + self.queue_limit:
+            self.counters['rejected'] += 1
+            raise HttpError(503, "analysis queue is full", {'Retry-After': '1'})
+        self.admitted += 1
+        upload = None
+        try:
+            if method == 'POST':
+                upload = await self.receive_upload(headers, reader, deadline)
+                file_path = upload
+                name = query.get('name', ['<upload>'])[-1]
+            else:
+                file_path = self.resolve_path(query)
+                name = None
+            executor = self.executor
+            # The workers keep time with the wall clock rather than the loop's clock
+            future = self.submit(file_path, name, ENDPOINTS[url.path], options,
+                                 time.time() + deadline - loop.time())
+        except BaseException:
+            self.admitted -= 1
+            if upload:
+                os.unlink(upload)
+            raise
+        # Runs on a pool thread when the work itself finishes, even after its request timed out
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self.release, upload))
+
+        try:
+            status, report, snapshot = await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)),
+                                            max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            self.counters['timeouts'] += 1
+            raise HttpError(504, f"analysis did not finish within {timeout} s") from None
+        except BrokenProcessPool:
+            self.counters['errors'] += 1
+            self.restart_pool(executor)
+            raise HttpError(500, "worker process crashed") from None
+        except asyncio.CancelledError:
+            # The work was dropped with a pool shut down by a restart; a cancelled request
+            # task (server shutdown) still cancels the handler
+            if not future.cancelled():
+                raise
+            self.counters['errors'] += 1
+            raise HttpError(503, "worker pool restarted, retry the request", {'Retry-After': '1'}) from None
+        except Exception as e:
+            self.counters['errors'] += 1
+            raise HttpError(500, f"{type(e).__name__}: {e}") from None
+        if snapshot:
+            metrics.merge(snapshot)
+        if status == 504:
+            self.counters['timeouts'] += 1
+            raise HttpError(504, f"analysis did not finish within {timeout} s")
+        self.counters['completed'] += 1
+        return status, report, {}
+
+    def resolve_path(self, query):
+        if 'path' not in query:
+            raise HttpError(400, "missing ?path= (or POST the archive bytes)")
+        file_path = query['path'][-1]
+        # Fetching a URL is not confined by --root and lets clients make the server send
+        # requests, so it needs --allow-urls
+        if URL_PATTERN.match(file_path):
+            if not self.allow_urls:
+                raise HttpError(403, "URL paths are not allowed (see --allow-urls)")
+            if not is_url(file_path):
+                raise HttpError(400, "only http(s) URLs can be analyzed")
+            return file_path
+        if self.root is not None:
+            real_path = os.path.realpath(file_path)
+            if os.path.commonpath([self.root, real_path]) != self.root:
+                raise HttpError(403, f"{file_path} is outside {self.root}")
+        return file_path
+
+    # Spool the request body to a temporary file that the workers can map
+    async def receive_upload(self, headers, reader, deadline):
+        if 'content-length' not in headers:
+            raise HttpError(411, "uploads need a Content-Length")
+        try:
+            length = int(headers['content-length'])
+        except ValueError:
+            raise HttpError(400, "bad Content-Length") from None
+        if length > self.max_upload:
+            raise HttpError(413, f"upload larger than {self.max_upload} bytes")
+        loop = asyncio.get_running_loop()
+        try:
+            body = await asyncio.wait_for(reader.readexactly(length), max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            self.counters['timeouts'] += 1
+            raise HttpError(504, "upload did not finish before the deadline") from None
+        return await loop.run_in_executor(None, spool_upload, body)
+
+    def submit(self, file_path, name, sections, options, deadline):
+        return self.executor.submit(serve_report, file_path, name, sections, options, deadline, not self.threads,
+                                    self.cache_path, self.cache_size)
+
+    # The admitted count follows the work the pool still has to do, not the open requests
+    def release(self, upload):
+        self.admitted -= 1
+        if upload:
+            try:
+                os.unlink(upload)
+            except OSError:
+                pass
+
+    # Replace the pool that broke; requests failing together on it restart it only once,
+    # so the later ones do not shut down the pool that replaced it
+    def restart_pool(self, broken):
+        if broken is not self.executor:
+            return
+        self.executor = self.make_executor()
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+async def serve(server, host='127.0.0.1', port=8080, unix=None):
+    loop = asyncio.get_running_loop()
+    if unix:
+        listener = await asyncio.start_unix_server(server.handle_connection, path=unix, limit=MAX_HEADER_SIZE)
+        where = unix
+    else:
+        listener = await asyncio.start_server(server.handle_connection, host, port, limit=MAX_HEADER_SIZE)
+        where = ', '.join(f"http://{sock.getsockname()[0]}:{sock.getsockname()[1]}" for sock in listener.sockets)
+    stop = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    print(f"Serving ZIP analysis on {where} ({server.workers} {'thread' if server.threads else 'process'} workers, "
+          f"queue limit {server.queue_limit})", file=sys.stderr)
+    async with listener:
+        await stop.wait()
+    server.close()
+    if unix:
+        os.unlink(unix)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve ZIP analysis over HTTP on localhost or a Unix socket.')
+    parser.add_argument('--host', type=str, default='127.0.0.1', help='Address to listen on')
+    parser.add_argument('--port', type=int, default=8080, help='TCP port to listen on')
+    parser.add_argument('--unix', type=str, metavar='PATH', help='Listen on this Unix socket instead of TCP')
+    parser.add_argument('-j', '--jobs', type=int, help='Worker processes (default: number of CPUs)')
+    parser.add_argument('--threads', action='store_true', help='Use worker threads instead of processes')
+    parser.add_argument('--queue-limit', type=int, default=DEFAULT_QUEUE_LIMIT, help='Requests allowed to wait for a worker before new ones get 503')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help='Default deadline of a request in seconds (?timeout= overrides it)')
+    parser.add_argument('--max-upload', type=int, default=DEFAULT_MAX_UPLOAD // (1024 * 1024), metavar='MB', help='Largest archive accepted as a POST body')
+    parser.add_argument('--root', type=str, help='Only serve ?path= requests for files under this directory')
+    parser.add_argument('--allow-urls', action='store_true', help='Also serve ?path= requests for http(s) URLs, which the server then fetches')
+    parser.add_argument('--cache', type=str, metavar='PATH', help='SQLite result cache shared by the workers')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE // (1024 * 1024), metavar='MB', help='Size limit of the result cache')
+    parser.add_argument('--rules', type=str, help='Fingerprint rule file used instead of fingerprints.json')
+    parser.add_argument('--profile', action='store_true', help='Time the analysis stages in the workers and report them on /metrics')
+    args = parser.parse_args()
+
+    if args.rules:
+        try:
+            load_rules(args.rules)
+        except (OSError, ValueError) as e:
+            parser.error(f"--rules: {e}")
+
+    server = AnalysisServer(args.jobs, args.queue_limit, args.timeout, args.max_upload * 1024 * 1024, args.root,
+                            args.cache, args.cache_size * 1024 * 1024, args.rules, args.threads,
+                            args.profile, args.allow_urls)
+    asyncio.run(serve(server, args.host, args.port, args.unix))
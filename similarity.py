@@ -0,0 +1,393 @@
+import os
+import sys
+import time
+import array
+import random
+import sqlite3
+import hashlib
+import argparse
+import datetime
+import functools
+import itertools
+import contextlib
+import operator
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from archive import ZipArchive, BadZipFile, UTF8_FLAG
+from extra_fields import (NtfsExtra, ExtendedTimestampExtra, UnixUidGidExtra, InfoZipUnixExtra,
+                          decode_extra_fields, filetime_to_datetime)
+from batch import iter_batch_paths
+from jsonl import JsonlWriter
+from scoring import score_zip_origin
+
+# Bumped whenever archive_features changes, so old indexes are rebuilt rather than mixed
+INDEX_FORMAT = 1
+# MinHash signature of NUM_HASHES values split into BANDS bands for LSH: two archives land
+# in the same bucket of a band when all of its rows agree. With 16 bands of 4 rows the
+# chance of becoming a candidate passes 50% at a similarity of about 0.5.
+NUM_HASHES = 64
+BANDS = 16
+ROWS = NUM_HASHES // BANDS
+MERSENNE_PRIME = (1 << 61) - 1
+HASH_SEED = 0x5A1F
+
+# (a, b) of the NUM_HASHES hash functions (a * x + b) mod MERSENNE_PRIME, the same in every run
+def make_hash_functions(count, seed):
+    rng = random.Random(seed)
+    return [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(MERSENNE_PRIME)) for _ in range(count)]
+
+HASH_FUNCTIONS = make_hash_functions(NUM_HASHES, HASH_SEED)
+# Archives read from one bucket, and candidates compared, per query. Buckets of identical
+# archives (one tool, one machine) can hold a large part of a corpus; the candidates that
+# share the most bands are compared first.
+MAX_BUCKET_CANDIDATES = 1000
+MAX_CANDIDATES = 2000
+# Features whose hash values are kept in memory
+TOKEN_CACHE_SIZE = 65536
+# Archives featurized between commits while indexing
+INDEX_CHUNK_SIZE = 256
+UNIX_EPOCH = datetime.datetime(1970, 1, 1)
+# Offsets further than this between the DOS time (local) and a UTC timestamp are not time zones
+MAX_TZ_OFFSET = datetime.timedelta(hours=14)
+UNIX_HOST = 3
+MAX_DEPTH_FEATURE = 8
+
+def dos_datetime(mod_date, mod_time):
+    try:
+        return datetime.datetime((mod_date >> 9) + 1980, (mod_date >> 5) & 0xF, mod_date & 0x1F,
+                                 mod_time >> 11, (mod_time >> 5) & 0x3F, (mod_time & 0x1F) * 2)
+    except ValueError:
+        return None
+
+# Time zone of the machine that wrote an entry: its DOS time is local time, the Unix and
+# NTFS timestamps are UTC. Rounded to 15 minutes; None when they are too far apart.
+def tz_offset(local, utc):
+    offset = local - utc
+    if abs(offset) > MAX_TZ_OFFSET:
+        return None
+    minutes = round(offset.total_seconds() / 900) * 15
+    sign = '-' if minutes < 0 else '+'
+    return f"{sign}{abs(minutes) // 60:02}:{abs(minutes) % 60:02}"
+
+# Features of one entry as 'kind:value' tokens: how its extra fields are laid out, the
+# version and host that made it, timestamp precision and time zone, uid/gid and permissions,
+# and the path conventions of its name
+def entry_features(entry, features):
+    host = entry.create_version >> 8
+    features.add(f"made_by:{host}/{entry.create_version & 0xFF}")
+    features.add(f"needs:{entry.extract_version}")
+    features.add(f"method:{entry.compress_type}")
+    features.add(f"flags:{entry.flag_bits:#06x}")
+    if host == UNIX_HOST:
+        features.add(f"mode:{(entry.external_attr >> 16) & 0o7777:o}")
+    else:
+        features.add(f"dos_attr:{entry.external_attr & 0xFF:#04x}")
+
+    fields = entry.extra_fields
+    features.add("extra:" + ('+'.join(f"{header_id:04X}" for header_id, _ in fields) or 'none'))
+    local = None
+    for field in decode_extra_fields(fields):
+        features.add(f"extra_size:{field.header_id:04X}/{len(field.data)}")
+        utc = None
+        if isinstance(field, NtfsExtra):
+            if field.times:
+                whole = all(value % 10_000_000 == 0 for value in field.times)
+                features.add(f"ntfs_precision:{'1s' if whole else '100ns'}")
+                # None (no time feature) for a FILETIME past year 9999
+                utc = filetime_to_datetime(field.times[0])
+        elif isinstance(field, ExtendedTimestampExtra):
+            if field.data:
+                features.add(f"ut_flags:{field.data[0]}/{len(field.times)}")
+            if 'modified' in field.times:
+                utc = UNIX_EPOCH + datetime.timedelta(seconds=field.times['modified'])
+        elif isinstance(field, (UnixUidGidExtra, InfoZipUnixExtra)):
+            if field.uid is not None:
+                features.add(f"uid:{field.uid}")
+                features.add(f"gid:{field.gid}")
+        if utc is not None:
+            if local is None:
+                local = dos_datetime(entry.mod_date, entry.mod_time) or False
+            offset = tz_offset(local, utc) if local else None
+            if offset is not None:
+                features.add(f"tz:{offset}")
+
+    name = entry.filename
+    if name.endswith('/'):
+        features.add("path:folder_entries")
+    if '\\' in name:
+        features.add("path:backslash")
+    if name.startswith('./'):
+        features.add("path:dot_slash")
+    elif name.startswith('/'):
+        features.add("path:absolute")
+    if not name.isascii():
+        features.add("name:utf8" if entry.flag_bits & UTF8_FLAG else "name:legacy_code_page")
+    elif entry.flag_bits & UTF8_FLAG:
+        features.add("name:utf8_flag_ascii")
+    features.add(f"depth:{min(name.rstrip('/').count('/'), MAX_DEPTH_FEATURE)}")
+
+# The feature set of an archive: the entry features, the origin features scored by
+# detect_zip_origin, and the archive layout; sorted for storage
+def archive_features(archive):
+    entries = archive.infolist()
+    features = set()
+    for entry in entries:
+        entry_features(entry, features)
+    origin = score_zip_origin(entries)
+    features.update(f"feature:{name}" for name, count in origin['feature_counts'].items() if count)
+    roots = {entry.filename.split('/', 1)[0] for entry in entries}
+    if len(roots) == 1 and len(entries) > 1:
+        features.add("layout:single_root")
+    features.add(f"entries:2^{len(entries).bit_length()}")
+    return sorted(features)
+
+# Read the features of one archive in a worker; returns (path, size, mtime_ns, features, error)
+def read_archive_features(file_path):
+    try:
+        stat = os.stat(file_path)
+        with ZipArchive(file_path) as archive:
+            return file_path, stat.st_size, stat.st_mtime_ns, archive_features(archive), None
+    except BadZipFile:
+        return file_path, None, None, None, "not a valid ZIP file"
+    except OSError as e:
+        return file_path, None, None, None, str(e)
+    except (OverflowError, ValueError) as e:
+        return file_path, None, None, None, f"unreadable field value: {e}"
+
+# The NUM_HASHES hash values of one feature. Features repeat across a corpus (one tool
+# writes the same ones into every archive), so they are computed once per process.
+@functools.lru_cache(maxsize=TOKEN_CACHE_SIZE)
+def token_hashes(token):
+    x = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+    return tuple((a * x + b) % MERSENNE_PRIME for a, b in HASH_FUNCTIONS)
+
+# MinHash signature of a feature set: the fraction of equal values between two
+# signatures estimates the Jaccard similarity of the sets
+def minhash(features):
+    if not features:
+        return [MERSENNE_PRIME] * NUM_HASHES
+    return list(map(min, zip(*map(token_hashes, features))))
+
+# LSH bucket of every band of a signature, as signed 64-bit SQLite integers
+def band_buckets(signature):
+    return [int.from_bytes(hashlib.blake2b(array.array('Q', signature[band * ROWS:(band + 1) * ROWS]).tobytes(),
+                                           digest_size=8).digest(), 'little', signed=True)
+            for band in range(BANDS)]
+
+def estimate_similarity(signature, other):
+    return sum(map(operator.eq, signature, other)) / NUM_HASHES
+
+def unpack_signature(blob):
+    signature = array.array('Q')
+    signature.frombytes(blob)
+    return signature
+
+# Persistent MinHash/LSH index of archive feature sets. Archives are keyed by absolute
+# path and re-read only when their size or mtime changed, so an index is kept up to
+# date by adding the same sources again.
+class SimilarityIndex:
+    def __init__(self, path):
+        self.path = path
+        self.version = f"{INDEX_FORMAT}:{NUM_HASHES}:{BANDS}:{HASH_SEED}"
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS archives (id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, "
+                        "size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, signature BLOB NOT NULL, "
+                        "features TEXT NOT NULL)")
+        self.db.execute("CREATE TABLE IF NOT EXISTS bands (band INTEGER NOT NULL, bucket INTEGER NOT NULL, "
+                        "archive INTEGER NOT NULL, PRIMARY KEY (band, bucket, archive)) WITHOUT ROWID")
+        self.db.execute("CREATE INDEX IF NOT EXISTS bands_archive ON bands (archive)")
+        self.db.execute("INSERT OR IGNORE INTO meta VALUES ('version', ?)", (self.version,))
+        version = self.db.execute("SELECT value FROM meta WHERE name = 'version'").fetchone()[0]
+        if version != self.version:
+            self.db.close()
+            raise ValueError(f"{path} was built by another version of the index; delete it and index again")
+
+    # Whether the file at path is missing from the index or changed since it was added
+    def needs_update(self, path):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return True
+        row = self.db.execute("SELECT size, mtime_ns FROM archives WHERE path = ?", (path,)).fetchone()
+        return row != (stat.st_size, stat.st_mtime_ns)
+
+    def add(self, path, size, mtime_ns, features):
+        signature = minhash(features)
+        self.remove(path)
+        archive = self.db.execute("INSERT INTO archives (path, size, mtime_ns, signature, features) "
+                                  "VALUES (?, ?, ?, ?, ?)",
+                                  (path, size, mtime_ns, array.array('Q', signature).tobytes(),
+                                   '\n'.join(features))).lastrowid
+        self.db.executemany("INSERT INTO bands VALUES (?, ?, ?)",
+                            [(band, bucket, archive) for band, bucket in enumerate(band_buckets(signature))])
+
+    def remove(self, path):
+        row = self.db.execute("SELECT id FROM archives WHERE path = ?", (path,)).fetchone()
+        if row is not None:
+            self.db.execute("DELETE FROM bands WHERE archive = ?", row)
+            self.db.execute("DELETE FROM archives WHERE id = ?", row)
+
+    # Drop the archives whose file no longer exists; returns how many
+    def prune(self):
+        missing = [path for (path,) in self.db.execute("SELECT path FROM archives") if not os.path.exists(path)]
+        with self.transaction():
+            for path in missing:
+                self.remove(path)
+        return len(missing)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        self.db.execute("BEGIN")
+        try:
+            yield
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        self.db.execute("COMMIT")
+
+    # The indexed archives most similar to a feature set, best first, as dicts with the
+    # estimated similarity and the exact Jaccard similarity of the features;
+    # returns (matches, candidates compared)
+    def similar(self, features, top=10, min_similarity=0.0, exclude=None):
+        signature = minhash(features)
+        shared_bands = Counter()
+        for band, bucket in enumerate(band_buckets(signature)):
+            shared_bands.update(archive for (archive,) in self.db.execute(
+                "SELECT archive FROM bands WHERE band = ? AND bucket = ? LIMIT ?",
+                (band, bucket, MAX_BUCKET_CANDIDATES)))
+        candidates = [archive for archive, _ in shared_bands.most_common(MAX_CANDIDATES)]
+
+        scored = []
+        for start in range(0, len(candidates), 500):
+            chunk = candidates[start:start + 500]
+            rows = self.db.execute(f"SELECT id, path, signature FROM archives WHERE id IN ({','.join('?' * len(chunk))})",
+                                   chunk)
+            for archive, path, blob in rows:
+                similarity = estimate_similarity(signature, unpack_signature(blob))
+                if path != exclude and similarity >= min_similarity:
+                    scored.append((similarity, path, archive))
+        scored.sort(key=lambda match: (-match[0], match[1]))
+
+        matches = []
+        feature_set = set(features)
+        for similarity, path, archive in scored[:top]:
+            other = set(self.db.execute("SELECT features FROM archives WHERE id = ?", (archive,)).fetchone()[0].split('\n'))
+            union = feature_set | other
+            matches.append({
+                'file': path,
+                'similarity': similarity,
+                'jaccard': round(len(feature_set & other) / len(union), 4) if union else 1.0,
+                'only_in_query': sorted(feature_set - other),
+                'only_in_match': sorted(other - feature_set),
+            })
+        return matches, len(candidates)
+
+    def stats(self):
+        return {'archives': self.db.execute("SELECT COUNT(*) FROM archives").fetchone()[0],
+                'buckets': self.db.execute("SELECT COUNT(*) FROM (SELECT DISTINCT band, bucket FROM bands)").fetchone()[0]}
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Add the archives of sources (files, directories, glob patterns or '-') that are new or
+# changed, reading them on a process pool; yields (path, error or None) per archive read
+def update_index(index, sources, workers=None):
+    workers = workers or os.cpu_count() or 1
+    paths = (os.path.abspath(path) for path in iter_batch_paths(sources))
+    paths = (path for path in paths if index.needs_update(path))
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        while True:
+            chunk = list(itertools.islice(paths, INDEX_CHUNK_SIZE))
+            if not chunk:
+                break
+            results = executor.map(read_archive_features, chunk, chunksize=16) if executor else map(read_archive_features, chunk)
+            with index.transaction():
+                for path, size, mtime_ns, features, error in results:
+                    if error is None:
+                        index.add(path, size, mtime_ns, features)
+                    yield path, error
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+def print_update(index, sources, workers=None):
+    start = time.perf_counter()
+    added = errors = 0
+    for path, error in update_index(index, sources, workers):
+        if error:
+            errors += 1
+            print(f"Skipped {path}: {error}", file=sys.stderr)
+        else:
+            added += 1
+    elapsed = time.perf_counter() - start
+    rate = (added + errors) / elapsed if elapsed > 0 else 0.0
+    print(f"Index: {added} archives added or updated, {errors} errors in {elapsed:.2f} s ({rate:.1f} files/sec)",
+          file=sys.stderr)
+
+def print_similar(index, file_path, top=10, min_similarity=0.5, verbose=False, output_format='text'):
+    with ZipArchive(file_path) as archive:
+        features = archive_features(archive)
+    exclude = os.path.abspath(file_path) if os.path.exists(file_path) else None
+    start = time.perf_counter()
+    matches, candidates = index.similar(features, top, min_similarity, exclude)
+    elapsed = time.perf_counter() - start
+    if output_format == 'jsonl':
+        with JsonlWriter(sys.stdout) as writer:
+            for match in matches:
+                writer.write({'query': file_path, **match})
+        return matches
+    print(f"\nArchives similar to {file_path} ({candidates} candidates, looked up in {elapsed * 1000:.1f} ms):")
+    if not matches:
+        print("  None above the minimum similarity.")
+    for match in matches:
+        print(f"  {match['similarity']:.2f}  {match['file']}  (Jaccard {match['jaccard']:.2f})")
+        if verbose:
+            print(f"        only in query: {', '.join(match['only_in_query']) or '-'}")
+            print(f"        only in match: {', '.join(match['only_in_match']) or '-'}")
+    return matches
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Index archives by the features they were made with and find archives made the same way.')
+    parser.add_argument('--index', type=str, required=True, metavar='PATH', help='SQLite index file, created when missing')
+    parser.add_argument('--add', type=str, nargs='+', metavar='SOURCE', help="Index these files, directories, glob patterns or '-' (paths on stdin); unchanged archives are skipped")
+    parser.add_argument('--prune', action='store_true', help='Drop archives that no longer exist from the index')
+    parser.add_argument('-q', '--query', type=str, metavar='FILE', help='List the indexed archives most similar to FILE')
+    parser.add_argument('--top', type=int, default=10, help='Matches listed by --query')
+    parser.add_argument('--min-similarity', type=float, default=0.5, help='Lowest estimated similarity (0-1) listed by --query')
+    parser.add_argument('-j', '--jobs', type=int, help='Worker processes reading archives for --add (default: number of CPUs)')
+    parser.add_argument('--format', choices=['text', 'jsonl'], default='text', help='Output format of --query')
+    parser.add_argument('-v', '--verbose', action='store_true', help='With --query, list the features each match does not share')
+    args = parser.parse_args()
+    if not (args.add or args.prune or args.query):
+        parser.error("nothing to do: use --add, --prune and/or --query")
+
+    try:
+        index = SimilarityIndex(args.index)
+    except (sqlite3.Error, ValueError) as e:
+        parser.error(f"--index: {e}")
+    with index:
+        if args.prune:
+            print(f"Index: {index.prune()} missing archives dropped", file=sys.stderr)
+        if args.add:
+            print_update(index, args.add, args.jobs)
+        if args.query:
+            try:
+                print_similar(index, args.query, args.top, args.min_similarity, args.verbose, args.format)
+            except BadZipFile:
+                print(f"Error: The file '{args.query}' is not a valid ZIP file.")
+            except OSError as e:
+                print(f"Error: {e}")
+            except (OverflowError, ValueError) as e:
+                print(f"Error: The file '{args.query}' has an unreadable field value: {e}")
+        stats = index.stats()
+        print(f"Index: {stats['archives']} archives in {stats['buckets']} buckets", file=sys.stderr)
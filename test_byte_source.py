@@ -0,0 +1,85 @@
+import threading
+import unittest
+import http.server
+from byte_source import HttpRangeSource, BLOCK_SIZE, TAIL_BLOCKS
+
+# Serves the server's body at every path, honouring Range and If-Match unless told not to
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        body, etag = self.server.body, self.server.etag
+        if_match = self.headers.get('If-Match')
+        if if_match is not None and if_match != etag:
+            self.send_response(412)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        byte_range = self.headers.get('Range', '')
+        status = 200
+        start, end = 0, len(body) - 1
+        if self.server.honor_range and byte_range.startswith('bytes='):
+            first, _, last = byte_range[6:].partition('-')
+            if first:
+                start, end = int(first), min(len(body) - 1, int(last))
+            else:
+                start = max(0, len(body) - int(last))
+            status = 206
+        self.send_response(status)
+        if status == 206:
+            self.send_header('Content-Range', f"bytes {start}-{end}/{len(body)}")
+        if etag:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        self.wfile.write(body[start:end + 1])
+
+class HttpRangeSourceTest(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+        self.server.body = bytes(range(256)) * (4 * BLOCK_SIZE // 256) + b'end'
+        self.server.etag = '"v1"'
+        self.server.honor_range = True
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/a.zip"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_byte_range(self):
+        body = self.server.body
+        with HttpRangeSource(self.url) as source:
+            self.assertEqual(len(source), len(body))
+            self.assertIsNone(source.whole)
+            self.assertEqual(source[-3:], b'end')
+            self.assertEqual(source.requests, 1)
+            self.assertEqual(source[1000:1010], body[1000:1010])
+            self.assertEqual(source[BLOCK_SIZE - 5:BLOCK_SIZE + 5], body[BLOCK_SIZE - 5:BLOCK_SIZE + 5])
+            self.assertEqual(source[70000], body[70000])
+            self.assertLess(source.bytes_read, len(body) + TAIL_BLOCKS * BLOCK_SIZE)
+
+    def test_range_ignored(self):
+        self.server.honor_range = False
+        body = self.server.body
+        with HttpRangeSource(self.url) as source:
+            self.assertEqual(source.whole, body)
+            self.assertEqual(len(source), len(body))
+            self.assertEqual(source[1000:1010], body[1000:1010])
+            self.assertEqual(source[-3:], b'end')
+            self.assertEqual(source.requests, 1)
+
+    def test_etag_change(self):
+        with HttpRangeSource(self.url) as source:
+            self.assertEqual(source.etag, '"v1"')
+            self.server.body = bytes(len(self.server.body))
+            self.server.etag = '"v2"'
+            with self.assertRaisesRegex(OSError, 'HTTP 412'):
+                source[0:10]
+
+if __name__ == "__main__":
+    unittest.main()
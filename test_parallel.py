@@ -0,0 +1,55 @@
+import io
+import os
+import signal
+import zipfile
+import tempfile
+import unittest
+import contextlib
+from unittest import mock
+import parallel
+from report import build_report
+
+PARENT_PID = os.getpid()
+real_analyze_shard = parallel.analyze_shard
+real_directory_dicts_shard = parallel.directory_dicts_shard
+
+# Kill the worker process that runs a task, so that only the fallback in this process
+# gets results
+def kill_worker():
+    if os.getpid() != PARENT_PID:
+        os.kill(os.getpid(), signal.SIGKILL)
+
+def analyze_shard_or_die(location, verbose):
+    kill_worker()
+    return real_analyze_shard(location, verbose)
+
+def directory_dicts_shard_or_die(location):
+    kill_worker()
+    return real_directory_dicts_shard(location)
+
+class WorkerDeathTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.path = os.path.join(tempfile.mkdtemp(), 'many.zip')
+        with zipfile.ZipFile(cls.path, 'w') as zip_file:
+            for index in range(parallel.MIN_SHARDED_ENTRIES + 10):
+                zip_file.writestr(f"dir{index % 7}/file{index}.txt", b'')
+
+    def check_fallback(self, sections, name, func):
+        expected = build_report(self.path, **sections)
+        stderr = io.StringIO()
+        with mock.patch.object(parallel, name, func), contextlib.redirect_stderr(stderr):
+            report = build_report(self.path, jobs=2, **sections)
+        self.assertEqual(report, expected)
+        self.assertIn("a worker process died", stderr.getvalue())
+        self.assertIsNone(parallel.worker_data)
+
+    def test_analysis(self):
+        self.check_fallback({'analyze': True}, 'analyze_shard', analyze_shard_or_die)
+
+    def test_records(self):
+        self.check_fallback({'analyze': True, 'hex_view': True}, 'directory_dicts_shard',
+                            directory_dicts_shard_or_die)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import time
+import asyncio
+import zipfile
+import tempfile
+import unittest
+from server import AnalysisServer, HttpError, serve_report
+
+class ResolvePathTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.server = AnalysisServer(workers=1, root=self.root)
+
+    def resolve(self, path, server=None):
+        return (server or self.server).resolve_path({'path': [path]})
+
+    def test_path_under_root(self):
+        path = os.path.join(self.root, 'a.zip')
+        self.assertEqual(self.resolve(path), path)
+
+    def test_path_outside_root(self):
+        with self.assertRaises(HttpError) as caught:
+            self.resolve(os.path.join(self.root, '..', 'a.zip'))
+        self.assertEqual(caught.exception.status, 403)
+
+    def test_url_rejected(self):
+        for path in ('http://127.0.0.1:8766/a.zip', 'HTTPS://example.com/a.zip', 'ftp://example.com/a.zip'):
+            for server in (self.server, AnalysisServer(workers=1)):
+                with self.assertRaises(HttpError) as caught:
+                    self.resolve(path, server)
+                self.assertEqual(caught.exception.status, 403)
+
+    def test_url_allowed(self):
+        server = AnalysisServer(workers=1, root=self.root, allow_urls=True)
+        self.assertEqual(self.resolve('http://127.0.0.1:8766/a.zip', server), 'http://127.0.0.1:8766/a.zip')
+        with self.assertRaises(HttpError) as caught:
+            self.resolve('ftp://example.com/a.zip', server)
+        self.assertEqual(caught.exception.status, 400)
+
+class ServeReportTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'a.zip')
+        with zipfile.ZipFile(self.path, 'w') as zip_file:
+            zip_file.writestr('a.txt', 'a')
+
+    def test_within_deadline(self):
+        status, report, _ = serve_report(self.path, None, {'analyze': True}, {}, time.time() + 30, use_alarm=True)
+        self.assertEqual(status, 200)
+        self.assertNotIn('error', report)
+        self.assertIn('origin', report)
+
+    def test_deadline_passed_in_queue(self):
+        for deadline in (time.time(), time.time() - 1):
+            status, report, _ = serve_report(self.path, None, {'analyze': True}, {}, deadline, use_alarm=True)
+            self.assertEqual(status, 504)
+            self.assertEqual(report['error'], "timed out at the request deadline")
+
+    def test_error_status(self):
+        not_zip = os.path.join(self.directory, 'b.zip')
+        with open(not_zip, 'wb') as f:
+            f.write(b'not a zip file')
+        for path, expected in ((os.path.join(self.directory, 'missing.zip'), 404), (not_zip, 422)):
+            status, report, _ = serve_report(path, None, {'analyze': True}, {})
+            self.assertEqual(status, expected)
+            self.assertIn('error', report)
+
+    def test_request_status(self):
+        server = AnalysisServer(workers=1, threads=True)
+        try:
+            for path, expected in ((self.path, 200), (os.path.join(self.directory, 'missing.zip'), 404)):
+                status, _, _ = asyncio.run(server.handle_request('GET', f"/analyze?path={path}", {}, None))
+                self.assertEqual(status, expected)
+        finally:
+            server.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,26 +1,183 @@
-import zipfile
 import os
+import sys
+from array import array
+import metrics
+from archive import shared_archive
+from cache import cached_result
 
-# Print file tree
-def print_file_tree(file_path):
-    print(f"\nFile Tree for: {file_path}\n")
-    with zipfile.ZipFile(file_path, 'r') as zip_file:
-        file_tree = {}
+# Lines collected before each write to the output stream
+RENDER_BATCH_LINES = 4096
+
+# Paths of an archive as a tree. Nodes are indexes into parallel arrays (node 0 is the
+# root and a parent always comes before its children), so a file costs a name and a few
+# array slots instead of a dict of its own. Only folders get a {name: child} dict, which
+# also keeps their children in the order they were first seen. The node and sizes of
+# each entry are appended as it is added and summed over subtrees on demand.
+class FileTree:
+    def __init__(self):
+        self.names = ['']
+        self.parents = array('i', [-1])
+        self.entry_nodes = array('i')
+        self.entry_compressed = array('q')
+        self.entry_uncompressed = array('q')
+        self.folders = {}
+        self.totals = None
+
+    def __len__(self):
+        return len(self.names)
+
+    # Only the arrays go to the cache; the folders are rebuilt when loaded
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['folders'] = state['totals'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.folders = {}
+        for node in range(1, len(self.names)):
+            self.folders.setdefault(self.parents[node], {})[self.names[node]] = node
+
+    def child(self, parent, name):
+        children = self.folders.get(parent)
+        return -1 if children is None else children.get(name, -1)
+
+    # Add one entry path, creating its missing components
+    def add(self, path, compress_size=0, file_size=0):
+        node = 0
+        folders = self.folders
+        names = self.names
+        for part in path.split('/'):
+            if not part:
+                continue
+            children = folders.get(node)
+            if children is None:
+                children = folders[node] = {}
+            child = children.get(part)
+            if child is None:
+                child = children[part] = len(names)
+                names.append(part)
+                self.parents.append(node)
+            node = child
+        self.entry_nodes.append(node)
+        self.entry_compressed.append(compress_size)
+        self.entry_uncompressed.append(file_size)
+        self.totals = None
+        return node
+
+    # (entries, compressed, uncompressed) arrays per node summed over its subtree; the
+    # entries are added to their own node, then one backwards pass adds every node to
+    # its parent since children always come after it
+    def subtree_totals(self):
+        if self.totals is None:
+            count = len(self.names)
+            entries = array('q', bytes(8 * count))
+            compressed = array('q', bytes(8 * count))
+            uncompressed = array('q', bytes(8 * count))
+            for node, compress_size, file_size in zip(self.entry_nodes, self.entry_compressed, self.entry_uncompressed):
+                entries[node] += 1
+                compressed[node] += compress_size
+                uncompressed[node] += file_size
+            parents = self.parents
+            for node in range(count - 1, 0, -1):
+                parent = parents[node]
+                entries[parent] += entries[node]
+                compressed[parent] += compressed[node]
+                uncompressed[parent] += uncompressed[node]
+            self.totals = (entries, compressed, uncompressed)
+        return self.totals
+
+    # Node of a '/'-separated path, or -1
+    def find(self, path):
+        node = 0
+        for part in path.split('/'):
+            if part:
+                node = self.child(node, part)
+                if node == -1:
+                    break
+        return node
+
+    # (node, depth) in print order, without recursion. max_depth stops below that depth
+    # (top-level components are depth 1); subtrees keeps only those paths, their
+    # ancestors and everything below them.
+    def walk(self, max_depth=None, subtrees=None):
+        on_path = None
+        targets = None
+        if subtrees:
+            on_path = set()
+            targets = set()
+            for path in subtrees:
+                node = self.find(path)
+                if node > 0:
+                    targets.add(node)
+                    while node > 0:
+                        on_path.add(node)
+                        node = self.parents[node]
+
+        folders = self.folders
+        # One (children iterator, depth, inside a kept subtree) per open folder
+        stack = [(iter(folders.get(0, {}).values()), 1, on_path is None)]
+        while stack:
+            children, depth, inside = stack[-1]
+            node = next(children, None)
+            if node is None:
+                stack.pop()
+                continue
+            if not inside and node not in on_path:
+                continue
+            yield node, depth
+            if node in folders and (max_depth is None or depth < max_depth):
+                stack.append((iter(folders[node].values()), depth + 1, inside or node in targets))
+
+    # The nested {name: {children}} form used by the JSON output
+    def to_dict(self, max_depth=None, subtrees=None):
+        levels = {0: {}}
+        for node, depth in self.walk(max_depth, subtrees):
+            levels[node] = levels[self.parents[node]][self.names[node]] = {}
+        return levels[0]
+
+def format_tree_stats(tree, node):
+    entries, compressed, uncompressed = tree.subtree_totals()
+    return f"({entries[node]} entries, {compressed[node]} bytes compressed, {uncompressed[node]} bytes uncompressed)"
+
+# Build the tree index of the entries, streaming them from the central directory
+def build_file_tree(file_path, archive=None, cache=None):
+    return cached_result(cache, file_path, 'file_tree', lambda: read_file_tree(file_path, archive))
+
+def read_file_tree(file_path, archive=None):
+    file_tree = FileTree()
+    with shared_archive(file_path, archive) as zip_file, metrics.stage('tree_build'):
         for info in zip_file.infolist():
-            parts = [part for part in info.filename.split('/') if part]
-            current_level = file_tree
-            for part in parts:
-                if part not in current_level:
-                    current_level[part] = {}
-                current_level = current_level[part]
-
-        def print_tree(level, indent=""):
-            for key, value in level.items():
-                if value:
-                    print(f"{indent}|___{key}:")
-                    print_tree(value, indent + "    ")
-                else:
-                    print(f"{indent}|___{key}")
-
-        print(f"{os.path.basename(file_path)}:")
-        print_tree(file_tree)
+            file_tree.add(info.filename, info.compress_size, info.file_size)
+    metrics.count('tree_nodes', len(file_tree))
+    return file_tree
+
+# Print file tree; with stats, directories show their entry counts and total sizes
+def print_file_tree(file_path, file_tree=None, archive=None, cache=None, max_depth=None, subtrees=None, stats=False):
+    if file_tree is None:
+        file_tree = build_file_tree(file_path, archive, cache)
+    with metrics.stage('output'):
+        out = sys.stdout
+        print(f"\nFile Tree for: {file_path}\n")
+
+        names = file_tree.names
+        folders = file_tree.folders
+        indents = ['']
+        lines = [f"{os.path.basename(file_path)}: {format_tree_stats(file_tree, 0)}" if stats
+                 else f"{os.path.basename(file_path)}:"]
+        for node, depth in file_tree.walk(max_depth, subtrees):
+            while len(indents) < depth:
+                indents.append(indents[-1] + "    ")
+            if node not in folders:
+                lines.append(f"{indents[depth - 1]}|___{names[node]}")
+            elif stats:
+                lines.append(f"{indents[depth - 1]}|___{names[node]}: {format_tree_stats(file_tree, node)}")
+            else:
+                lines.append(f"{indents[depth - 1]}|___{names[node]}:")
+            if len(lines) >= RENDER_BATCH_LINES:
+                lines.append('')
+                out.write('\n'.join(lines))
+                lines.clear()
+        lines.append('')
+        out.write('\n'.join(lines))
+    return file_tree
@@ -0,0 +1,408 @@
+import re
+import struct
+from collections import namedtuple
+from byte_source import BUFFER_TYPES
+
+LOCAL_FILE_HEADER_SIGNATURE = b'PK\x03\x04'
+CENTRAL_DIRECTORY_SIGNATURE = b'PK\x01\x02'
+END_OF_CENTRAL_DIRECTORY_SIGNATURE = b'PK\x05\x06'
+ZIP64_END_OF_CENTRAL_DIRECTORY_SIGNATURE = b'PK\x06\x06'
+ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR_SIGNATURE = b'PK\x06\x07'
+DATA_DESCRIPTOR_SIGNATURE = b'PK\x07\x08'
+
+# Fixed-size parts of the ZIP records (little endian, signature included). Records are
+# unpacked from slices, so data can also be a byte_source.ByteSource instead of a buffer.
+LOCAL_FILE_HEADER = struct.Struct('<4sHHHHHIIIHH')
+CENTRAL_DIRECTORY_HEADER = struct.Struct('<4sHHHHHHIIIHHHHHII')
+END_OF_CENTRAL_DIRECTORY = struct.Struct('<4sHHHHIIH')
+ZIP64_END_OF_CENTRAL_DIRECTORY = struct.Struct('<4sQHHIIQQQQ')
+ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR = struct.Struct('<4sIQI')
+EXTRA_FIELD_HEADER = struct.Struct('<HH')
+# Signature, then file name, extra field and comment lengths of a central directory header
+CENTRAL_DIRECTORY_LENGTHS = struct.Struct('<4s24xHHH')
+
+# Header fields set to these values are stored in the ZIP64 extra field (0x0001) instead
+ZIP64_EXTRA_ID = 0x0001
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP64_COUNT_LIMIT = 0xFFFF
+
+LocalFileHeader = namedtuple('LocalFileHeader', [
+    'offset', 'version_needed', 'flags', 'compression_method',
+    'mod_time', 'mod_date', 'crc32', 'compressed_size', 'uncompressed_size',
+    'file_name', 'extra', 'data_offset',
+])
+
+CentralDirectoryHeader = namedtuple('CentralDirectoryHeader', [
+    'offset', 'version_made_by', 'version_needed', 'flags', 'compression_method',
+    'mod_time', 'mod_date', 'crc32', 'compressed_size', 'uncompressed_size',
+    'disk_number_start', 'internal_attributes', 'external_attributes',
+    'local_header_offset', 'file_name', 'extra', 'comment',
+])
+
+EndOfCentralDirectory = namedtuple('EndOfCentralDirectory', [
+    'offset', 'disk_number', 'cd_start_disk', 'cd_entries_this_disk',
+    'cd_entries_total', 'cd_size', 'cd_offset', 'comment',
+])
+
+Zip64EndOfCentralDirectory = namedtuple('Zip64EndOfCentralDirectory', [
+    'offset', 'record_size', 'version_made_by', 'version_needed',
+    'disk_number', 'cd_start_disk', 'cd_entries_this_disk',
+    'cd_entries_total', 'cd_size', 'cd_offset', 'extensible_data',
+])
+
+Zip64EndOfCentralDirectoryLocator = namedtuple('Zip64EndOfCentralDirectoryLocator', [
+    'offset', 'zip64_eocd_disk', 'zip64_eocd_offset', 'total_disks',
+])
+
+UnknownRecord = namedtuple('UnknownRecord', ['offset', 'signature'])
+
+# Where the central directory is, after resolving ZIP64 values; base is the
+# number of bytes in front of the archive (SFX stub, prepended data)
+CentralDirectoryLocation = namedtuple('CentralDirectoryLocation', [
+    'eocd', 'zip64_locator', 'zip64_eocd', 'offset', 'size', 'entries', 'base',
+])
+
+WALK_SIGNATURES = (
+    LOCAL_FILE_HEADER_SIGNATURE,
+    CENTRAL_DIRECTORY_SIGNATURE,
+    END_OF_CENTRAL_DIRECTORY_SIGNATURE,
+    ZIP64_END_OF_CENTRAL_DIRECTORY_SIGNATURE,
+    ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR_SIGNATURE,
+)
+
+# Any of WALK_SIGNATURES, so a buffer is scanned by one regex search instead of a
+# find and a check per 'PK'
+SIGNATURE_PATTERN = re.compile(rb'PK(?:\x01\x02|\x03\x04|\x05\x06|\x06[\x06\x07])')
+
+# Compression methods listed in the APPNOTE and the highest "version needed to extract"
+# it defines (6.3); carved headers outside them are rejected
+KNOWN_COMPRESSION_METHODS = frozenset((0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 12, 14, 16, 18, 19, 20, 93, 94, 95, 96, 97, 98, 99))
+MAX_VERSION_NEEDED = 63
+
+# Find the next record signature at or after offset
+def find_next_signature(data, offset):
+    if isinstance(data, BUFFER_TYPES):
+        match = SIGNATURE_PATTERN.search(data, offset)
+        return -1 if match is None else match.start()
+    while True:
+        offset = data.find(b'PK', offset)
+        if offset == -1:
+            return -1
+        if data[offset:offset + 4] in WALK_SIGNATURES:
+            return offset
+        offset += 1
+
+def read_local_file_header(data, offset):
+    end = offset + LOCAL_FILE_HEADER.size
+    if end > len(data):
+        return None
+    (_, version_needed, flags, compression_method, mod_time, mod_date, crc32,
+     compressed_size, uncompressed_size, file_name_length,
+     extra_field_length) = LOCAL_FILE_HEADER.unpack(data[offset:end])
+    file_name = data[end:end + file_name_length]
+    end += file_name_length
+    extra = data[end:end + extra_field_length]
+    end += extra_field_length
+    return LocalFileHeader(
+        offset, version_needed, flags, compression_method, mod_time, mod_date,
+        crc32, compressed_size, uncompressed_size, file_name, extra, end)
+
+def read_central_directory_header(data, offset):
+    end = offset + CENTRAL_DIRECTORY_HEADER.size
+    if end > len(data):
+        return None
+    (_, version_made_by, version_needed, flags, compression_method, mod_time,
+     mod_date, crc32, compressed_size, uncompressed_size, file_name_length,
+     extra_field_length, file_comment_length, disk_number_start,
+     internal_attributes, external_attributes,
+     local_header_offset) = CENTRAL_DIRECTORY_HEADER.unpack(data[offset:end])
+    file_name = data[end:end + file_name_length]
+    end += file_name_length
+    extra = data[end:end + extra_field_length]
+    end += extra_field_length
+    comment = data[end:end + file_comment_length]
+    return CentralDirectoryHeader(
+        offset, version_made_by, version_needed, flags, compression_method,
+        mod_time, mod_date, crc32, compressed_size, uncompressed_size,
+        disk_number_start, internal_attributes, external_attributes,
+        local_header_offset, file_name, extra, comment)
+
+def read_end_of_central_directory(data, offset):
+    end = offset + END_OF_CENTRAL_DIRECTORY.size
+    if end > len(data):
+        return None
+    (_, disk_number, cd_start_disk, cd_entries_this_disk, cd_entries_total,
+     cd_size, cd_offset, comment_length) = END_OF_CENTRAL_DIRECTORY.unpack(data[offset:end])
+    comment = data[end:end + comment_length]
+    return EndOfCentralDirectory(
+        offset, disk_number, cd_start_disk, cd_entries_this_disk,
+        cd_entries_total, cd_size, cd_offset, comment)
+
+def read_zip64_end_of_central_directory(data, offset):
+    end = offset + ZIP64_END_OF_CENTRAL_DIRECTORY.size
+    if end > len(data):
+        return None
+    (_, record_size, version_made_by, version_needed, disk_number, cd_start_disk,
+     cd_entries_this_disk, cd_entries_total, cd_size,
+     cd_offset) = ZIP64_END_OF_CENTRAL_DIRECTORY.unpack(data[offset:end])
+    # record_size counts the bytes after itself: 44 fixed bytes plus the extensible data
+    extensible_data = data[end:offset + 12 + record_size] if record_size > 44 else b''
+    return Zip64EndOfCentralDirectory(
+        offset, record_size, version_made_by, version_needed, disk_number,
+        cd_start_disk, cd_entries_this_disk, cd_entries_total, cd_size,
+        cd_offset, extensible_data)
+
+def read_zip64_end_of_central_directory_locator(data, offset):
+    end = offset + ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR.size
+    if end > len(data):
+        return None
+    (_, zip64_eocd_disk, zip64_eocd_offset,
+     total_disks) = ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR.unpack(data[offset:end])
+    return Zip64EndOfCentralDirectoryLocator(offset, zip64_eocd_disk, zip64_eocd_offset, total_disks)
+
+RECORD_READERS = {
+    LOCAL_FILE_HEADER_SIGNATURE: read_local_file_header,
+    CENTRAL_DIRECTORY_SIGNATURE: read_central_directory_header,
+    END_OF_CENTRAL_DIRECTORY_SIGNATURE: read_end_of_central_directory,
+    ZIP64_END_OF_CENTRAL_DIRECTORY_SIGNATURE: read_zip64_end_of_central_directory,
+    ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR_SIGNATURE: read_zip64_end_of_central_directory_locator,
+}
+
+# Yield (header_id, data) for each field of an extra field block
+def iter_extra_fields(extra):
+    idx = 0
+    while idx + EXTRA_FIELD_HEADER.size <= len(extra):
+        header_id, data_size = EXTRA_FIELD_HEADER.unpack_from(extra, idx)
+        yield header_id, extra[idx + 4:idx + 4 + data_size]
+        idx += 4 + data_size
+
+# Read the (name, size) values listed in needed from a ZIP64 extra field (0x0001)
+def unpack_zip64_extra(extra, needed):
+    values = {}
+    for header_id, data in iter_extra_fields(extra):
+        if header_id == ZIP64_EXTRA_ID:
+            pos = 0
+            for name, size in needed:
+                if pos + size > len(data):
+                    break
+                values[name] = int.from_bytes(data[pos:pos + size], 'little')
+                pos += size
+            break
+    return values
+
+# Values stored in the ZIP64 extra field of a local or central directory header.
+# Only the fields whose header value is 0xFFFFFFFF (0xFFFF for the disk) are present, in this order.
+def read_zip64_extra(record):
+    needed = []
+    if record.uncompressed_size == ZIP64_LIMIT:
+        needed.append(('uncompressed_size', 8))
+    if record.compressed_size == ZIP64_LIMIT:
+        needed.append(('compressed_size', 8))
+    if isinstance(record, CentralDirectoryHeader):
+        if record.local_header_offset == ZIP64_LIMIT:
+            needed.append(('local_header_offset', 8))
+        if record.disk_number_start == ZIP64_COUNT_LIMIT:
+            needed.append(('disk_number_start', 4))
+    return unpack_zip64_extra(record.extra, needed) if needed else {}
+
+# The record with its 32-bit sizes and offsets replaced by their ZIP64 values
+def resolve_zip64(record):
+    values = read_zip64_extra(record)
+    return record._replace(**values) if values else record
+
+# Size of a record as stored in the archive
+def record_size(record):
+    if isinstance(record, LocalFileHeader):
+        return record.data_offset - record.offset
+    if isinstance(record, CentralDirectoryHeader):
+        return (CENTRAL_DIRECTORY_HEADER.size + len(record.file_name)
+                + len(record.extra) + len(record.comment))
+    if isinstance(record, EndOfCentralDirectory):
+        return END_OF_CENTRAL_DIRECTORY.size + len(record.comment)
+    if isinstance(record, Zip64EndOfCentralDirectory):
+        return 12 + record.record_size
+    if isinstance(record, Zip64EndOfCentralDirectoryLocator):
+        return ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR.size
+    return 0
+
+# Walk the archive front to back and yield the records in file order
+def iter_zip_records(data, offset=0):
+    size = len(data)
+    while offset < size:
+        signature = data[offset:offset + 4]
+        reader = RECORD_READERS.get(signature)
+        record = reader(data, offset) if reader else None
+
+        if record is None:
+            yield UnknownRecord(offset, signature)
+            return
+        yield record
+
+        #! Move to the next record
+        if isinstance(record, LocalFileHeader):
+            compressed_size = resolve_zip64(record).compressed_size
+            if compressed_size > 0:
+                offset = record.data_offset + compressed_size
+            else:
+                offset = find_next_signature(data, record.data_offset)
+                if offset == -1:
+                    return
+        else:
+            offset += record_size(record)
+
+# The EOCD record sits in the last 22 bytes plus at most a 64 KiB comment
+EOCD_SEARCH_LIMIT = END_OF_CENTRAL_DIRECTORY.size + 0xFFFF
+
+# The ZIP64 EOCD record is at the offset given by the locator, or right before the locator
+# when data was prepended to the archive
+def find_zip64_end_of_central_directory(data, locator):
+    candidates = (locator.zip64_eocd_offset, locator.offset - ZIP64_END_OF_CENTRAL_DIRECTORY.size)
+    for offset in candidates:
+        if 0 <= offset and data[offset:offset + 4] == ZIP64_END_OF_CENTRAL_DIRECTORY_SIGNATURE:
+            return read_zip64_end_of_central_directory(data, offset)
+    return None
+
+def read_central_directory_location(data, offset):
+    eocd = read_end_of_central_directory(data, offset)
+    if eocd is None:
+        return None
+    zip64_locator = zip64_eocd = None
+    end = offset
+    entries, size, cd_offset = eocd.cd_entries_total, eocd.cd_size, eocd.cd_offset
+
+    locator_offset = offset - ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR.size
+    if locator_offset >= 0 and data[locator_offset:locator_offset + 4] == ZIP64_END_OF_CENTRAL_DIRECTORY_LOCATOR_SIGNATURE:
+        zip64_locator = read_zip64_end_of_central_directory_locator(data, locator_offset)
+        zip64_eocd = find_zip64_end_of_central_directory(data, zip64_locator)
+        if zip64_eocd is not None:
+            end = zip64_eocd.offset
+            entries, size, cd_offset = zip64_eocd.cd_entries_total, zip64_eocd.cd_size, zip64_eocd.cd_offset
+
+    if size > end or cd_offset > end - size:
+        return None
+    start = end - size
+    if entries and data[start:start + 4] != CENTRAL_DIRECTORY_SIGNATURE:
+        return None
+    return CentralDirectoryLocation(eocd, zip64_locator, zip64_eocd, start, size, entries, start - cd_offset)
+
+# Scan backward from the end of the file for an EOCD record that points at a central directory
+def locate_central_directory(data):
+    start = max(0, len(data) - EOCD_SEARCH_LIMIT)
+    offset = data.rfind(END_OF_CENTRAL_DIRECTORY_SIGNATURE, start)
+    while offset != -1:
+        location = read_central_directory_location(data, offset)
+        if location is not None:
+            return location
+        offset = data.rfind(END_OF_CENTRAL_DIRECTORY_SIGNATURE, start, offset)
+    return None
+
+# Yield the central directory headers; an UnknownRecord ends a damaged directory
+def iter_central_directory(data, location):
+    offset = location.offset
+    end = location.offset + location.size
+    while offset < end:
+        signature = data[offset:offset + 4]
+        record = None
+        if signature == CENTRAL_DIRECTORY_SIGNATURE:
+            record = read_central_directory_header(data, offset)
+        if record is None:
+            yield UnknownRecord(offset, signature)
+            return
+        yield record
+        offset += record_size(record)
+
+# Split the central directory into (offset, size) ranges of at most shard_entries headers,
+# reading only the signature and length fields of each header; None when a header is
+# damaged or runs past the end of the directory
+def split_central_directory(data, location, shard_entries):
+    ranges = []
+    unpack_from = CENTRAL_DIRECTORY_LENGTHS.unpack_from
+    offset = start = location.offset
+    end = location.offset + location.size
+    count = 0
+    while offset < end:
+        if offset + CENTRAL_DIRECTORY_HEADER.size > len(data):
+            return None
+        signature, name_length, extra_length, comment_length = unpack_from(data, offset)
+        if signature != CENTRAL_DIRECTORY_SIGNATURE:
+            return None
+        offset += CENTRAL_DIRECTORY_HEADER.size + name_length + extra_length + comment_length
+        count += 1
+        if count == shard_entries:
+            ranges.append((start, offset - start))
+            start = offset
+            count = 0
+    if offset != end:
+        return None
+    if count:
+        ranges.append((start, offset - start))
+    return ranges
+
+# Whether a record read at a carved signature looks real rather than bytes that happen
+# to start with one: it fits in the data and its versions, methods and counts are in range
+def plausible_record(record, size):
+    if isinstance(record, LocalFileHeader):
+        return (record.data_offset <= size and len(record.file_name) > 0
+                and record.version_needed & 0xFF <= MAX_VERSION_NEEDED
+                and record.compression_method in KNOWN_COMPRESSION_METHODS)
+    if record.offset + record_size(record) > size:
+        return False
+    if isinstance(record, CentralDirectoryHeader):
+        return (len(record.file_name) > 0 and record.version_needed & 0xFF <= MAX_VERSION_NEEDED
+                and record.compression_method in KNOWN_COMPRESSION_METHODS)
+    if isinstance(record, (EndOfCentralDirectory, Zip64EndOfCentralDirectory)):
+        return record.cd_entries_this_disk <= record.cd_entries_total and record.cd_size <= size
+    return record.zip64_eocd_disk <= record.total_disks <= ZIP64_COUNT_LIMIT
+
+# Yield every plausible record at a PK signature, skipping damaged or unknown bytes.
+# File data is skipped when its size lands on the next record, so archives stored
+# inside an entry are not carved as records of the outer one.
+def carve_zip_records(data, offset=0):
+    size = len(data)
+    offset = find_next_signature(data, offset)
+    while offset != -1:
+        record = RECORD_READERS[data[offset:offset + 4]](data, offset)
+        if record is None or not plausible_record(record, size):
+            offset = find_next_signature(data, offset + 1)
+            continue
+        yield record
+        if isinstance(record, LocalFileHeader):
+            offset = record.data_offset
+            end = offset + resolve_zip64(record).compressed_size
+            if end == size or data[end:end + 4] in WALK_SIGNATURES or data[end:end + 4] == DATA_DESCRIPTOR_SIGNATURE:
+                offset = end
+        else:
+            offset += record_size(record)
+        offset = find_next_signature(data, offset)
+
+# Read the central directory from the EOCD record and seek straight to each local header.
+# Yields the same records in the same order as iter_zip_records for a well-formed archive.
+# Callers that already parsed the directory pass its location and local header offsets.
+def seek_zip_records(data, location=None, local_header_offsets=None):
+    if local_header_offsets is None:
+        location = locate_central_directory(data)
+        local_header_offsets = []
+        if location is not None:
+            for entry in iter_central_directory(data, location):
+                if isinstance(entry, UnknownRecord):
+                    location = None
+                    break
+                local_header_offsets.append(location.base + resolve_zip64(entry).local_header_offset)
+    if location is None:
+        yield from carve_zip_records(data)
+        return
+
+    for offset in sorted(local_header_offsets):
+        signature = data[offset:offset + 4]
+        record = None
+        if signature == LOCAL_FILE_HEADER_SIGNATURE:
+            record = read_local_file_header(data, offset)
+        yield record if record is not None else UnknownRecord(offset, signature)
+
+    # Second pass over the directory, so memory stays at one offset per entry
+    yield from iter_central_directory(data, location)
+    if location.zip64_eocd is not None:
+        yield location.zip64_eocd
+    if location.zip64_locator is not None:
+        yield location.zip64_locator
+    yield location.eocd